@@ -0,0 +1,179 @@
+"""
+Device-clock to host-clock alignment for spectrometer scans
+
+AVS_GetScopeData reports when the last pixel of a scan reached the
+spectrometer's microcontroller, as a 32-bit tick counter in 10 us units
+(it wraps after ~11.9 h). The host only sees the scan later, after USB and
+callback latency that varies from scan to scan. ClockAligner fits
+
+    host_monotonic = intercept + slope * device_seconds
+
+online with exponentially weighted least squares, so slow crystal drift is
+tracked, and rejects points whose latency is far outside the recent spread.
+The fitted line is then shifted down to the lowest recent residual (the
+minimum-latency envelope), which is the best estimate of when the scan really
+ended (less fixed_latency, the part of the delay no timing data can reveal,
+if it is known). Host monotonic times convert to wall-clock time through one offset
+that is refreshed occasionally rather than per scan.
+
+    aligner = ClockAligner()
+    t_mono = aligner.update(timelabel)       # in the scan callback
+    when = aligner.to_datetime(timelabel)
+"""
+import time
+import math
+import datetime
+from collections import deque
+
+TICK_SECONDS = 10e-6
+
+
+class ClockAligner:
+    """Online linear fit of device ticks to time.monotonic() with drift tracking"""
+
+    def __init__(self, tick_seconds: float = TICK_SECONDS, wrap_bits: int = 32,
+                 forgetting: float = 0.995, reject_sigma: float = 4.0,
+                 min_tolerance: float = 0.5e-3, floor_window: int = 64,
+                 wall_refresh_s: float = 60.0, fixed_latency: float = 0.0):
+        self.tick_seconds = tick_seconds
+        self.wrap = 1 << wrap_bits
+        self.forgetting = forgetting
+        self.reject_sigma = reject_sigma
+        self.min_tolerance = min_tolerance
+        self.floor_window = floor_window
+        self.wall_refresh_s = wall_refresh_s
+        self.fixed_latency = fixed_latency
+        self.reset()
+
+    def reset(self):
+        """Forget the fit (device restarted or reconnected)"""
+        self._last_raw = None
+        self._wraps = 0
+        self._x0 = None
+        self._y0 = None
+        # Exponentially weighted sums for the regression
+        self._sw = self._sx = self._sy = self._sxx = self._sxy = 0.0
+        self.slope = 1.0
+        self.intercept = 0.0
+        self._var = 0.0
+        self._floor = deque(maxlen=self.floor_window)
+        self._outlier_run = 0
+        self.samples = 0
+        self.rejected = 0
+        self._wall_offset = None
+        self._wall_refreshed = None
+
+    # -------------  Tick handling  -------------------------------------
+
+    def _unwrap(self, raw: int) -> int:
+        """Extend the wrapping counter to a monotonically increasing tick count"""
+        raw = int(raw) % self.wrap
+        if self._last_raw is not None and raw < self._last_raw:
+            if self._last_raw - raw > self.wrap // 2:
+                self._wraps += 1
+            else:
+                # Counter went backwards by less than half a wrap: the device restarted
+                self.reset()
+        self._last_raw = raw
+        return self._wraps * self.wrap + raw
+
+    def _device_seconds(self, raw: int) -> float:
+        return self._unwrap(raw) * self.tick_seconds
+
+    # -------------  Fit  -----------------------------------------------
+
+    def _predict(self, x: float) -> float:
+        """Fitted host monotonic time for device seconds x (relative to the first sample)"""
+        return self._y0 + self.intercept + self.slope * (x - self._x0)
+
+    def _solve(self):
+        det = self._sw * self._sxx - self._sx * self._sx
+        if self._sw > 0 and det > 1e-12 * max(self._sw * self._sxx, 1e-300):
+            self.slope = (self._sw * self._sxy - self._sx * self._sy) / det
+            self.intercept = (self._sy - self.slope * self._sx) / self._sw
+        elif self._sw > 0:
+            self.slope = 1.0
+            self.intercept = (self._sy - self._sx) / self._sw
+
+    @property
+    def sigma(self) -> float:
+        """Recent spread of accepted residuals (s)"""
+        return math.sqrt(self._var)
+
+    @property
+    def drift_ppm(self) -> float:
+        """Device clock rate relative to the host clock, in parts per million"""
+        return (self.slope - 1.0) * 1e6
+
+    def update(self, raw_ticks: int, host_mono: float = None) -> float:
+        """
+        Add one observation (device ticks, host monotonic arrival time) and
+        return the aligned host monotonic time of the scan end.
+        """
+        if host_mono is None:
+            host_mono = time.monotonic()
+        x = self._device_seconds(raw_ticks)
+        if self._x0 is None:
+            self._x0, self._y0 = x, host_mono
+        dx, dy = x - self._x0, host_mono - self._y0
+
+        if self.samples >= 5:
+            residual = host_mono - self._predict(x)
+            tolerance = max(self.reject_sigma * self.sigma, self.min_tolerance)
+            if abs(residual) > tolerance:
+                self.rejected += 1
+                self._outlier_run += 1
+                # A long run of outliers means the relation itself changed: start over
+                if self._outlier_run >= 5:
+                    self.reset()
+                    return self.update(raw_ticks, host_mono)
+                return self._aligned(x)
+            self._var = self.forgetting * self._var + (1 - self.forgetting) * residual * residual
+        self._outlier_run = 0
+
+        lam = self.forgetting
+        self._sw = lam * self._sw + 1.0
+        self._sx = lam * self._sx + dx
+        self._sy = lam * self._sy + dy
+        self._sxx = lam * self._sxx + dx * dx
+        self._sxy = lam * self._sxy + dx * dy
+        self._solve()
+        self.samples += 1
+        self._floor.append(dy - (self.intercept + self.slope * dx))
+        return self._aligned(x)
+
+    # -------------  Conversion  ----------------------------------------
+
+    def _aligned(self, x: float) -> float:
+        """Point on the minimum-latency line for device seconds x"""
+        floor = min(self._floor) if self._floor else 0.0
+        return self._predict(x) + floor - self.fixed_latency
+
+    def to_mono(self, raw_ticks: int) -> float:
+        """Host monotonic time of a recent device tick value (does not update the fit)"""
+        if self._x0 is None:
+            return time.monotonic()
+        raw = int(raw_ticks) % self.wrap
+        ticks = self._wraps * self.wrap + raw
+        if raw - self._last_raw > self.wrap // 2:
+            ticks -= self.wrap  # value from just before the last wrap
+        return self._aligned(ticks * self.tick_seconds)
+
+    def wall_offset(self) -> float:
+        """time.time() - time.monotonic(), refreshed every wall_refresh_s"""
+        now = time.monotonic()
+        if self._wall_refreshed is None or now - self._wall_refreshed >= self.wall_refresh_s:
+            self._wall_offset = time.time() - time.monotonic()
+            self._wall_refreshed = now
+        return self._wall_offset
+
+    def mono_to_epoch(self, t_mono: float) -> float:
+        return t_mono + self.wall_offset()
+
+    def to_epoch(self, raw_ticks: int) -> float:
+        """UNIX time (UTC seconds) of a device tick value"""
+        return self.mono_to_epoch(self.to_mono(raw_ticks))
+
+    def to_datetime(self, raw_ticks: int) -> datetime.datetime:
+        """Local naive datetime, like datetime.now(), of a device tick value"""
+        return datetime.datetime.fromtimestamp(self.to_epoch(raw_ticks))
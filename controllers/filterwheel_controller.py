@@ -4,9 +4,11 @@ from PyQt5.QtCore import QObject, pyqtSignal
 from PyQt5.QtWidgets import QGroupBox, QHBoxLayout, QVBoxLayout, QLabel, QComboBox, QLineEdit, QPushButton
 
 from drivers.filterwheel import FilterWheelConnectThread, FilterWheelCommandThread
+import telemetry
 
 class FilterWheelController(QObject):
     status_signal = pyqtSignal(str)
+    position_signal = pyqtSignal(object)  # position after each command (None if it failed)
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -131,9 +133,9 @@ class FilterWheelController(QObject):
         """Set filter wheel to a specific position (1-6)"""
         if position < 1 or position > 6:
             self.status_signal.emit(f"Invalid position: {position}")
-            return
+            return False
         cmd = f"F1{position}"
-        self._send(cmd)
+        return self._send(cmd)
 
     def send(self):
         cmd = self.cmd_input.text().strip()
@@ -141,7 +143,8 @@ class FilterWheelController(QObject):
 
     def _send(self, cmd):
         if not self._connected:
-            return self.status_signal.emit("Not connected")
+            self.status_signal.emit("Not connected")
+            return False
         self.send_btn.setEnabled(False)
         self.open_btn.setEnabled(False)
         self.opaque_btn.setEnabled(False)
@@ -150,6 +153,7 @@ class FilterWheelController(QObject):
         th = FilterWheelCommandThread(self.serial, cmd, parent=self)
         th.result_signal.connect(self._on_result)
         th.start()
+        return True
 
     def _on_result(self, pos, msg):
         self.send_btn.setEnabled(True)
@@ -158,25 +162,22 @@ class FilterWheelController(QObject):
         self.diff_btn.setEnabled(True)
         self.status_signal.emit(msg)
 
-        if self.last:
+        new_pos = None
+        if self.last and pos is not None:
             if self.last == "F1r":
-                self.pos_label.setText("1")
                 self.current_position = 1
             elif self.last.startswith("F1") and len(self.last) == 3 and self.last[2].isdigit():
-                position = int(self.last[2])
-                self.pos_label.setText(str(position))
-                self.current_position = position
-            else:
-                if pos is not None:
-                    self.pos_label.setText(str(pos))
-                    self.current_position = pos
+                self.current_position = int(self.last[2])
+            elif pos is not None:
+                self.current_position = pos
+            if self.current_position is not None:
+                telemetry.store.publish("filter.position", self.current_position)
+                new_pos = self.current_position
         self.last = None
+        self.position_signal.emit(new_pos)
 
     def get_position(self):
-        try:
-            return int(self.pos_label.text())
-        except:
-            return self.current_position or 0
+        return telemetry.store.get("filter.position", self.current_position or 0)
 
     def is_connected(self):
         return self._connected
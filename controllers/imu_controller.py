@@ -7,6 +7,7 @@ from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 import matplotlib.pyplot as plt
 
 from drivers.imu import start_imu_read_thread
+import telemetry
 import utils
 
 class IMUController(QObject):
@@ -101,11 +102,12 @@ class IMUController(QObject):
                     Qt.KeepAspectRatio, Qt.SmoothTransformation))
 
     def _refresh(self):
-        r, p, y = self.latest['rpy']
-        lat = self.latest['latitude']
-        lon = self.latest['longitude']
-        t = self.latest['temperature']
-        pres = self.latest['pressure']
+        tm = telemetry.store
+        r, p, y = tm.get("imu.roll_deg", 0), tm.get("imu.pitch_deg", 0), tm.get("imu.yaw_deg", 0)
+        lat = tm.get("imu.latitude_deg", 0)
+        lon = tm.get("imu.longitude_deg", 0)
+        t = tm.get("imu.temperature_C", 0)
+        pres = tm.get("imu.pressure_hPa", 0)
         
         # Format the data with larger text and better formatting
         self.data_label.setText(
@@ -1,11 +1,20 @@
+import os
+import time
+from functools import partial
 from PyQt5.QtCore import QObject, pyqtSignal
 from PyQt5.QtWidgets import QGroupBox, QLabel, QComboBox, QPushButton, QLineEdit, QGridLayout, QHBoxLayout
 from serial.tools import list_ports
 
-from drivers.motor import MotorConnectThread, send_move_command
+from drivers.motor import MotorConnectThread, MotorMoveThread, MotorAxis, SlaveID, STEPS_PER_DEG
+from drivers.modbus_bus import ModbusBus
+from drivers.link_cache import LinkCache
+import telemetry
+
 
 class MotorController(QObject):
     status_signal = pyqtSignal(str)
+    arrived_signal = pyqtSignal(bool, object)  # (in position, actual angle in degrees or None) after each move
+    axis_arrived_signal = pyqtSignal(str, bool, object)  # (axis, in position, actual angle or None), every axis
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -54,11 +63,23 @@ class MotorController(QObject):
 
         self.groupbox.setLayout(layout)
         self._connected = False
-        self.serial = None
+        self.bus = None
+        # Axis name -> Modbus slave ID, all on the motor port; the first is the one the GUI and routines move
+        self.axis_slaves = {"azimuth": SlaveID}
+        self.axes = {}
+        self._move_threads = {}
+        self._move_started = {}
+        # Below the routine's 30 s motor timeout, so a stuck move fails with a reason
+        self.move_timeout_s = 25.0
+        # Last-good baud/parity per port, probed first on every connect
+        cache_file = getattr(parent, 'config', {}).get("motor_link_cache", "logs/motor_links.json")
+        self.link_cache = LinkCache(os.path.join(os.path.dirname(__file__), "..", cache_file))
 
         # If configured port is provided, auto-connect
         if parent is not None and hasattr(parent, 'config'):
             cfg_port = parent.config.get("motor")
+            self.move_timeout_s = parent.config.get("motor_move_timeout_s", self.move_timeout_s)
+            self.axis_slaves = dict(parent.config.get("motor_axes", self.axis_slaves))
             if cfg_port:
                 self.port = cfg_port
                 self.connect()
@@ -70,21 +91,31 @@ class MotorController(QObject):
             return
         
         self.connect_btn.setEnabled(False)
-        self.status_signal.emit(f"Connecting to motor controller on {self.port}...")
+        if self.bus is not None:
+            # Reconnect: release the port so the probe can open it again
+            self.shutdown()
+            self.move_btn.setEnabled(False)
+            self.status_signal.emit(f"Reconnecting to motor controller on {self.port}...")
+        else:
+            self.status_signal.emit(f"Connecting to motor controller on {self.port}...")
         
-        thread = MotorConnectThread(self.port, parent=self)
+        thread = MotorConnectThread(self.port, parent=self, cache=self.link_cache,
+                                    slave=next(iter(self.axis_slaves.values())))
         thread.result_signal.connect(self._on_connect)
         thread.start()
 
-    def _on_connect(self, ser, baud, msg):
+    def _on_connect(self, client, baud, msg):
         self.connect_btn.setEnabled(True)
         self.status_signal.emit(msg)
-        if ser:
-            self.serial = ser
+        if client:
+            # One bus owns the port; every axis queues its transactions on it
+            self.bus = ModbusBus(client)
+            self.axes = {name: MotorAxis(self.bus, slave, name) for name, slave in self.axis_slaves.items()}
             self._connected = True
             self.move_btn.setEnabled(True)
             # Move to 0 degrees on successful connection
-            self.move_to(0)
+            for name in self.axes:
+                self.move_to(0, name)
         else:
             self._connected = False
             self.move_btn.setEnabled(False)
@@ -103,28 +134,103 @@ class MotorController(QObject):
         except ValueError:
             self.status_signal.emit("Invalid angle")
 
-    def move_to(self, angle):
-        """Move to the specified angle"""
-        if not self._connected:
+    def move_to(self, angle, axis=None):
+        """
+        Start a move of axis (default: the primary axis) to the specified
+        angle; returns True if it was started. arrived_signal reports when
+        the encoder shows the primary axis in position, axis_arrived_signal
+        does so for every axis.
+        """
+        name = axis or self.primary_axis
+        if not self._connected or not self.bus:
             self.status_signal.emit("Motor not connected")
-            return
+            return False
+        if name not in self.axes:
+            self.status_signal.emit(f"Unknown motor axis '{name}'")
+            return False
         
-        ok = False
-        if self.serial:
-            # Convert angle to motor steps (100 steps per degree)
-            motor_angle = angle * 100
-            ok = send_move_command(self.serial, motor_angle)
-            if ok:
-                # Update the current angle attribute when move is successful
+        # A new target replaces the move in progress (the driver retargets directly)
+        previous = self._move_threads.pop(name, None)
+        if previous is not None:
+            previous.stop()
+            previous.wait()
+        
+        # Convert angle to motor steps (100 steps per degree)
+        motor_angle = int(round(angle * STEPS_PER_DEG))
+        thread = MotorMoveThread(self.axes[name], motor_angle, self.move_timeout_s, parent=self)
+        thread.position_signal.connect(partial(self._on_position, name))
+        thread.result_signal.connect(partial(self._on_move_result, name, thread))
+        self._move_threads[name] = thread
+        self._move_started[name] = time.monotonic()
+        prefix = self._channel_prefix(name)
+        telemetry.store.publish_many({f"{prefix}.target_deg": angle, f"{prefix}.moving": 1})
+        thread.start()
+        return True
+
+    def stop(self, axis=None):
+        """Stop axis (default: every axis) ahead of any queued move or poll"""
+        for name in ([axis] if axis else list(self.axes)):
+            thread = self._move_threads.get(name)
+            if thread is not None:
+                thread.stop()
+            # Not waited for: the bus runs it before any queued move or poll
+            self.axes[name].stop().add_done_callback(partial(self._on_stop_done, name))
+
+    def _on_stop_done(self, name, future):
+        # Runs on the bus thread; the signal is delivered to the GUI thread
+        if future.exception() is not None:
+            self.status_signal.emit(f"{self._label(name)} stop failed: {future.exception()}")
+
+    @property
+    def primary_axis(self):
+        return next(iter(self.axis_slaves))
+
+    def _channel_prefix(self, name):
+        """Telemetry prefix: motor.* for the primary axis, motor.<axis>.* for the others"""
+        return "motor" if name == self.primary_axis else f"motor.{name}"
+
+    def _label(self, name):
+        return "Motor" if name == self.primary_axis else f"Motor {name}"
+
+    def _on_position(self, name, steps):
+        telemetry.store.publish(f"{self._channel_prefix(name)}.angle_deg", steps / STEPS_PER_DEG)
+
+    def _on_move_result(self, name, thread, ok, steps, message):
+        if self._move_threads.get(name) is not thread:
+            return  # superseded by a newer move
+        del self._move_threads[name]
+        elapsed = time.monotonic() - self._move_started[name]
+        angle = None if steps is None else steps / STEPS_PER_DEG
+        prefix = self._channel_prefix(name)
+        if angle is not None:
+            if name == self.primary_axis:
+                # Update the current angle attribute with where the encoder says it is
                 self.current_angle_deg = angle
-        self.status_signal.emit(f"Moved to {angle}°" if ok else "No ACK")
+            telemetry.store.publish(f"{prefix}.angle_deg", angle)
+        telemetry.store.publish(f"{prefix}.moving", 0)
+        label = self._label(name)
+        if ok:
+            self.status_signal.emit(f"{label} moved to {angle:g}° in {elapsed:.2f} s")
+        elif angle is not None:
+            self.status_signal.emit(f"{label} move failed at {angle:g}°: {message}")
+        else:
+            self.status_signal.emit(f"{label} move failed: {message}")
+        self.axis_arrived_signal.emit(name, ok, angle)
+        if name == self.primary_axis:
+            self.arrived_signal.emit(ok, angle)
 
     def is_connected(self):
         return self._connected
 
-
-
-
-
-
-
+    def shutdown(self):
+        """Stop following moves in progress and release the port"""
+        for thread in self._move_threads.values():
+            thread.stop()
+        for thread in self._move_threads.values():
+            thread.wait(2000)
+        self._move_threads.clear()
+        if self.bus is not None:
+            self.bus.close()
+            self.bus = None
+        self.axes = {}
+        self._connected = False
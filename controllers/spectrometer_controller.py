@@ -1,4 +1,5 @@
 import os
+import time
 import numpy as np
 import datetime
 from PyQt5.QtCore import QObject, pyqtSignal, QTimer
@@ -9,10 +10,14 @@ from PyQt5.QtWidgets import (
 import pyqtgraph as pg
 from pyqtgraph import ViewBox
 
+import telemetry
+from clock_sync import ClockAligner
 from drivers.spectrometer import connect_spectrometer, AVS_MeasureCallback, AVS_MeasureCallbackFunc, AVS_GetScopeData, StopMeasureThread, prepare_measurement
 
 class SpectrometerController(QObject):
     status_signal = pyqtSignal(str)
+    stopped_signal = pyqtSignal()
+    scan_signal = pyqtSignal(int, object, object, object)  # (scan sequence number, timestamp, intensities, telemetry snapshot)
 
     def __init__(self, parent=None, auto_connect=True):
         super().__init__(parent)
@@ -149,6 +154,8 @@ class SpectrometerController(QObject):
         self.data = None
         self.cb = None
         self.intens = []  # Initialize intens attribute
+        self.scan_seq = 0  # Incremented once per scan delivered by the driver
+        self.clock = ClockAligner()  # Maps the device tick counter to host time
         
         # Set the layout
         self.groupbox.setLayout(main_layout)
@@ -182,6 +189,7 @@ class SpectrometerController(QObject):
         # Store wavelength calibration and number of pixels
         self.wls = wavelengths.tolist() if isinstance(wavelengths, np.ndarray) else wavelengths
         self.npix = num_pixels
+        self.clock.reset()
         self._ready = True
         # Enable measurement start once connected
         self.start_btn.setEnabled(True)
@@ -190,7 +198,7 @@ class SpectrometerController(QObject):
     def start(self):
         if not self._ready:
             self.status_signal.emit("Spectrometer not ready")
-            return
+            return False
         
         # Get integration time from UI
         integration_time = float(self.integ_spinbox.value())
@@ -211,8 +219,10 @@ class SpectrometerController(QObject):
         else:
             averages = 1   # No averaging for long integration times
         
-        # Store current integration time for data saving
+        # Store current integration time and averaging for data saving
         self.current_integration_time_us = integration_time
+        self.current_averages = averages
+        telemetry.store.publish_many({"spec.integration_time_ms": integration_time, "spec.averages": averages})
         
         # Update status with current settings
         self.status_signal.emit(f"Starting measurement (Int: {integration_time}ms, Avg: {averages}, Cycles: {cycles}, Rep: {repetitions})")
@@ -224,24 +234,29 @@ class SpectrometerController(QObject):
                                   repetitions=repetitions)
         if code != 0:
             self.status_signal.emit(f"Prepare error: {code}")
-            return
+            return False
         self.measure_active = True
         self.cb = AVS_MeasureCallbackFunc(self._cb)
         err = AVS_MeasureCallback(self.handle, self.cb, -1)
         if err != 0:
             self.status_signal.emit(f"Callback error: {err}")
             self.measure_active = False
-            return
+            return False
         self.start_btn.setEnabled(False)
         self.stop_btn.setEnabled(True)
         self.apply_btn.setEnabled(True)  # Enable the apply button when measurement starts
         self.status_signal.emit("Measurement started")
+        return True
 
     def _cb(self, p_data, p_user):
         # Spectrometer driver callback (on new scan)
         status_code = p_user[0]
         if status_code == 0:
-            _, data = AVS_GetScopeData(self.handle)
+            arrival = time.monotonic()
+            timelabel, data = AVS_GetScopeData(self.handle)
+            # Acquisition end on the host clock, from the device tick counter
+            acq_end = self.clock.update(int(getattr(timelabel, "value", timelabel)), arrival)
+            timestamp = datetime.datetime.fromtimestamp(self.clock.mono_to_epoch(acq_end))
             # Ensure intensities list has correct length (up to 2048)
             max_pixels = min(2048, self.npix)
             full = [0.0] * max_pixels
@@ -250,6 +265,13 @@ class SpectrometerController(QObject):
             full[:len(data_to_use)] = data_to_use
             self.intens = full
             
+            # Hand the scan to listeners (data logger) exactly once, tagged with its sequence
+            # number and the housekeeping telemetry as it stood when the scan arrived
+            self.scan_seq += 1
+            telemetry.store.publish("spec.scan_seq", self.scan_seq, t_mono=acq_end)
+            self.scan_signal.emit(self.scan_seq, timestamp, np.array(full),
+                                  telemetry.store.snapshot())
+            
             # Make sure integration time is accessible to MainWindow
             if hasattr(self, 'current_integration_time_us'):
                 # Make it accessible to parent (MainWindow)
@@ -345,6 +367,7 @@ class SpectrometerController(QObject):
         self.stop_btn.setEnabled(False)
         self.apply_btn.setEnabled(False)  # Disable the apply button when measurement stops
         self.status_signal.emit("Measurement stopped")
+        self.stopped_signal.emit()
 
     def save(self):
         ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -354,10 +377,18 @@ class SpectrometerController(QObject):
                 f.write("Wavelength (nm),Intensity\n")
                 for wl, inten in zip(self.wls, self.intens):
                     if inten != 0:
-                        f.write(f"{wl:.4f},{inten:.4f}\n")
+                        f.write(f"{wl:.4f},{self._format_counts(inten)}\n")
             self.status_signal.emit(f"Saved snapshot to {path}")
+            return True
         except Exception as e:
             self.status_signal.emit(f"Save error: {e}")
+            return False
+
+    def _format_counts(self, value):
+        """Write integral ADC counts as integers, averaged values with decimals"""
+        if float(value).is_integer():
+            return str(int(value))
+        return f"{value:.4f}"
 
     def toggle(self):
         # This method is overridden by MainWindow if parent is provided.
@@ -387,8 +418,9 @@ class SpectrometerController(QObject):
         else:
             averages = 1
         
-        # Store current integration time for data saving
+        # Store current integration time and averaging for data saving
         self.current_integration_time_us = integration_time 
+        self.current_averages = averages
         
         if hasattr(self, 'measure_active') and self.measure_active:
             # First stop the current measurement
@@ -400,6 +432,7 @@ class SpectrometerController(QObject):
             th.finished_signal.connect(lambda: self._apply_new_settings(integration_time, averages, cycles, repetitions))
             th.start()
         else:
+            telemetry.store.publish_many({"spec.integration_time_ms": integration_time, "spec.averages": averages})
             # Just prepare the measurement with new settings
             code = prepare_measurement(self.handle, self.npix, 
                                       integration_time_ms=integration_time, 
@@ -430,6 +463,8 @@ class SpectrometerController(QObject):
             return
         
         self.measure_active = True
+        # Published only now, so scans still in flight from the old settings carry the old values
+        telemetry.store.publish_many({"spec.integration_time_ms": integration_time, "spec.averages": averages})
         self.stop_btn.setEnabled(True)
         self.status_signal.emit(f"Settings updated (Int: {integration_time}ms, Avg: {averages}, Cycles: {cycles}, Rep: {repetitions})")
 
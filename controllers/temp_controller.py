@@ -1,11 +1,18 @@
+import os
+import time
+import datetime
 from PyQt5.QtCore import QObject, pyqtSignal, QTimer
 from PyQt5.QtWidgets import QGroupBox, QGridLayout, QLabel, QLineEdit, QPushButton, QComboBox, QDoubleSpinBox, QHBoxLayout
 from serial.tools import list_ports
 
-from drivers.tc36_25_driver import TC36_25
+from drivers.tc36_poller import TC36PollerThread
+from controllers.temp_stability import StabilityWindow
+from controllers.temp_history import TemperatureHistory
+import telemetry
 
 class TempController(QObject):
     status_signal = pyqtSignal(str)
+    command_signal = pyqtSignal(str, bool, object)  # (command, ok, queued value) after each setpoint/power command
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -79,6 +86,23 @@ class TempController(QObject):
         
         self.groupbox.setLayout(layout)
 
+        # Serial I/O runs in the poller thread (drivers.tc36_poller), never here
+        self.poller = None
+        self._connected = False
+        # Pending wait_stable(): (window, tolerance, started, callback), fed by _on_reading
+        self._stable_wait = None
+        self._stable_timer = QTimer(self)
+        self._stable_timer.setSingleShot(True)
+        self._stable_timer.timeout.connect(self._stable_wait_timeout)
+        self.last_settle_s = None
+        # Every reading (decimated to record_interval_s) and step-response metrics
+        self.log_config = dict(getattr(parent, 'config', {}).get("temperature_log", {}))
+        self.history = TemperatureHistory(
+            history_s=self.log_config.get("history_s", 7200),
+            record_interval_s=self.log_config.get("record_interval_s", 1.0),
+            tolerance=self.log_config.get("settle_tolerance_C", 0.1),
+            settle_window_s=self.log_config.get("settle_window_s", 30))
+
         # Auto-select config port if provided
         if parent is not None and hasattr(parent, 'config'):
             cfg_port = parent.config.get("temp_controller")
@@ -88,7 +112,7 @@ class TempController(QObject):
 
     def set_preset_temp(self, temp):
         """Set temperature to a preset value (kept for backward compatibility)"""
-        if not hasattr(self, 'tc'):
+        if not self._connected:
             self.status_signal.emit("Temperature controller not connected")
             return
         
@@ -96,78 +120,114 @@ class TempController(QObject):
         self.set_temp()
 
     def set_temp(self):
-        """Set the temperature setpoint"""
-        try:
-            t = self.setpoint_spin.value()
-            self.tc.set_setpoint(t)
-            self.status_signal.emit(f"Temperature setpoint set to {t:.1f}°C")
-        except Exception as e:
-            self.status_signal.emit(f"Failed to set temperature: {e}")
+        """Queue the setpoint from the spin box; _on_result reports the outcome"""
+        t = self.setpoint_spin.value()
+        self.poller.set_setpoint(t)
+        self.status_signal.emit(f"Setting temperature setpoint to {t:.1f}°C")
+
+    def _on_reading(self, reading):
+        """Display and publish one TempReading from the poller thread"""
+        self.temp_display.setText(f"{reading.temp_C:.2f} °C")
+        self.aux_temp_display.setText(f"{reading.aux_C:.2f} °C")
+        # Store auxiliary temperature for data logging
+        self._aux_temperature = reading.aux_C
+        telemetry.store.publish_many({
+            "temp.current_C": reading.temp_C,
+            "temp.aux_C": reading.aux_C,
+            "temp.setpoint_C": reading.setpoint_C,
+        }, reading.t_mono)
+        for line in self.history.add(reading.t_mono, reading.temp_C, reading.aux_C, reading.setpoint_C):
+            self.status_signal.emit(line)
+        if self._stable_wait is not None:
+            self._check_stable(reading)
+
+    def wait_stable(self, tolerance, window_s, timeout_s, callback):
+        """
+        Call callback(ok, message) as soon as every reading over the last
+        window_s seconds is within tolerance of the setpoint and not drifting,
+        or with ok=False after timeout_s. Only readings taken after this call count.
+        """
+        if not self._connected:
+            self.status_signal.emit("Temperature controller not connected")
+            return False
+        if self._stable_wait is not None:
+            self._finish_stable_wait(False, "superseded by a new wait")
+        self._stable_wait = (StabilityWindow(window_s), tolerance, time.monotonic(), callback)
+        self._stable_timer.start(int(timeout_s * 1000))
+        self.status_signal.emit(f"Waiting for temperature to hold within ±{tolerance:g} °C for {window_s:g} s")
+        return True
+
+    def _check_stable(self, reading):
+        window, tolerance, started, _ = self._stable_wait
+        if reading.t_mono < started:
+            return
+        window.add(reading.t_mono, reading.temp_C)
+        if window.is_stable(reading.setpoint_C, tolerance):
+            self.last_settle_s = reading.t_mono - started
+            self._finish_stable_wait(True, f"Temperature stable at {reading.setpoint_C:.2f} °C "
+                                           f"(±{tolerance:g}) after {self.last_settle_s:.1f} s")
+
+    def _stable_wait_timeout(self):
+        if self._stable_wait is None:
+            return
+        window, tolerance, started, _ = self._stable_wait
+        setpoint = telemetry.store.get("temp.setpoint_C")
+        if not len(window):
+            detail = "no readings"
+        else:
+            detail = (f"off by up to {window.deviation(setpoint):.2f} °C, "
+                      f"drifting {window.slope * 60:+.2f} °C/min")
+        self._finish_stable_wait(False, f"Temperature not stable after {time.monotonic() - started:.0f} s ({detail})")
+
+    def _finish_stable_wait(self, ok, message):
+        callback = self._stable_wait[3]
+        self._stable_wait = None
+        self._stable_timer.stop()
+        self.status_signal.emit(message)
+        callback(ok, message)
 
-    def _upd(self):
-        """Update the current temperature display with timeout protection"""
+    def temperature_window(self, t0, t1):
+        """Recorded readings between two time.monotonic() times (numpy records t/temp/aux/setpoint)"""
+        return self.history.ring.window(t0, t1)
+
+    def save_history(self, path=None):
+        """Write the recorded temperature history (.npz) next to the logs; returns the path"""
+        if not len(self.history.ring):
+            return None
+        if path is None:
+            log_dir = os.path.join(os.path.dirname(__file__), "..", "logs")
+            os.makedirs(log_dir, exist_ok=True)
+            ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            path = os.path.join(log_dir, f"temperature_history_{ts}.npz")
         try:
-            # Set a timeout for temperature reading
-            if not hasattr(self, '_temp_read_timer') or self._temp_read_timer is None:
-                from threading import Timer
-                self._temp_read_timer = Timer(0.5, self._timeout_temp_read)
-                self._temp_read_timer.daemon = True
-                self._temp_read_timer.start()
-                
-            # Read primary temperature
-            current = self.tc.get_temperature()
-            
-            # Read auxiliary temperature
-            try:
-                aux_temp = self.tc.get_auxiliary_temperature()
-                self.aux_temp_display.setText(f"{aux_temp:.2f} °C")
-                # Store auxiliary temperature for data logging
-                self._aux_temperature = aux_temp
-            except Exception as e:
-                self.aux_temp_display.setText("-- °C")
-                self._aux_temperature = 0.0
-                # Only log error if it's not a timeout
-                if not hasattr(self, '_temp_read_timeout') or not self._temp_read_timeout:
-                    self.status_signal.emit(f"Auxiliary temperature read error: {e}")
-            
-            # Cancel timeout timer if successful
-            if hasattr(self, '_temp_read_timer') and self._temp_read_timer is not None:
-                try:
-                    if self._temp_read_timer.is_alive():
-                        self._temp_read_timer.cancel()
-                except Exception:
-                    # If there's any issue with the timer, just create a new one next time
-                    pass
-                self._temp_read_timer = None
-            
-            self.temp_display.setText(f"{current:.2f} °C")
-            
-            # Reset timeout flag if successful
-            if hasattr(self, '_temp_read_timeout'):
-                self._temp_read_timeout = False
-            
-        except Exception as e:
-            self.temp_display.setText("-- °C")
-            self.aux_temp_display.setText("-- °C")
-            # Only show error message if it's not a timeout
-            if not hasattr(self, '_temp_read_timeout') or not self._temp_read_timeout:
-                self.status_signal.emit(f"Temperature read error: {e}")
-
-    def _timeout_temp_read(self):
-        """Called when temperature reading times out"""
-        self._temp_read_timeout = True
+            self.history.ring.save(path)
+        except OSError as e:
+            self.status_signal.emit(f"Could not save temperature history: {e}")
+            return None
+        return path
+
+    def _on_read_failed(self, message):
         self.temp_display.setText("-- °C")
-        self.status_signal.emit("Temperature read timed out")
-        self._temp_read_timer = None
+        self.aux_temp_display.setText("-- °C")
+        self._aux_temperature = 0.0
+
+    def _on_result(self, command, ok, message, value):
+        """A queued setpoint/power command finished in the poller thread"""
+        if command == "setpoint" and ok:
+            # The value that was sent, not whatever the spin box shows by now
+            t = value
+            telemetry.store.publish("temp.setpoint_C", t)
+            self.status_signal.emit(f"Temperature setpoint set to {t:.1f}°C")
+        elif command == "power off" and ok:
+            self.status_signal.emit("Temperature controller turned off")
+        elif not ok:
+            self.status_signal.emit(f"Temperature controller {command} failed: {message}")
+        self.command_signal.emit(command, ok, value)
 
     @property
     def current_temp(self):
         # Current temperature reading from controller
-        try:
-            text = self.temp_display.text()
-            return float(text.split()[0])
-        except:
-            return 0.0
+        return telemetry.store.get("temp.current_C", 0.0)
 
     @property
     def setpoint(self):
@@ -189,67 +249,79 @@ class TempController(QObject):
 
     def is_connected(self):
         """Check if temperature controller is connected"""
-        return hasattr(self, 'tc')
+        return self._connected
 
     def connect(self):
-        """Connect to the temperature controller"""
+        """Start the poller thread, which opens the controller and reads it periodically"""
         if not hasattr(self, 'port') or not self.port:
             self.status_signal.emit("No port specified for temperature controller")
             return
+        if self.poller is not None:
+            return
         
         self.status_signal.emit(f"Connecting to temperature controller on {self.port}...")
+        self.connect_btn.setEnabled(False)
         
-        try:
-            self.tc = TC36_25(self.port)
-            # Once connected, enable computer control and turn on power
-            self.tc.enable_computer_setpoint()
-            self.tc.power(True)
-            
-            # Enable the setpoint control
-            self.setpoint_spin.setEnabled(True)
-            self.set_btn.setEnabled(True)
-            
-            # Update status indicator
+        # Whole-frame writes unless the config asks for per-character pacing
+        config = getattr(self.parent(), 'config', {})
+        self.poller = TC36PollerThread(self.port,
+                                       interval_s=self.log_config.get("poll_interval_s", 1.0),
+                                       io_timeout_s=config.get("temp_io_timeout_s", 0.5),
+                                       char_delay=config.get("temp_controller_char_delay_s", 0.0),
+                                       parent=self)
+        self.poller.connected_signal.connect(self._on_connected)
+        self.poller.reading_signal.connect(self._on_reading)
+        self.poller.read_failed_signal.connect(self._on_read_failed)
+        self.poller.result_signal.connect(self._on_result)
+        self.poller.status_signal.connect(self.status_signal)
+        self.poller.start()
+        return True
+
+    def _on_connected(self, ok, message):
+        self.status_signal.emit(message)
+        self.connect_btn.setEnabled(True)
+        self._connected = ok
+        # Enable the setpoint control
+        self.setpoint_spin.setEnabled(ok)
+        self.set_btn.setEnabled(ok)
+        if ok:
             self.status_label.setText("Status: Connected")
             self.status_label.setStyleSheet("color: #4CAF50;")  # Green for connected
-            
-            # Start periodic update
-            if not hasattr(self, 'timer') or not self.timer.isActive():
-                self.timer = QTimer(self)
-                self.timer.timeout.connect(self._upd)
-                self.timer.start(1000)
-            
-            self.status_signal.emit(f"Temperature controller connected on {self.port}")
-            return True
-        except Exception as e:
+        else:
             self.status_label.setText("Status: Connection Failed")
-            self.status_signal.emit(f"Temperature controller connection failed: {e}")
-            return False
+            self.poller.wait()
+            self.poller = None
 
     def set_temperature(self, temp):
-        """Set temperature to a specific value (for routine manager)"""
-        if not hasattr(self, 'tc'):
+        """Queue a setpoint (for routine manager); command_signal reports the outcome"""
+        if not self._connected:
             self.status_signal.emit("Temperature controller not connected")
             return False
         
-        try:
-            self.setpoint_spin.setValue(temp)
-            self.set_temp()
-            return True
-        except Exception as e:
-            self.status_signal.emit(f"Failed to set temperature: {e}")
-            return False
+        self.setpoint_spin.setValue(temp)
+        self.set_temp()
+        return True
 
     def disable(self):
-        """Turn off the temperature controller"""
-        if not hasattr(self, 'tc'):
+        """Queue turning the controller output off; command_signal reports the outcome"""
+        if not self._connected:
             self.status_signal.emit("Temperature controller not connected")
             return False
         
-        try:
-            self.tc.power(False)
-            self.status_signal.emit("Temperature controller turned off")
-            return True
-        except Exception as e:
-            self.status_signal.emit(f"Failed to turn off temperature controller: {e}")
-            return False
+        self.poller.power(False)
+        return True
+
+    def shutdown(self):
+        """Stop the poller thread and close the port"""
+        if self._stable_wait is not None:
+            self._finish_stable_wait(False, "temperature controller shut down")
+        if self.history.step is not None:
+            summary = self.history.finish()
+            if summary:
+                self.status_signal.emit(summary)
+        self.save_history()
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller.wait(2000)
+            self.poller = None
+        self._connected = False
@@ -0,0 +1,160 @@
+"""
+Temperature history and control-loop metrics for the TC-36-25
+
+TemperatureRing keeps the last hours of poller readings (primary,
+auxiliary and effective set-point) in one preallocated numpy array of
+20-byte records, so it never grows and appending never allocates. Readings
+are stamped with time.monotonic(), the clock the telemetry snapshots taken
+with every scan use, so a scan's temperature history is window(t0, t1).
+
+StepResponse follows every set-point change and reports how the loop
+answered: overshoot past the new set-point, settling time (until the plate
+stays within tolerance for settle_window_s) and RMS error over the step.
+"""
+import time
+import math
+import numpy as np
+
+TEMP_DTYPE = np.dtype([("t", "f8"), ("temp", "f4"), ("aux", "f4"), ("setpoint", "f4")])
+
+# A set-point change smaller than this (C) is the same set-point read back
+SETPOINT_EPSILON = 0.005
+
+
+class TemperatureRing:
+    """Fixed-capacity ring of (t_mono, temp, aux, setpoint) records"""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(int(capacity), 1)
+        self._data = np.zeros(self.capacity, dtype=TEMP_DTYPE)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, t: float, temp: float, aux: float, setpoint: float):
+        self._data[self._next] = (t, temp, aux, setpoint)
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def latest(self):
+        return self._data[self._next - 1] if self._count else None
+
+    def array(self) -> np.ndarray:
+        """All stored records, oldest first (a copy)"""
+        if self._count < self.capacity:
+            return self._data[:self._count].copy()
+        return np.concatenate((self._data[self._next:], self._data[:self._next]))
+
+    def window(self, t0: float, t1: float) -> np.ndarray:
+        """Records with t0 <= t <= t1, oldest first"""
+        records = self.array()
+        lo = np.searchsorted(records["t"], t0, side="left")
+        hi = np.searchsorted(records["t"], t1, side="right")
+        return records[lo:hi]
+
+    def at(self, t: float):
+        """(temp, aux, setpoint) linearly interpolated at t, or None outside the history"""
+        records = self.array()
+        if not len(records) or not records["t"][0] <= t <= records["t"][-1]:
+            return None
+        return tuple(float(np.interp(t, records["t"], records[name])) for name in ("temp", "aux", "setpoint"))
+
+    def save(self, path: str):
+        """Write the history as .npz; wall_offset + t gives epoch seconds"""
+        np.savez_compressed(path, records=self.array(), wall_offset=time.time() - time.monotonic())
+
+
+class StepResponse:
+    """Overshoot, settling time and RMS error of one set-point change, updated per reading"""
+
+    def __init__(self, t: float, start_temp: float, setpoint: float, tolerance: float, settle_window_s: float):
+        self.t_start = t
+        self.start_temp = start_temp
+        self.setpoint = setpoint
+        self.tolerance = tolerance
+        self.settle_window_s = settle_window_s
+        self.direction = 1 if setpoint >= start_temp else -1
+        self.overshoot = 0.0            # C past the set-point, in the step direction
+        self.settling_time = None       # s from the change until it stayed within tolerance
+        self._inside_since = None
+        self._n = 0
+        self._sq = 0.0
+        self.t_last = t
+
+    @property
+    def step(self) -> float:
+        return abs(self.setpoint - self.start_temp)
+
+    @property
+    def rms_error(self) -> float:
+        return math.sqrt(self._sq / self._n) if self._n else 0.0
+
+    def add(self, t: float, temp: float) -> bool:
+        """Account one reading; True the first time the plate counts as settled"""
+        error = temp - self.setpoint
+        self._n += 1
+        self._sq += error * error
+        self.t_last = t
+        self.overshoot = max(self.overshoot, self.direction * error)
+        if abs(error) > self.tolerance:
+            self._inside_since = None
+            return False
+        if self._inside_since is None:
+            self._inside_since = t
+        if self.settling_time is None and t - self._inside_since >= self.settle_window_s:
+            self.settling_time = self._inside_since - self.t_start
+            return True
+        return False
+
+    def summary(self) -> str:
+        percent = f" ({self.overshoot / self.step * 100:.0f}%)" if self.step > SETPOINT_EPSILON else ""
+        settled = (f"settled in {self.settling_time:.1f} s" if self.settling_time is not None
+                   else f"not settled after {self.t_last - self.t_start:.0f} s")
+        return (f"Setpoint {self.start_temp:.2f} -> {self.setpoint:.2f} °C: overshoot "
+                f"{max(self.overshoot, 0.0):.2f} °C{percent}, {settled}, RMS error {self.rms_error:.3f} °C")
+
+    def to_dict(self) -> dict:
+        return {"t_start": self.t_start, "start_C": self.start_temp, "setpoint_C": self.setpoint,
+                "overshoot_C": max(self.overshoot, 0.0), "settling_time_s": self.settling_time,
+                "rms_error_C": self.rms_error, "duration_s": self.t_last - self.t_start}
+
+
+class TemperatureHistory:
+    """Ring buffer plus step-response metrics, fed one reading at a time"""
+
+    def __init__(self, history_s: float = 7200, record_interval_s: float = 1.0,
+                 tolerance: float = 0.1, settle_window_s: float = 30.0):
+        self.ring = TemperatureRing(math.ceil(history_s / max(record_interval_s, 1e-3)) + 1)
+        self.record_interval_s = record_interval_s
+        self.tolerance = tolerance
+        self.settle_window_s = settle_window_s
+        self.step = None        # StepResponse of the current set-point
+        self.steps = []         # finished StepResponses, oldest first
+        self._last_record = None
+
+    def add(self, t: float, temp: float, aux: float, setpoint: float) -> list:
+        """Record one reading (decimated to record_interval_s); returns report lines"""
+        if self._last_record is None or t - self._last_record >= self.record_interval_s * 0.95:
+            self.ring.append(t, temp, aux, setpoint)
+            self._last_record = t
+
+        reports = []
+        if self.step is None or abs(setpoint - self.step.setpoint) > SETPOINT_EPSILON:
+            if self.step is not None:
+                reports.append(self.finish())
+            self.step = StepResponse(t, temp, setpoint, self.tolerance, self.settle_window_s)
+        if self.step.add(t, temp) and self.step.step > self.tolerance:
+            reports.append(f"Setpoint {self.step.setpoint:.2f} °C reached: settled in "
+                           f"{self.step.settling_time:.1f} s, overshoot {max(self.step.overshoot, 0.0):.2f} °C")
+        return [line for line in reports if line]
+
+    def finish(self):
+        """Close the current step (set-point changed or logging stops); its summary line,
+        or None if the plate was already within tolerance of the set-point"""
+        step, self.step = self.step, None
+        if step is None or step.step <= self.tolerance:
+            return None
+        self.steps.append(step)
+        return step.summary()
@@ -0,0 +1,89 @@
+"""
+Rolling-window stability test for the temperature controller
+
+StabilityWindow keeps the readings of the last window_s seconds with running
+sums for a least-squares slope and monotonic deques for the minimum and
+maximum, so adding a reading and asking "is it stable?" are O(1) amortised.
+The plate counts as stable against a target when the window is full, every
+reading in it is within tolerance of the target and the fitted drift over
+the window is below tolerance too.
+"""
+from collections import deque
+
+
+class StabilityWindow:
+    """Readings (t, value) of the last window_s seconds, with slope and range kept incrementally"""
+
+    def __init__(self, window_s: float):
+        self.window_s = window_s
+        self._samples = deque()
+        self._max = deque()     # values in decreasing order
+        self._min = deque()     # values in increasing order
+        self._origin = None     # time origin for the sums, keeps them well conditioned
+        self._n = 0
+        self._st = self._sv = self._stt = self._stv = 0.0
+
+    def clear(self):
+        self.__init__(self.window_s)
+
+    def add(self, t: float, value: float):
+        if self._origin is None:
+            self._origin = t
+        x = t - self._origin
+        self._samples.append((t, value))
+        self._n += 1
+        self._st += x
+        self._sv += value
+        self._stt += x * x
+        self._stv += x * value
+        while self._max and self._max[-1] < value:
+            self._max.pop()
+        self._max.append(value)
+        while self._min and self._min[-1] > value:
+            self._min.pop()
+        self._min.append(value)
+        # Drop readings older than the window
+        while self._samples[0][0] < t - self.window_s:
+            old_t, old_value = self._samples.popleft()
+            x = old_t - self._origin
+            self._n -= 1
+            self._st -= x
+            self._sv -= old_value
+            self._stt -= x * x
+            self._stv -= x * old_value
+            if self._max[0] == old_value:
+                self._max.popleft()
+            if self._min[0] == old_value:
+                self._min.popleft()
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def span(self) -> float:
+        """Seconds between the oldest and newest reading in the window"""
+        return self._samples[-1][0] - self._samples[0][0] if self._samples else 0.0
+
+    @property
+    def mean(self) -> float:
+        return self._sv / self._n if self._n else float("nan")
+
+    @property
+    def slope(self) -> float:
+        """Least-squares drift (value per second) over the window"""
+        denom = self._n * self._stt - self._st * self._st
+        if self._n < 2 or denom <= 0:
+            return 0.0
+        return (self._n * self._stv - self._st * self._sv) / denom
+
+    def deviation(self, target: float) -> float:
+        """Largest distance of a reading in the window from target"""
+        if not self._samples:
+            return float("inf")
+        return max(self._max[0] - target, target - self._min[0])
+
+    def is_stable(self, target: float, tolerance: float) -> bool:
+        # Readings arrive about once per poll interval: allow one interval of slack on the span
+        full = self._n >= 2 and self.span >= self.window_s * 0.9
+        return (full and self.deviation(target) <= tolerance
+                and abs(self.slope) * self.window_s <= tolerance)
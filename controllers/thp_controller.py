@@ -1,6 +1,7 @@
 from PyQt5.QtCore import QObject, QTimer, pyqtSignal, Qt
 from PyQt5.QtWidgets import QGroupBox, QLabel, QVBoxLayout, QHBoxLayout, QPushButton
 from drivers.thp_sensor import read_thp_sensor_data
+import telemetry
 
 class THPController(QObject):
     status_signal = pyqtSignal(str)
@@ -68,6 +69,7 @@ class THPController(QObject):
             data = read_thp_sensor_data(self.port)
             if data:
                 self.latest = data
+                self._publish(data)
                 self.readings_label.setText(
                     f"Temp: {data['temperature']:.1f} °C | "
                     f"Humidity: {data['humidity']:.1f} % | "
@@ -81,6 +83,14 @@ class THPController(QObject):
             self.readings_label.setText("Sensor error - check connection")
             self.status_signal.emit(f"THP sensor error: {e}")
 
+    def _publish(self, data):
+        """Share a reading through the telemetry store"""
+        telemetry.store.publish_many({
+            "thp.temperature_C": data.get("temperature") or 0.0,
+            "thp.humidity_pct": data.get("humidity") or 0.0,
+            "thp.pressure_hPa": data.get("pressure") or 0.0,
+        })
+
     def get_latest(self):
         return self.latest
 
@@ -96,6 +106,7 @@ class THPController(QObject):
         data = read_thp_sensor_data(self.port)
         if data:
             self.latest = data
+            self._publish(data)
             self.readings_label.setText(
                 f"Temp: {data['temperature']:.1f} °C | "
                 f"Humidity: {data['humidity']:.1f} % | "
@@ -121,6 +132,7 @@ class THPController(QObject):
             data = read_thp_sensor_data(self.port)
             if data:
                 self.latest = data
+                self._publish(data)
                 self.readings_label.setText(
                     f"Temp: {data['temperature']:.1f} °C | "
                     f"Humidity: {data['humidity']:.1f} % | "
@@ -1,5 +1,6 @@
 import struct
 import threading
+import telemetry
 
 def parse_imu_packet(packet: bytes):
     """Parse an 11-byte WitMotion IMU packet."""
@@ -45,16 +46,23 @@ def read_from_imu(serial_obj, data_dict: dict, stop_event: threading.Event):
                 label, *vals = parse_imu_packet(packet)
                 if label == "Angle":
                     data_dict["rpy"] = tuple(vals)
+                    telemetry.store.publish_many({"imu.roll_deg": vals[0], "imu.pitch_deg": vals[1],
+                                                  "imu.yaw_deg": vals[2]})
                 elif label == "Pressure":
                     data_dict["pressure"], data_dict["temperature"] = vals
+                    telemetry.store.publish_many({"imu.pressure_hPa": vals[0], "imu.temperature_C": vals[1]})
                 elif label == "GPS" and vals[0] is not None:
                     data_dict["latitude"], data_dict["longitude"] = vals
+                    telemetry.store.publish_many({"imu.latitude_deg": vals[0], "imu.longitude_deg": vals[1]})
                 elif label == "Accel":
                     data_dict["accel"] = tuple(vals)
+                    telemetry.store.publish("imu.accel_g", vals)
                 elif label == "Gyro":
                     data_dict["gyro"] = tuple(vals)
+                    telemetry.store.publish("imu.gyro_dps", vals)
                 elif label == "Mag":
                     data_dict["mag"] = tuple(vals)
+                    telemetry.store.publish("imu.mag_uT", vals)
             else:
                 buffer.pop(0)
 
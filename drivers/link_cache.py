@@ -0,0 +1,46 @@
+"""
+Last-good serial line settings per port
+
+Drivers that auto-detect their line settings remember what worked, so the
+next connect can probe those settings first instead of scanning every baud
+rate. Stored as JSON ({port: {"baud", "parity", "t"}}), replaced atomically.
+"""
+import os
+import json
+import time
+
+
+class LinkCache:
+    """Per-port (baud, parity) of the last successful connect"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.links = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.links, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def get(self, port: str):
+        """(baud, parity) that last worked on port, or None"""
+        link = self.links.get(port)
+        return (link["baud"], link["parity"]) if link else None
+
+    def remember(self, port: str, baud: int, parity: str):
+        if self.get(port) == (baud, parity):
+            return
+        self.links[port] = {"baud": baud, "parity": parity, "t": time.time()}
+        try:
+            self._save()
+        except OSError:
+            pass    # only costs a scan on the next connect
@@ -0,0 +1,102 @@
+"""
+Shared Modbus RTU bus for several slaves on one RS-485 line
+
+ModbusBus owns a ModbusRTUClient and runs every transaction on one worker
+thread, so requests from different axes never interleave on the line.
+Requests are queued per (priority, slave): a higher priority class always
+goes first (stop before move before status poll), and within a class the
+slaves take turns, one transaction each, so a busy axis cannot starve the
+others. submit() returns a concurrent.futures.Future with the parsed reply.
+"""
+import threading
+from collections import deque, Counter
+from concurrent.futures import Future
+
+from drivers import modbus_rtu
+
+PRIORITY_STOP = 0
+PRIORITY_MOVE = 1
+PRIORITY_POLL = 2
+PRIORITIES = (PRIORITY_STOP, PRIORITY_MOVE, PRIORITY_POLL)
+
+
+class ModbusBus:
+    """Serialises transactions of several slaves on one port with priorities and round-robin"""
+
+    def __init__(self, client: modbus_rtu.ModbusRTUClient):
+        self.client = client
+        self.transactions = Counter()   # completed transactions per slave
+        self._cond = threading.Condition()
+        self._queues = {}               # (priority, slave) -> deque of (request, Future)
+        self._turns = {p: deque() for p in PRIORITIES}  # slaves with queued requests, in turn order
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="modbus-bus", daemon=True)
+        self._thread.start()
+
+    def submit(self, slave: int, request: bytes, priority: int = PRIORITY_POLL) -> Future:
+        """Queue one request frame for slave; the Future gets parse_reply()'s result"""
+        future = Future()
+        with self._cond:
+            if not self._running:
+                future.set_exception(modbus_rtu.ModbusError("Bus closed"))
+                return future
+            queue = self._queues.setdefault((priority, slave), deque())
+            if not queue:
+                self._turns[priority].append(slave)
+            queue.append((request, future))
+            self._cond.notify()
+        return future
+
+    def read_registers(self, slave: int, address: int, count: int, priority: int = PRIORITY_POLL) -> list:
+        return self.submit(slave, modbus_rtu.read_holding_registers_frame(slave, address, count),
+                           priority).result()
+
+    def write_registers(self, slave: int, address: int, values, priority: int = PRIORITY_MOVE):
+        self.submit(slave, modbus_rtu.write_multiple_registers_frame(slave, address, values),
+                    priority).result()
+
+    def _next(self):
+        """Next (slave, request, future) by priority, then round-robin; None once closed"""
+        with self._cond:
+            while self._running:
+                for priority in PRIORITIES:
+                    turns = self._turns[priority]
+                    if turns:
+                        slave = turns.popleft()
+                        queue = self._queues[(priority, slave)]
+                        request, future = queue.popleft()
+                        if queue:
+                            turns.append(slave)     # back of the line for its next request
+                        return slave, request, future
+                self._cond.wait()
+        return None
+
+    def _run(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            slave, request, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.client.transact(request))
+            except Exception as e:
+                future.set_exception(e)
+            self.transactions[slave] += 1
+
+    def close(self):
+        """Stop the worker, fail queued requests and close the port"""
+        with self._cond:
+            self._running = False
+            pending = [future for queue in self._queues.values() for _, future in queue]
+            self._queues.clear()
+            for turns in self._turns.values():
+                turns.clear()
+            self._cond.notify_all()
+        for future in pending:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(modbus_rtu.ModbusError("Bus closed"))
+        if self._thread is not threading.current_thread():
+            self._thread.join(2.0)
+        self.client.close()
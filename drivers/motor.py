@@ -1,82 +1,223 @@
+import time
 import serial
 from PyQt5.QtCore import QThread, pyqtSignal
-import utils
+from drivers import modbus_rtu, modbus_bus
 
 # Motor control constants for Oriental Motor AZ series (Modbus)
 TrackerSpeed = 10000       # Motor rotation speed (steps/s)
+STEPS_PER_DEG = 100        # Motor steps per degree of the tracker axis
 TrackerCurrent = 1000      # Motor current limit (in 0.1% units, 1000 = 100.0%)
-SlaveID = 2                # Modbus slave address of the motor controller
+SlaveID = 2                # Modbus slave address of the (azimuth) motor controller
 BaudRateList = [9600, 19200, 38400, 57600, 115200, 230400]
+ParityList = [serial.PARITY_EVEN, serial.PARITY_NONE, serial.PARITY_ODD]  # driver default first
+
+IO_TIMEOUT_S = 0.5
+# Connect probe: an 8-byte status read and its 9-byte reply, plus driver and USB adapter latency
+PROBE_CHARS = 17
+PROBE_LATENCY_S = 0.05
+
+# AZ-series registers (upper word first) and driver output status bits
+REG_DIRECT_DATA = 0x0058        # direct data operation block (18 registers)
+REG_DRIVER_INPUT = 0x007C       # driver input command (2 registers)
+REG_OUTPUT_STATUS = 0x007E      # driver output status (2 registers)
+REG_FEEDBACK_POSITION = 0x00CC  # feedback position, steps (2 registers, signed)
+IN_STOP = 1 << 5
+OUT_READY = 1 << 5
+OUT_ALM_A = 1 << 7
+OUT_MOVE = 1 << 13
+OUT_IN_POS = 1 << 14
+
+POSITION_TOLERANCE_STEPS = 10   # 0.1 deg
+POLL_INTERVAL_S = 0.05
+
+
+def probe_timeout_s(baud: int) -> float:
+    """Read timeout of one probe: request and reply on the line plus the driver's latency"""
+    return PROBE_LATENCY_S + PROBE_CHARS * modbus_rtu.char_time_s(baud)
+
+
+def probe(ser, baud: int, parity: str, slave: int = SlaveID):
+    """
+    Switch ser to baud/parity and read the output status. Returns a
+    ModbusRTUClient if the driver answered with a CRC-valid reply (an
+    exception reply counts: it proves the settings), else None.
+    """
+    ser.baudrate = baud
+    ser.parity = parity
+    ser.timeout = probe_timeout_s(baud)
+    bus = modbus_rtu.ModbusRTUClient(ser, baud)
+    try:
+        bus.read_registers(slave, REG_OUTPUT_STATUS, 2)
+    except modbus_rtu.ModbusExceptionReply:
+        pass
+    except modbus_rtu.ModbusError:
+        return None
+    ser.timeout = IO_TIMEOUT_S
+    return bus
+
 
 class MotorConnectThread(QThread):
-    """Thread to attempt motor serial connection with baud auto-detection."""
-    result_signal = pyqtSignal(object, int, str)  # will emit (serial_obj or None, baud_rate, message)
-    def __init__(self, port_name, parent=None):
+    """
+    Thread to attempt motor serial connection with baud auto-detection. The
+    last-good baud and parity of the port (from cache, a LinkCache) are
+    probed first; every other setting is scanned only if they fail.
+    """
+    result_signal = pyqtSignal(object, int, str)  # will emit (ModbusRTUClient or None, baud_rate, message)
+    def __init__(self, port_name, parent=None, cache=None, slave=SlaveID):
         super().__init__(parent)
         self.port_name = port_name
+        self.cache = cache
+        self.slave = slave
     def run(self):
-        found_serial = None
-        found_baud = None
-        message = ""
-        # Try each baud rate to find a responding motor
-        for baud in BaudRateList:
+        start = time.monotonic()
+        try:
+            ser = serial.Serial(self.port_name, bytesize=serial.EIGHTBITS,
+                                stopbits=serial.STOPBITS_ONE, timeout=IO_TIMEOUT_S)
+        except Exception as e:
+            self.result_signal.emit(None, 0, f"Cannot open motor port {self.port_name}: {e}")
+            return
+        cached = self.cache.get(self.port_name) if self.cache else None
+        settings = [(baud, parity) for parity in ParityList for baud in BaudRateList]
+        if cached in settings:
+            settings.remove(cached)
+            settings.insert(0, cached)
+        for tried, (baud, parity) in enumerate(settings, 1):
             try:
-                ser = serial.Serial(
-                    self.port_name, baudrate=baud, bytesize=serial.EIGHTBITS,
-                    parity=serial.PARITY_EVEN, stopbits=serial.STOPBITS_ONE,
-                    timeout=0.5
-                )
-                # Example Modbus read command (function 0x03) at register 0x0058 (2 registers)
-                base_cmd = bytes([SlaveID, 0x03, 0x00, 0x58, 0x00, 0x02])
-                crc_val = utils.modbus_crc16(base_cmd)
-                crc_bytes = crc_val.to_bytes(2, 'little')
-                ser.write(base_cmd + crc_bytes)
-                # Read a few bytes to detect any response
-                response = ser.read(5)
-                if response:
-                    found_serial = ser
-                    found_baud = baud
-                    message = f"Motor connected on {self.port_name} at {baud} baud."
-                    break
-                ser.close()
+                bus = probe(ser, baud, parity, self.slave)
             except Exception:
-                # Ignore exceptions and try next baud
+                bus = None  # setting not supported by the port
+            if bus is None:
                 continue
-        if not found_serial:
-            message = f"No response from motor on {self.port_name}."
-        # Emit result (serial object if found, else None)
-        self.result_signal.emit(found_serial, found_baud if found_baud else 0, message)
+            if self.cache:
+                self.cache.remember(self.port_name, baud, parity)
+            how = "last-good settings" if tried == 1 and cached else f"{tried} settings tried"
+            self.result_signal.emit(bus, baud, f"Motor connected on {self.port_name} at {baud} baud 8{parity}1 "
+                                               f"in {time.monotonic() - start:.2f} s ({how}).")
+            return
+        ser.close()
+        self.result_signal.emit(None, 0, f"No response from motor on {self.port_name} "
+                                         f"({len(settings)} settings tried in {time.monotonic() - start:.2f} s).")
+
+
+def direct_data_registers(angle: int) -> list:
+    """Direct data block (REG_DIRECT_DATA, 18 registers) for an absolute move to angle (motor steps)"""
+    return ([0, 1,                                  # operation data No. 1
+             0, 1]                                  # absolute positioning
+            + modbus_rtu.int32_to_registers(angle)  # position (clamped to 32-bit range)
+            + modbus_rtu.int32_to_registers(TrackerSpeed)
+            + [0, 0x1F40, 0, 0x1F40]                # acceleration / deceleration rate
+            + modbus_rtu.int32_to_registers(TrackerCurrent)
+            + [0, 1,                                # trigger: start on write
+               0, 1])                               # forwarding destination
+
+
+class MotorAxis:
+    """
+    One AZ driver (slave) on a shared ModbusBus. Status reads queue at poll
+    priority, moves at move priority and stop ahead of both.
+    """
+
+    def __init__(self, bus, slave: int = SlaveID, name: str = "azimuth"):
+        self.bus = bus
+        self.slave = slave
+        self.name = name
+
+    def read_registers(self, address: int, count: int) -> list:
+        return self.bus.read_registers(self.slave, address, count, modbus_bus.PRIORITY_POLL)
+
+    def move(self, angle: int):
+        """Start an absolute move to angle (motor steps); raises ModbusError if not accepted"""
+        self.bus.write_registers(self.slave, REG_DIRECT_DATA, direct_data_registers(angle),
+                                 modbus_bus.PRIORITY_MOVE)
+
+    def stop(self):
+        """Queue a stop (STOP input on, then off again) ahead of everything else; returns its Future"""
+        for value in (IN_STOP, 0):
+            future = self.bus.submit(self.slave, modbus_rtu.write_multiple_registers_frame(
+                self.slave, REG_DRIVER_INPUT, [0, value]), modbus_bus.PRIORITY_STOP)
+        return future
+
 
-def send_move_command(serial_obj, angle: int) -> bool:
+def send_move_command(axis, angle: int) -> bool:
     """Send a move command to the motor to go to the specified angle (in motor steps). Returns True if ACK received."""
-    # Construct Modbus Write Multiple Registers command to move motor to target angle
-    base_cmd = bytes([SlaveID, 0x10, 0x00, 0x58, 0x00, 0x12, 0x24,
-                      0x00, 0x00, 0x00, 0x01, 0x00, 0x00, 0x00, 0x01])
-    # Prepare data bytes for angle, speed, current
     try:
-        angle_bytes = angle.to_bytes(4, 'big', signed=True)
-    except OverflowError:
-        # Clamp angle to 32-bit signed range if out of bounds
-        val = max(min(angle, 0x7FFFFFFF), -0x80000000)
-        angle_bytes = val.to_bytes(4, 'big', signed=True)
-    speed_bytes = TrackerSpeed.to_bytes(4, 'big', signed=True)
-    current_bytes = TrackerCurrent.to_bytes(4, 'big', signed=True)
-    # Mid and end bytes (acceleration/deceleration and execution parameters)
-    mid_bytes = bytes([0x00, 0x00, 0x1F, 0x40, 0x00, 0x00, 0x1F, 0x40])
-    end_bytes = bytes([0x00, 0x00, 0x00, 0x01, 0x00, 0x00, 0x00, 0x01])
-    full_cmd = base_cmd + angle_bytes + speed_bytes + mid_bytes + current_bytes + end_bytes
-    # Append CRC16
-    crc_val = utils.modbus_crc16(full_cmd)
-    crc_bytes = crc_val.to_bytes(2, 'little')
-    try:
-        serial_obj.reset_input_buffer()
-        serial_obj.write(full_cmd + crc_bytes)
-        # Response for function 0x10 (Write Multiple Registers) should be 8 bytes (including CRC)
-        response = serial_obj.read(8)
-        if response and len(response) >= 6 and response[1] == 0x10:
-            return True
-        else:
-            return False
+        axis.move(angle)
+        return True
     except Exception:
         return False
 
+
+def read_registers(axis, address: int, count: int):
+    """Read holding registers (function 03); list of values, or None without a valid reply"""
+    try:
+        return axis.read_registers(address, count)
+    except Exception:
+        return None
+
+
+def read_output_status(axis):
+    """Driver output status bits (OUT_*), or None"""
+    regs = read_registers(axis, REG_OUTPUT_STATUS, 2)
+    return None if regs is None else (regs[0] << 16) | regs[1]
+
+
+def read_feedback_position(axis):
+    """Encoder position in motor steps, or None"""
+    regs = read_registers(axis, REG_FEEDBACK_POSITION, 2)
+    return None if regs is None else modbus_rtu.registers_to_int32(*regs)
+
+
+def wait_until_in_position(axis, target: int, timeout: float, on_position=None,
+                           running=lambda: True, poll_s: float = POLL_INTERVAL_S):
+    """
+    Poll status and feedback position until the driver reports IN-POS (not
+    MOVE) within POSITION_TOLERANCE_STEPS of target. Returns (ok, position,
+    message); on_position(steps) is called for every position read.
+    """
+    deadline = time.monotonic() + timeout
+    position = None
+    while running():
+        status = read_output_status(axis)
+        steps = read_feedback_position(axis)
+        if steps is not None:
+            position = steps
+            if on_position is not None:
+                on_position(steps)
+        if status is not None:
+            if status & OUT_ALM_A:
+                return False, position, "Motor alarm"
+            arrived = position is not None and abs(position - target) <= POSITION_TOLERANCE_STEPS
+            if status & OUT_IN_POS and not status & OUT_MOVE and arrived:
+                return True, position, ""
+        if time.monotonic() >= deadline:
+            return False, position, f"Not in position after {timeout:.0f} s"
+        time.sleep(poll_s)
+    return False, position, "Stopped"
+
+
+class MotorMoveThread(QThread):
+    """Sends one move on an axis and follows it until the motor is in position."""
+    position_signal = pyqtSignal(int)               # feedback position (steps) while moving
+    result_signal = pyqtSignal(bool, object, str)   # (arrived, final position in steps or None, message)
+
+    def __init__(self, axis, target: int, timeout: float = 30.0, parent=None):
+        super().__init__(parent)
+        self.axis = axis
+        self.target = target
+        self.timeout = timeout
+        self.running = True
+
+    def run(self):
+        try:
+            self.axis.move(self.target)
+        except Exception as e:
+            # Always answer: the controller clears motor.moving and the routine stops waiting
+            self.result_signal.emit(False, None, f"Move not accepted: {e}")
+            return
+        ok, position, message = wait_until_in_position(
+            self.axis, self.target, self.timeout,
+            on_position=self.position_signal.emit, running=lambda: self.running)
+        self.result_signal.emit(ok, position, message)
+
+    def stop(self):
+        self.running = False
@@ -1,7 +1,8 @@
 # motor.py
 import serial
 from PyQt5.QtCore import QThread, pyqtSignal
-import utils
+from drivers import modbus_rtu
+from drivers.motor import REG_DIRECT_DATA, direct_data_registers
 
 # Motor control constants for Oriental Motor AZ series (Modbus)
 TrackerSpeed   = 10000        # Motor rotation speed (steps/s)
@@ -34,10 +35,8 @@ class MotorConnectThread(QThread):
                     timeout=0.5
                 )
                 # Read 2 registers at 0x0058 (original working test)
-                base_cmd = bytes([SlaveID, 0x03, 0x00, 0x58, 0x00, 0x02])
-                crc_val  = utils.modbus_crc16(base_cmd)
                 ser.reset_input_buffer()
-                ser.write(base_cmd + crc_val.to_bytes(2, 'little'))
+                ser.write(modbus_rtu.read_holding_registers_frame(SlaveID, REG_DIRECT_DATA, 2))
 
                 # Just look for *any* response bytes
                 response = ser.read(5)
@@ -58,23 +57,10 @@ class MotorConnectThread(QThread):
 
 
 def send_move_command(serial_obj, angle: int) -> bool:
-    """Send a move command to the motor to go to the specified angle (degrees)."""
-    # Build Modbus Write Multiple Registers at 0x0058
-    base_cmd = bytes([SlaveID, 0x10, 0x00, 0x58, 0x00, 0x12, 0x24] + [0x00]*12)
-    # Insert angle, speed, mid‐params, current, end‐params
-    angle_bytes   = angle.to_bytes(4, 'big', signed=True)
-    speed_bytes   = TrackerSpeed.to_bytes(4, 'big', signed=True)
-    mid_bytes     = bytes([0x00,0x00,0x1F,0x40, 0x00,0x00,0x1F,0x40])
-    current_bytes = TrackerCurrent.to_bytes(4, 'big', signed=True)
-    end_bytes     = bytes([0x00,0x00,0x00,0x01, 0x00,0x00,0x00,0x01])
-
-    full_cmd = base_cmd + angle_bytes + speed_bytes + mid_bytes + current_bytes + end_bytes
-    crc_val  = utils.modbus_crc16(full_cmd).to_bytes(2, 'little')
-
+    """Send a move command to the motor to go to the specified angle (motor steps)."""
     try:
-        serial_obj.reset_input_buffer()
-        serial_obj.write(full_cmd + crc_val)
-        resp = serial_obj.read(8)
-        return bool(resp and len(resp) >= 6 and resp[1] == 0x10)
+        bus = modbus_rtu.ModbusRTUClient(serial_obj)
+        bus.write_registers(SlaveID, REG_DIRECT_DATA, direct_data_registers(angle))
+        return True
     except Exception:
         return False
@@ -20,25 +20,36 @@ CMD_FIXED_DESIRED_SETTING   = "1c"   # write / read fixed set‑point   :content
 CMD_POWER_ON_OFF            = "2d"   # write 1=on, 0=off            :contentReference[oaicite:8]{index=8}&#8203;:contentReference[oaicite:9]{index=9}
 CMD_INPUT2                  = "02"   # read auxiliary temperature
 
+REPLY_LEN = 12      # *DDDDDDDDSS^
+
 class TC36_25:
     """
     Thin, blocking interface – add your own threading / async wrapper if needed.
     """
 
-    def __init__(self, port: str = "COM16", delay_char: float = 0.001):
+    def __init__(self, port: str = "COM16", delay_char: float = 0.0,
+                 pipeline: bool = True, ser=None, timeout: float = 1.0):
         """
-        delay_char : seconds to wait after every byte – controller
-                     needs a little think‑time :contentReference[oaicite:10]{index=10}&#8203;:contentReference[oaicite:11]{index=11}
+        delay_char : seconds to wait after every byte. 0 (default) writes each
+                     frame with a single write(); set it only for firmware
+                     that drops characters sent back to back.
+        pipeline   : read_many() sends all its queries before reading the
+                     replies (switched off automatically if the controller
+                     does not answer them all).
+        ser        : an open serial-like object to use instead of opening port
+        timeout    : serial read/write timeout (s); a silent controller makes
+                     a transaction fail after this long
         """
         self.delay_char = delay_char
-        self.ser = serial.Serial(
+        self.pipeline = pipeline
+        self.ser = ser if ser is not None else serial.Serial(
             port=port,
             baudrate=9600,
             bytesize=serial.EIGHTBITS,
             parity=serial.PARITY_NONE,
             stopbits=serial.STOPBITS_ONE,
-            timeout=1.0,          # 1 s read timeout
-            write_timeout=1.0
+            timeout=timeout,
+            write_timeout=timeout
         )
 
     # -------------  Low–level helpers  ---------------------------------
@@ -54,16 +65,24 @@ class TC36_25:
         total = sum(ord(c) for c in payload) & 0xFF
         return f"{total:02x}"
 
-    def _tx(self, cmd: str, value_hex: str) -> str:
+    @classmethod
+    def _frame(cls, cmd: str, value_hex: str) -> bytes:
         payload = ADDR + cmd + value_hex
-        frame = STX + payload + self._csum(payload) + ETX
-        for ch in frame:
-            self.ser.write(ch.encode())
-            time.sleep(self.delay_char)
-
-        # Reply: *DDDDDDDDSS^  (12 bytes)
+        return (STX + payload + cls._csum(payload) + ETX).encode()
+
+    def _send(self, frame: bytes):
+        if self.delay_char > 0:
+            # Paced: one byte at a time for controllers that need think-time
+            for i in range(len(frame)):
+                self.ser.write(frame[i:i + 1])
+                time.sleep(self.delay_char)
+        else:
+            self.ser.write(frame)
+
+    def _reply(self) -> str:
+        # Reply: *DDDDDDDDSS^  (12 bytes)
         reply = self.ser.read_until(ACK.encode()).decode()
-        if len(reply) != 12 or reply[0] != STX or reply[-1] != ACK:
+        if len(reply) != REPLY_LEN or reply[0] != STX or reply[-1] != ACK:
             raise RuntimeError(f"Malformed reply: {reply!r}")
 
         data, rcv_sum = reply[1:9], reply[9:11]
@@ -72,6 +91,9 @@ class TC36_25:
 
         return data.lower()
 
+    def _tx(self, cmd: str, value_hex: str) -> str:
+        self._send(self._frame(cmd, value_hex))
+        return self._reply()
 
     def _write(self, cmd: str, value_hex: str = "00000000"):
         self._tx(cmd, value_hex)
@@ -79,6 +101,29 @@ class TC36_25:
     def _read(self, cmd: str) -> str:
         return self._tx(cmd, "00000000")
 
+    def read_many(self, cmds) -> list:
+        """
+        Read several registers in one exchange: all query frames go out in a
+        single write, then the replies are read back in order. Falls back to
+        one transaction per register (and stops pipelining) if the controller
+        answers some of the queued queries but loses others.
+        """
+        cmds = list(cmds)
+        if not self.pipeline or self.delay_char > 0 or len(cmds) < 2:
+            return [self._read(cmd) for cmd in cmds]
+        self.ser.write(b"".join(self._frame(cmd, "00000000") for cmd in cmds))
+        replies = []
+        try:
+            for _ in cmds:
+                replies.append(self._reply())
+        except RuntimeError:
+            self.ser.reset_input_buffer()
+            if not replies:
+                raise           # no answer at all: the controller is silent, not overrun
+            self.pipeline = False
+            return [self._read(cmd) for cmd in cmds]
+        return replies
+
     # -------------  Public API  ----------------------------------------
 
     def enable_computer_setpoint(self) -> None:
@@ -114,6 +159,11 @@ class TC36_25:
         hexval = self._read(CMD_INPUT2)
         return int(hexval, 16) / 100.0
 
+    def get_readings(self) -> tuple:
+        """(temperature, auxiliary temperature, set-point) from one read_many()."""
+        return tuple(int(hexval, 16) / 100.0
+                     for hexval in self.read_many([CMD_INPUT1, CMD_INPUT2, CMD_DESIRED_CONTROL_VALUE]))
+
     # -------------------------------------------------------------------
 
     def close(self):
@@ -0,0 +1,133 @@
+"""
+Loopback stand-in for the TC-36-25 controller, and a transport benchmark
+
+TC36Loopback is a serial-like object (write / read_until / reset_input_buffer
+/ close) that answers the TC-36 protocol: frames are checked, registers are
+read and written, and every byte costs its time on a 9600 baud line. The
+controller handles one query at a time, taking think_s to answer each, so
+pipelined queries are modelled the way the real unit serialises them.
+
+    python -m drivers.tc36_loopback            # compare the transport modes
+    python -m drivers.tc36_loopback --cycles 50 --think-ms 5
+"""
+import sys
+import time
+import argparse
+
+from drivers.tc36_25_driver import (TC36_25, STX, ETX, ACK, ADDR, CMD_INPUT1, CMD_INPUT2,
+                                    CMD_DESIRED_CONTROL_VALUE, CMD_FIXED_DESIRED_SETTING)
+
+BAUD = 9600
+BYTE_S = 10 / BAUD          # start + 8 data + stop bits
+
+# Commands whose register is written rather than read
+_WRITES = {"1c", "29", "2d"}
+
+
+class TC36Loopback:
+    """In-process TC-36-25: registers, checksums and line timing, no hardware"""
+
+    def __init__(self, think_s: float = 0.005, byte_s: float = BYTE_S):
+        self.think_s = think_s
+        self.byte_s = byte_s
+        self.registers = {CMD_INPUT1: 2512, CMD_INPUT2: 2437, CMD_DESIRED_CONTROL_VALUE: 2500,
+                          CMD_FIXED_DESIRED_SETTING: 2500, "29": 0, "2d": 0}
+        self.writes = 0             # write() calls, i.e. syscalls on a real port
+        self.frames = 0
+        self._rx = b""
+        self._replies = []          # (ready monotonic time, bytes)
+        self._busy_until = 0.0
+        self._line_free = 0.0       # when the host->controller line finishes sending
+
+    @staticmethod
+    def _csum(text: str) -> str:
+        return f"{sum(ord(c) for c in text) & 0xFF:02x}"
+
+    def write(self, data: bytes) -> int:
+        # Like an OS serial buffer: write() returns at once, the bytes leave at line speed
+        self.writes += 1
+        sent = max(time.monotonic(), self._line_free)
+        for byte in data:
+            sent += self.byte_s
+            self._rx += bytes([byte])
+            if self._rx.endswith(ETX.encode()):
+                self._handle(self._rx[:-1].decode(), sent)
+                self._rx = b""
+        self._line_free = sent
+        return len(data)
+
+    def _handle(self, frame: str, arrived: float):
+        self.frames += 1
+        if len(frame) != 15 or frame[0] != STX or frame[1:3] != ADDR:
+            return      # the controller ignores what it cannot parse
+        payload, checksum = frame[1:13], frame[13:15]
+        if checksum != self._csum(payload):
+            return
+        cmd, value = payload[2:4], payload[4:12]
+        if cmd in _WRITES:
+            raw = int(value, 16)
+            self.registers[cmd] = raw - (1 << 32) if raw & 0x80000000 else raw
+            if cmd == CMD_FIXED_DESIRED_SETTING:
+                self.registers[CMD_DESIRED_CONTROL_VALUE] = self.registers[cmd]
+        data = f"{self.registers.get(cmd, 0) & 0xFFFFFFFF:08x}"
+        reply = (STX + data + self._csum(data) + ACK).encode()
+        # One query at a time: think, then send the reply at line speed
+        start = max(arrived, self._busy_until)
+        self._busy_until = start + self.think_s + len(reply) * self.byte_s
+        self._replies.append((self._busy_until, reply))
+
+    def read_until(self, expected: bytes = b"\n") -> bytes:
+        if not self._replies:
+            return b""
+        ready, reply = self._replies.pop(0)
+        delay = ready - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return reply
+
+    def reset_input_buffer(self):
+        self._replies.clear()
+
+    def close(self):
+        pass
+
+
+def bench(cycles: int = 20, think_s: float = 0.005) -> list:
+    """[(mode, ms per update cycle, write() calls per cycle)] for one temperature update each"""
+    cmds = [CMD_INPUT1, CMD_INPUT2, CMD_DESIRED_CONTROL_VALUE]
+    modes = [
+        ("per-char, 1 ms pacing", dict(delay_char=0.001), False),
+        ("whole frames", dict(), False),
+        ("whole frames, read_many", dict(), True),
+    ]
+    results = []
+    for name, options, batched in modes:
+        line = TC36Loopback(think_s)
+        tc = TC36_25(ser=line, **options)
+        start = time.perf_counter()
+        for _ in range(cycles):
+            if batched:
+                tc.read_many(cmds)
+            else:
+                for cmd in cmds:
+                    tc._read(cmd)
+        elapsed = time.perf_counter() - start
+        results.append((name, elapsed / cycles * 1000, line.writes / cycles))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TC-36-25 transport benchmark against a loopback controller")
+    parser.add_argument("--cycles", type=int, default=20, help="update cycles per mode")
+    parser.add_argument("--think-ms", type=float, default=5.0, help="controller time to answer one query")
+    args = parser.parse_args(argv)
+
+    print(f"3 registers per cycle (temperature, auxiliary, set-point), {args.cycles} cycles, "
+          f"{BAUD} baud, {args.think_ms:g} ms controller think-time")
+    for name, ms, writes in bench(args.cycles, args.think_ms / 1000):
+        print(f"  {name:<26} {ms:7.1f} ms/cycle  {writes:5.0f} writes/cycle")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Background polling thread for the TC-36-25 temperature controller
+"""
+import time
+import queue
+from collections import namedtuple
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from drivers.tc36_25_driver import TC36_25
+
+TempReading = namedtuple("TempReading", ["t_mono", "temp_C", "aux_C", "setpoint_C"])
+
+# Consecutive failed reads before the controller is reported as not responding
+FAILURES_BEFORE_REPORT = 3
+
+
+class TC36PollerThread(QThread):
+    """
+    Owns the TC36_25 connection: opens it, reads temperature, auxiliary
+    temperature and set-point every interval_s, and runs queued set-point and
+    power commands between reads. Every serial transaction is bounded by
+    io_timeout_s, so a stuck controller only delays this thread.
+    """
+    connected_signal = pyqtSignal(bool, str)        # (connected, message)
+    reading_signal = pyqtSignal(object)             # TempReading
+    read_failed_signal = pyqtSignal(str)            # error of one failed periodic read
+    result_signal = pyqtSignal(str, bool, str, object)  # (command, ok, message, value it was queued with)
+    status_signal = pyqtSignal(str)
+
+    def __init__(self, port, interval_s=1.0, io_timeout_s=0.5, char_delay=0.0, parent=None, ser=None):
+        super().__init__(parent)
+        self.port = port
+        self.interval_s = interval_s
+        self.io_timeout_s = io_timeout_s
+        self.char_delay = char_delay
+        self._ser = ser
+        self._commands = queue.Queue()
+        self._running = True
+
+    def set_setpoint(self, temp_c):
+        self._commands.put(("setpoint", temp_c, lambda tc: tc.set_setpoint(temp_c)))
+
+    def power(self, on):
+        self._commands.put(("power on" if on else "power off", on, lambda tc: tc.power(on)))
+
+    def stop(self):
+        self._running = False
+        self._commands.put(None)  # wake the thread
+
+    def run(self):
+        tc = None
+        try:
+            tc = TC36_25(self.port, delay_char=self.char_delay, ser=self._ser, timeout=self.io_timeout_s)
+            # Computer-set mode and output on, as at every connect
+            tc.enable_computer_setpoint()
+            tc.power(True)
+        except Exception as e:
+            if tc is not None:
+                tc.close()  # opened but not answering: release the port for the next Connect
+            self.connected_signal.emit(False, f"Temperature controller connection failed: {e}")
+            return
+        self.connected_signal.emit(True, f"Temperature controller connected on {self.port}")
+
+        failures = 0
+        next_read = time.monotonic()
+        try:
+            while self._running:
+                # Commands run as soon as they are queued; reads keep their cadence
+                try:
+                    item = self._commands.get(timeout=max(next_read - time.monotonic(), 0.0))
+                except queue.Empty:
+                    item = ()
+                if item is None:
+                    break
+                if item:
+                    name, value, command = item
+                    try:
+                        command(tc)
+                        self.result_signal.emit(name, True, "", value)
+                    except Exception as e:
+                        self.result_signal.emit(name, False, str(e), value)
+                    continue
+
+                next_read += self.interval_s
+                if next_read < time.monotonic():
+                    next_read = time.monotonic() + self.interval_s  # fell behind: don't burst
+                t = time.monotonic()
+                try:
+                    temp, aux, setpoint = tc.get_readings()
+                    t = (t + time.monotonic()) / 2  # middle of the exchange
+                except Exception as e:
+                    failures += 1
+                    self.read_failed_signal.emit(str(e))
+                    if failures == FAILURES_BEFORE_REPORT:
+                        self.status_signal.emit(f"Temperature controller not responding: {e}")
+                    continue
+                if failures >= FAILURES_BEFORE_REPORT:
+                    self.status_signal.emit("Temperature controller responding again")
+                failures = 0
+                self.reading_signal.emit(TempReading(t, temp, aux, setpoint))
+        finally:
+            tc.close()
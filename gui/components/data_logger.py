@@ -5,29 +5,73 @@ import os
 import datetime
 import numpy as np
 
+from storage.rotation import SessionIndex, RotatingSegmentFile
+from storage.records import record_dtype, dtype_to_meta, dtype_from_meta
+from storage.spectral_codec import SpectralBlockWriter, BLOCK_INDEX_DTYPE
+from storage.accumulator import SegmentAccumulator
+from storage.event_log import EventLog
+import telemetry
+
+# Housekeeping columns written ahead of the pixel columns in every scan row
+HOUSEKEEPING_COLUMNS = [
+    "Timestamp", "RoutineName", "Cycles", "Repetitions",
+    "MotorAngle_deg", "FilterPos",
+    "Roll_deg", "Pitch_deg", "Yaw_deg", "AccelX_g", "AccelY_g", "AccelZ_g",
+    "MagX_uT", "MagY_uT", "MagZ_uT",
+    "Pressure_hPa", "Temperature_C", "TempCtrl_curr", "TempCtrl_set", "TempCtrl_aux",
+    "Latitude_deg", "Longitude_deg", "IntegrationTime_us",
+    "THP_Temp_C", "THP_Humidity_pct", "THP_Pressure_hPa",
+    "ScanSeq", "NScans"
+]
+
 class DataLogger:
     def __init__(self, parent):
         """Initialize data logger"""
         self.parent = parent
         
-        # Initialize log file attributes
-        self.log_file = None
+        # Initialize file attributes
         self.csv_file = None
+        self.record_file = None
+        self.stats_file = None
+        self.spectra_writer = None
+        self._record_dtype = None
+        self._stats_dtype = None
         self.csv_file_path = None
-        self.log_file_path = None
+        self.session_index = None
         self.continuous_saving = False
         
+        # Segment rotation settings (hardware_config.json "data_logging" section)
+        log_cfg = getattr(parent, 'config', {}).get("data_logging", {})
+        self.max_segment_bytes = int(log_cfg.get("max_segment_mb", 64) * 1024 * 1024)
+        self.rotate_hourly = bool(log_cfg.get("rotate_hourly", True))
+        
+        # "text" writes spectra into the CSV rows as Pixel_* columns (what downstream scripts
+        # read); "packed" keeps them as compressed integer counts (storage.spectral_codec)
+        # and drops those columns, so it has to be chosen in the config
+        self.spectra_storage = log_cfg.get("spectra_storage", "text")
+        self.spectra_codec = log_cfg.get("spectra_codec", "zlib")
+        self.block_scans = int(log_cfg.get("block_scans", 32))
+        
+        # Averaging window length in acquired scans (1 = every scan gets its own row)
+        self.scans_per_average = max(1, int(log_cfg.get("scans_per_average", 1)))
+        # Per-pixel std/min/max of every multi-scan segment go to a "stats" stream
+        self.segment_stats = bool(log_cfg.get("segment_stats", True))
+        
         # Create log directories if they don't exist
         self.log_dir = os.path.join(os.path.dirname(__file__), "..", "..", "logs")
         self.csv_dir = os.path.join(os.path.dirname(__file__), "..", "..", "data")
         os.makedirs(self.log_dir, exist_ok=True)
         os.makedirs(self.csv_dir, exist_ok=True)
         
-        # Data collection attributes
-        self._data_collection = []
+        # Application-wide event log (storage.event_log), written in batches by its own thread
+        self.events = EventLog(self.log_dir,
+                               max_bytes=int(log_cfg.get("event_log_max_mb", 16) * 1024 * 1024))
+        
+        # Data collection attributes: the open averaging segment (storage.accumulator)
+        self._segment = None
         self._hardware_changing = False
-        self._last_motor_angle = 0
-        self._last_filter_position = 0
+        self._last_scan_seq = None
+        self.dropped_scans = 0
         
         # Current routine info
         self.current_routine_name = "Unknown"
@@ -37,27 +81,12 @@ class DataLogger:
     def toggle_data_saving(self):
         """Toggle continuous data saving on/off"""
         if not self.continuous_saving:
-            if self.csv_file:
-                self.csv_file.close()
-            if self.log_file:
-                self.log_file.close()
+            self._close_files()
             ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
             
             # Get current routine name if available
             routine_name = getattr(self.parent, 'current_routine_name', "Unknown")
             
-            self.csv_file_path = os.path.join(self.csv_dir, f"Scans_{routine_name}_{ts}.csv")
-            self.log_file_path = os.path.join(self.log_dir, f"log_{routine_name}_{ts}.txt")
-            try:
-                self.csv_file = open(self.csv_file_path, "w", encoding="utf-8", newline="")
-                self.log_file = open(self.log_file_path, "w", encoding="utf-8")
-            except Exception as e:
-                self.parent.statusBar().showMessage(f"Cannot open files: {e}")
-                return
-            
-            # Add metadata header with routine information
-            self.csv_file.write(f"# Routine: {routine_name}\n")
-            
             # Get cycles and repetitions from spectrometer controller if available
             cycles = 1
             repetitions = 1
@@ -66,28 +95,61 @@ class DataLogger:
             if hasattr(self.parent, 'hw') and hasattr(self.parent.hw.spec_ctrl, 'repetitions_spinbox'):
                 repetitions = self.parent.hw.spec_ctrl.repetitions_spinbox.value()
             
-            self.csv_file.write(f"# Cycles: {cycles}\n")
-            self.csv_file.write(f"# Repetitions: {repetitions}\n")
-            self.csv_file.write(f"# Start Time: {ts}\n")
-            self.csv_file.write(f"# ----------------------------------------\n")
-            
-            # Write CSV headers
-            headers = [
-                "Timestamp", "RoutineName", "Cycles", "Repetitions", 
-                "MotorAngle_deg", "FilterPos",
-                "Roll_deg", "Pitch_deg", "Yaw_deg", "AccelX_g", "AccelY_g", "AccelZ_g",
-                "MagX_uT", "MagY_uT", "MagZ_uT",
-                "Pressure_hPa", "Temperature_C", "TempCtrl_curr", "TempCtrl_set", "TempCtrl_aux",
-                "Latitude_deg", "Longitude_deg", "IntegrationTime_us",
-                "THP_Temp_C", "THP_Humidity_pct", "THP_Pressure_hPa"
-            ]
-            
-            # Add pixel headers
+            # Metadata header with routine information, repeated in every segment
             spec_ctrl = self.parent.hw.spec_ctrl
-            headers += [f"Pixel_{i}" for i in range(len(spec_ctrl.intens))]
-            self.csv_file.write(",".join(headers) + "\n")
-            self.csv_file.flush()
-            os.fsync(self.csv_file.fileno())
+            npix = len(spec_ctrl.intens) or min(2048, getattr(spec_ctrl, 'npix', 0))
+            packed = self.spectra_storage == "packed"
+            headers = list(HOUSEKEEPING_COLUMNS)
+            if not packed:
+                headers += [f"Pixel_{i}" for i in range(npix)]
+            csv_header = (
+                f"# Routine: {routine_name}\n"
+                f"# Cycles: {cycles}\n"
+                f"# Repetitions: {repetitions}\n"
+                f"# Start Time: {ts}\n"
+                f"# ----------------------------------------\n"
+                + ",".join(headers) + "\n"
+            )
+            
+            session_name = f"Scans_{routine_name}_{ts}"
+            try:
+                self.session_index = SessionIndex(self.csv_dir, session_name)
+                # Binary mirror of the scan rows for memory-mapped access (storage.records)
+                self._record_dtype = record_dtype(HOUSEKEEPING_COLUMNS[2:], 0 if packed else npix)
+                self.session_index.meta = {
+                    "routine": routine_name,
+                    "cycles": cycles,
+                    "repetitions": repetitions,
+                    "npix": npix,
+                    "records_dtype": dtype_to_meta(self._record_dtype),
+                    # Events logged while this session was open
+                    "events": {
+                        "index": os.path.relpath(self.events.index_path, self.csv_dir),
+                        "first_seq": self.events.last_seq + 1,
+                    },
+                }
+                self._stats_dtype = None
+                if self.segment_stats:
+                    self._stats_dtype = np.dtype([
+                        ("Timestamp", "<f8"), ("SegmentStart", "<f8"), ("NScans", "<f8"),
+                        ("SpectrumStd", "<f4", (npix,)), ("SpectrumMin", "<f4", (npix,)),
+                        ("SpectrumMax", "<f4", (npix,)),
+                    ])
+                    self.session_index.meta["stats_dtype"] = dtype_to_meta(self._stats_dtype)
+                if packed:
+                    self.session_index.meta["spectra"] = {
+                        "format": "spz",
+                        "codec": self.spectra_codec,
+                        "block_index": f"{session_name}.spx",
+                    }
+                self._open_streams(session_name, npix, csv_header)
+            except Exception as e:
+                self.parent.statusBar().showMessage(f"Cannot open files: {e}")
+                self._close_files()
+                return
+            self.csv_file_path = self.csv_file.path
+            self.csv_file.flush(sync=True)
+            self.session_index.save()
             
             # Store routine info for later use
             self.current_routine_name = routine_name
@@ -95,57 +157,284 @@ class DataLogger:
             self.current_repetitions = repetitions
             
             # Initialize data collection for averaging
-            self._data_collection = []
+            self._segment = None
             self._collection_start_time = datetime.datetime.now()
+            self._last_scan_seq = None
+            self.dropped_scans = 0
             
-            # Initialize hardware state tracking
-            self._last_motor_angle = 0
-            if hasattr(self.parent.hw.motor_ctrl, "current_angle_deg"):
-                self._last_motor_angle = self.parent.hw.motor_ctrl.current_angle_deg
-            
-            self._last_filter_position = self.parent.hw.filter_ctrl.get_position()
-            if self._last_filter_position is None:
-                self._last_filter_position = getattr(self.parent.hw.filter_ctrl, "current_position", 0)
-            
-            # Start timers
-            integration_time_ms = getattr(spec_ctrl, 'current_integration_time_us', 100000) / 1000
-            self.parent.collection_timer.start(250)  # Collect samples every 250ms
-            timer_interval = max(1000, min(5000, int(integration_time_ms)))
-            self.parent.save_data_timer.start(timer_interval)
-            
+            # Rows are written from on_scan as scans arrive from the spectrometer
             self.continuous_saving = True
             self.parent.statusBar().showMessage(f"Started continuous data saving to {self.csv_file_path}")
         else:
             # Stop data saving
             self.continuous_saving = False
-            self.parent.collection_timer.stop()
-            self.parent.save_data_timer.stop()
             
             # Flush any remaining data
-            if hasattr(self, '_csv_buffer') and self._csv_buffer:
-                self.csv_file.write(''.join(self._csv_buffer))
-                self.csv_file.flush()
-                self._csv_buffer = []
-                self._csv_buffer_count = 0
-            
-            # Close files
-            if self.csv_file:
-                self.csv_file.close()
-                self.csv_file = None
-            if self.log_file:
-                self.log_file.close()
-                self.log_file = None
+            self.save_averaged_data()
+            if self.dropped_scans:
+                self.write_log(f"{self.dropped_scans} scans missed during session", level="WARNING")
+            if self.session_index:
+                self.session_index.meta["events"]["last_seq"] = self.events.last_seq
+            self._close_files()
             
             self.parent.statusBar().showMessage("Stopped continuous data saving")
     
-    def collect_data_sample(self):
-        """Collect a data sample for averaging"""
+    def _open_streams(self, session_name, npix, csv_header, first_scan=0):
+        """Open the session's segment files (new segments after any already in the index)"""
+        meta = self.session_index.meta
+        if self._stats_dtype is not None:
+            self.stats_file = RotatingSegmentFile(
+                self.session_index, "stats", self.csv_dir, f"{session_name}_stats", ".rec",
+                max_bytes=self.max_segment_bytes, rotate_hourly=self.rotate_hourly,
+                binary=True)
+        self.csv_file = RotatingSegmentFile(
+            self.session_index, "scans", self.csv_dir, session_name, ".csv",
+            max_bytes=self.max_segment_bytes, rotate_hourly=self.rotate_hourly,
+            header=csv_header)
+        self.record_file = RotatingSegmentFile(
+            self.session_index, "records", self.csv_dir, session_name, ".rec",
+            max_bytes=self.max_segment_bytes, rotate_hourly=self.rotate_hourly,
+            binary=True)
+        if "spectra" in meta:
+            self.spectra_writer = SpectralBlockWriter(
+                RotatingSegmentFile(
+                    self.session_index, "spectra", self.csv_dir, session_name, ".spz",
+                    max_bytes=self.max_segment_bytes, rotate_hourly=self.rotate_hourly,
+                    binary=True),
+                os.path.join(self.csv_dir, meta["spectra"]["block_index"]), npix,
+                block_scans=self.block_scans, codec=meta["spectra"]["codec"],
+                first_scan=first_scan)
+    
+    def resume_session(self, index_path):
+        """
+        Reopen an interrupted session (routine resume) and keep appending to it
+        in new segments; the index is first brought up to date with what the
+        last segments actually hold.
+        """
+        if self.continuous_saving:
+            return False
+        self._close_files()
+        try:
+            self.session_index = index = SessionIndex.load(index_path)
+            meta = index.meta
+            self._recover_segments(index)
+            self._record_dtype = dtype_from_meta(meta["records_dtype"])
+            self._stats_dtype = dtype_from_meta(meta["stats_dtype"]) if "stats_dtype" in meta else None
+            first_scan = 0
+            if "spectra" in meta:
+                first_scan = self._recover_spectra(index)
+            ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            csv_header = (
+                f"# Routine: {meta.get('routine', 'Unknown')}\n"
+                f"# Cycles: {meta.get('cycles', 1)}\n"
+                f"# Repetitions: {meta.get('repetitions', 1)}\n"
+                f"# Resumed: {ts}\n"
+                f"# ----------------------------------------\n"
+                + ",".join(HOUSEKEEPING_COLUMNS + ([] if "spectra" in meta else
+                                                   [f"Pixel_{i}" for i in range(meta["npix"])])) + "\n"
+            )
+            meta.setdefault("resumed", []).append({"time": ts, "event_seq": self.events.last_seq + 1})
+            self._open_streams(index.session_name, meta["npix"], csv_header, first_scan)
+        except Exception as e:
+            self.parent.statusBar().showMessage(f"Cannot resume data session: {e}")
+            self._close_files()
+            return False
+        self.csv_file_path = self.csv_file.path
+        self.session_index.save()
+        
+        self.current_routine_name = meta.get("routine", "Unknown")
+        self.current_cycles = meta.get("cycles", 1)
+        self.current_repetitions = meta.get("repetitions", 1)
+        self._segment = None
+        self._last_scan_seq = None
+        self.dropped_scans = 0
+        self.continuous_saving = True
+        self.write_log(f"Resumed data session {index.session_name}")
+        self.parent.statusBar().showMessage(f"Resumed continuous data saving to {self.csv_file_path}")
+        return True
+    
+    def _recover_segments(self, index):
+        """Sizes and record counts of the segments a crash left unrecorded in the index"""
+        records = dtype_from_meta(index.meta["records_dtype"]) if "records_dtype" in index.meta else None
+        for stream, segments in index.streams.items():
+            for entry in segments:
+                path = os.path.join(index.directory, entry["file"])
+                if not os.path.exists(path):
+                    continue
+                size = os.path.getsize(path)
+                if size == entry.get("bytes"):
+                    continue
+                entry["bytes"] = size
+                if stream == "records" and records is not None:
+                    entry["records"] = size // records.itemsize
+                elif stream == "scans":
+                    with open(path, "r", encoding="utf-8", errors="replace") as f:
+                        rows = sum(1 for line in f if line.strip() and not line.startswith("#"))
+                    entry["records"] = max(rows - 1, 0)  # less the column header row
+                entry["recovered"] = True
+    
+    def _recover_spectra(self, index):
+        """
+        Number of the first spectrum written after a resume. Scans still
+        buffered in the block writer at the crash have records but no spectra;
+        numbering continues from the record count so later records keep
+        matching their spectra, and the missing range is noted in the index.
+        """
+        spx = os.path.join(index.directory, index.meta["spectra"]["block_index"])
+        spectra = 0
+        if os.path.exists(spx):
+            # Drop a block index entry cut short by the crash
+            entries = os.path.getsize(spx) // BLOCK_INDEX_DTYPE.itemsize
+            os.truncate(spx, entries * BLOCK_INDEX_DTYPE.itemsize)
+            blocks = np.fromfile(spx, dtype=BLOCK_INDEX_DTYPE)
+            if len(blocks):
+                spectra = int(blocks[-1]["first_scan"] + blocks[-1]["n_scans"])
+        records = sum(entry.get("records", 0) for entry in index.segments("records"))
+        if records > spectra:
+            index.meta["spectra"].setdefault("gaps", []).append(
+                {"first_scan": spectra, "n_scans": records - spectra})
+            self.write_log(f"{records - spectra} spectra lost in the interruption of "
+                           f"{index.session_name}", level="WARNING")
+        return max(records, spectra)
+    
+    def _close_files(self):
+        """Close the active segments and finalize the session index"""
+        if self.csv_file:
+            self.csv_file.close()
+            self.csv_file = None
+        if self.record_file:
+            self.record_file.close()
+            self.record_file = None
+        if self.stats_file:
+            self.stats_file.close()
+            self.stats_file = None
+        if self.spectra_writer:
+            self.spectra_writer.close()
+            self.spectra_writer = None
+    
+    def on_scan(self, seq, timestamp, intens, snapshot=None):
+        """Log one acquired scan (connected to SpectrometerController.scan_signal)"""
         if not self.continuous_saving:
             return
         
-        # Check if hardware state has changed
-        current_motor_angle = 0
-        if hasattr(self.parent.hw.motor_ctrl, "current_angle_deg"):
-            current_motor_angle = self.parent.hw.motor_ctrl.current_angle_deg
+        # Each scan is logged exactly once; a gap in sequence numbers means scans were lost
+        if self._last_scan_seq is not None:
+            if seq <= self._last_scan_seq:
+                return
+            if seq > self._last_scan_seq + 1:
+                self.dropped_scans += seq - self._last_scan_seq - 1
+        self._last_scan_seq = seq
+        
+        if self._hardware_changing:
+            return
+        
+        # Housekeeping as it stood when the scan arrived (taken by the spectrometer callback)
+        if snapshot is None:
+            snapshot = telemetry.store.snapshot()
+        values = {name: sample.value for name, sample in snapshot.items()}
+        
+        # The encoder angle is published on every poll during a move: scans taken
+        # then are at no requested angle, so they are not logged
+        if values.get("motor.moving"):
+            self.save_averaged_data()
+            return
+        
+        # Never average across a motor, filter or integration-time change, and
+        # close the segment once it spans the configured number of scans
+        key = (values.get("motor.angle_deg", 0.0), values.get("filter.position", 0),
+               values.get("spec.integration_time_ms", 0.0))
+        if self._segment is not None and (self._segment.key != key or
+                                          self._segment.count >= self.scans_per_average):
+            self.save_averaged_data()
+        if self._segment is None:
+            self._segment = SegmentAccumulator(key, len(intens))
+        
+        self._segment.add(intens, timestamp=timestamp, seq=seq,
+                          housekeeping=self._housekeeping_values(values))
+        
+        if self._segment.count >= self.scans_per_average:
+            self.save_averaged_data()
+    
+    def _housekeeping_values(self, values):
+        """Housekeeping columns (after Timestamp) from a telemetry snapshot"""
+        get = values.get
+        accel = get("imu.accel_g", (0.0, 0.0, 0.0))
+        mag = get("imu.mag_uT", (0.0, 0.0, 0.0))
+        return [
+            self.current_routine_name, self.current_cycles, self.current_repetitions,
+            get("motor.angle_deg", 0.0), get("filter.position", 0),
+            get("imu.roll_deg", 0.0), get("imu.pitch_deg", 0.0), get("imu.yaw_deg", 0.0),
+            accel[0], accel[1], accel[2],
+            mag[0], mag[1], mag[2],
+            get("imu.pressure_hPa", 0.0), get("imu.temperature_C", 0.0),
+            get("temp.current_C", 0.0), get("temp.setpoint_C", 0.0), get("temp.aux_C", 0.0),
+            get("imu.latitude_deg", 0.0), get("imu.longitude_deg", 0.0),
+            get("spec.integration_time_ms", 0.0) * 1000,
+            get("thp.temperature_C", 0.0), get("thp.humidity_pct", 0.0), get("thp.pressure_hPa", 0.0),
+        ]
+    
+    def save_averaged_data(self):
+        """Close the open segment and write its summary right away"""
+        segment, self._segment = self._segment, None
+        if segment is None or segment.count == 0 or not self.csv_file:
+            return
         
-        current_filter_pos = self.parent.hw.filter_ctrl.get_position
\ No newline at end of file
+        intens = segment.mean()
+        timestamp = segment.last_time
+        values = segment.housekeeping + [segment.last_seq, segment.count]
+        row = [timestamp.strftime("%Y-%m-%d %H:%M:%S.%f")] + values
+        line = ",".join(str(v) for v in row)
+        if not self.spectra_writer:
+            line += "," + ",".join(f"{v:.4f}" for v in intens)
+        try:
+            self.csv_file.write(line + "\n", timestamp=timestamp)
+            self.csv_file.flush()
+            self.csv_file_path = self.csv_file.path
+            self._write_record(timestamp, values[1:], intens)
+            if self.spectra_writer:
+                # Mean of k scans that were each averaged over N hardware scans:
+                # a multiple of 1/(N*k) counts, so that scale stores it exactly
+                averages = getattr(self.parent.hw.spec_ctrl, 'current_averages', 1)
+                self.spectra_writer.append(intens, scale=averages * segment.count, timestamp=timestamp)
+            if self.stats_file and segment.count > 1:
+                self._write_stats(segment)
+        except Exception as e:
+            self.parent.statusBar().showMessage(f"Data write error: {e}")
+    
+    def _write_stats(self, segment):
+        """Append the per-pixel spread of a multi-scan segment to the stats stream"""
+        rec = np.zeros(1, dtype=self._stats_dtype)
+        rec["Timestamp"] = segment.last_time.timestamp()
+        rec["SegmentStart"] = segment.first_time.timestamp()
+        rec["NScans"] = segment.count
+        n = min(segment.npix, self._stats_dtype["SpectrumStd"].shape[0])
+        rec["SpectrumStd"][0, :n] = segment.std()[:n]
+        rec["SpectrumMin"][0, :n] = segment.min[:n]
+        rec["SpectrumMax"][0, :n] = segment.max[:n]
+        self.stats_file.write(rec.tobytes(), timestamp=segment.last_time)
+        self.stats_file.flush()
+    
+    def _write_record(self, timestamp, values, intens):
+        """Append one fixed-size binary record mirroring a CSV scan row"""
+        if not self.record_file:
+            return
+        rec = np.zeros(1, dtype=self._record_dtype)
+        rec["Timestamp"] = timestamp.timestamp()
+        for name, value in zip(HOUSEKEEPING_COLUMNS[2:], values):
+            rec[name] = value
+        if "Spectrum" in self._record_dtype.names:
+            spectrum = rec["Spectrum"][0]
+            n = min(len(spectrum), len(intens))
+            spectrum[:n] = intens[:n]
+        self.record_file.write(rec.tobytes(), timestamp=timestamp)
+        self.record_file.flush()
+    
+    def write_log(self, message, level=None, source="data_logger"):
+        """Queue a structured event (severity inferred from the text if not given)"""
+        self.events.log(message, level=level, source=source)
+    
+    def shutdown(self):
+        """Stop saving and write out the event queue"""
+        if self.continuous_saving:
+            self.toggle_data_saving()
+        self.events.close()
@@ -2,6 +2,7 @@
 Hardware manager for initializing and managing hardware controllers
 """
 import os
+from functools import partial
 from PyQt5.QtWidgets import QGroupBox, QWidget
 from PyQt5.QtCore import QTimer
 
@@ -33,16 +34,18 @@ class HardwareManager:
         try:
             self.thp_ctrl = THPController(port=thp_port, parent=self.parent)
             self.thp_ctrl.status_signal.connect(self.parent.statusBar().showMessage)
+            self.thp_ctrl.status_signal.connect(partial(self.parent.handle_status_message, source="thp"))
         except Exception as e:
             self.parent.statusBar().showMessage(f"THP sensor initialization failed: {e}")
             # Create a dummy THP controller to prevent errors
             self.thp_ctrl = THPController(port=None, parent=self.parent)
             self.thp_ctrl.status_signal.connect(self.parent.statusBar().showMessage)
+            self.thp_ctrl.status_signal.connect(partial(self.parent.handle_status_message, source="thp"))
         
         # Spectrometer - set auto_connect to True
         self.spec_ctrl = SpectrometerController(parent=self.parent, auto_connect=True)
         self.spec_ctrl.status_signal.connect(self.parent.statusBar().showMessage)
-        self.spec_ctrl.status_signal.connect(self.parent.handle_status_message)
+        self.spec_ctrl.status_signal.connect(partial(self.parent.handle_status_message, source="spectrometer"))
         # Add widget attribute to match the expected interface
         if hasattr(self.spec_ctrl, 'groupbox'):
             self.spec_ctrl.widget = self.spec_ctrl.groupbox
@@ -52,14 +55,14 @@ class HardwareManager:
         self.temp_ctrl = TempController(parent=self.parent)
         self.temp_ctrl.port = temp_port  # Set port from config
         self.temp_ctrl.status_signal.connect(self.parent.statusBar().showMessage)
-        self.temp_ctrl.status_signal.connect(self.parent.handle_status_message)
+        self.temp_ctrl.status_signal.connect(partial(self.parent.handle_status_message, source="temperature"))
         
         # Motor controller
         motor_port = self.config.get("motor", "COM11")
         self.motor_ctrl = MotorController(parent=self.parent)
         self.motor_ctrl.port = motor_port  # Set port from config
         self.motor_ctrl.status_signal.connect(self.parent.statusBar().showMessage)
-        self.motor_ctrl.status_signal.connect(self.parent.handle_status_message)
+        self.motor_ctrl.status_signal.connect(partial(self.parent.handle_status_message, source="motor"))
         # Add widget attribute to match the expected interface
         if hasattr(self.motor_ctrl, 'groupbox'):
             self.motor_ctrl.widget = self.motor_ctrl.groupbox
@@ -69,7 +72,7 @@ class HardwareManager:
         self.filter_ctrl = FilterWheelController(parent=self.parent)
         self.filter_ctrl.port = filter_port  # Set port from config
         self.filter_ctrl.status_signal.connect(self.parent.statusBar().showMessage)
-        self.filter_ctrl.status_signal.connect(self.parent.handle_status_message)
+        self.filter_ctrl.status_signal.connect(partial(self.parent.handle_status_message, source="filterwheel"))
         # Add widget attribute to match the expected interface
         if hasattr(self.filter_ctrl, 'groupbox'):
             self.filter_ctrl.widget = self.filter_ctrl.groupbox
@@ -79,7 +82,7 @@ class HardwareManager:
         self.imu_ctrl = IMUController(parent=self.parent)
         self.imu_ctrl.port = imu_port  # Set port from config
         self.imu_ctrl.status_signal.connect(self.parent.statusBar().showMessage)
-        self.imu_ctrl.status_signal.connect(self.parent.handle_status_message)
+        self.imu_ctrl.status_signal.connect(partial(self.parent.handle_status_message, source="imu"))
         # Add widget attribute to match the expected interface
         if hasattr(self.imu_ctrl, 'groupbox'):
             self.imu_ctrl.widget = self.imu_ctrl.groupbox
@@ -106,8 +109,8 @@ class HardwareManager:
     
     def shutdown(self):
         """Shutdown all hardware controllers"""
-        # Add any necessary cleanup for hardware controllers
-        pass
+        self.motor_ctrl.shutdown()
+        self.temp_ctrl.shutdown()
 
 
 
@@ -2,44 +2,242 @@
 Routine manager for handling automated routines
 """
 import os
+import json
 import time
 import datetime
+import threading
 from PyQt5.QtCore import QObject, QThread, pyqtSignal, QTimer
 
+import telemetry
+from routines.compiler import compile_file, device_of, RoutineCompileError, RoutineRuntimeError
+from routines.simulator import simulate, MAX_SIMULATION_STEPS
+from routines.timing import TimingModel, format_seconds
+from routines.tracing import RoutineTracer, LatencyHistograms, perfetto_trace
+from routines.checkpoint import (save_checkpoint, load_checkpoint, clear_checkpoint, make_checkpoint,
+                                 restore_cursor, track_hardware, forget_hardware, reconcile,
+                                 failed_lines)
+
+# Longest time to wait for a command's completion event, per device (seconds)
+COMMAND_TIMEOUTS = {
+    "motor": 30.0,
+    "filter": 15.0,
+    "spectrometer": 15.0,
+    "temp": 5.0,
+    "data": 10.0,
+    "camera": 10.0,
+    "log": 2.0,
+}
+DEFAULT_TIMEOUT = 10.0
+
+# Fixed delay the previous executor added after every non-wait command (for comparison)
+LEGACY_COMMAND_DELAY = 0.5
+
+
+def legacy_duration(program, start=None):
+    """Wall-clock time of the fixed-delay executor: every wait plus 0.5 s per other command"""
+    total = [0.0]
+    start = time.time() if start is None else start
+    cursor = program.cursor(clock=lambda: start + total[0])
+    for _ in range(MAX_SIMULATION_STEPS):
+        try:
+            instr = cursor.next()
+        except RoutineRuntimeError:
+            continue
+        if instr is None:
+            return total[0]
+        for sub in (instr.args if instr.op == "parallel" else (instr,)):
+            total[0] += sub.args[0] / 1000 if sub.op == "wait" else LEGACY_COMMAND_DELAY
+    return float("inf")
+
+
+class CommandCompletion:
+    """Completion event for one dispatched command, set from the GUI thread"""
+    
+    def __init__(self, instr):
+        self.instr = instr
+        self.ok = True
+        self.message = ""
+        self.dispatched = time.monotonic()
+        self.finished = None
+        self._event = threading.Event()
+    
+    def done(self, ok=True, message=""):
+        if self._event.is_set():
+            return
+        self.ok = bool(ok)
+        self.message = message
+        self.finished = time.monotonic()
+        self._event.set()
+    
+    def is_done(self):
+        return self._event.is_set()
+    
+    def wait(self, timeout):
+        return self._event.wait(timeout)
+
+
 class RoutineWorker(QThread):
-    """Worker thread for executing routine commands"""
-    command_signal = pyqtSignal(str)
+    """Worker thread executing a compiled routine (routines.compiler.Program)"""
+    command_signal = pyqtSignal(object, object)  # (Instruction, CommandCompletion)
     status_signal = pyqtSignal(str)
     finished_signal = pyqtSignal()
     
-    def __init__(self, commands, parent=None):
+    def __init__(self, program, timeouts=None, parent=None, cursor=None, prelude=(),
+                 checkpoint_path=None, session=None, hardware=None, step=0, failed=None):
         super().__init__(parent)
-        self.commands = commands
+        self.program = program
+        self.timeouts = dict(COMMAND_TIMEOUTS, **(timeouts or {}))
         self.running = True
+        self.elapsed = 0.0
+        self.timed_out = []
+        self.completed = False
+        # Resuming: a restored cursor and the commands that reconcile the hardware first
+        self.cursor = cursor
+        self.prelude = list(prelude)
+        # Checkpoint after every finished step (routines.checkpoint); session() names
+        # the data-logging session in use. Steps that failed or timed out are passed
+        # and listed in the checkpoint, so a resume reports them instead of repeating
+        # the whole run after them.
+        self.checkpoint_path = checkpoint_path
+        self.session = session or (lambda: None)
+        self.hardware = dict(hardware or {})
+        self.step = step
+        self.failed_steps = list(failed or [])
+        # Issue/completion time and outcome of every command (routines.tracing); the
+        # command records also fit the timing model (routines.simulator)
+        self.tracer = RoutineTracer(0.0, telemetry.store.get("motor.angle_deg"))
+        self.trace = self.tracer.commands
     
     def run(self):
-        """Execute routine commands"""
-        for cmd in self.commands:
+        """Execute the program, each command waiting for its completion event"""
+        start = self.tracer.start = time.monotonic()
+        last_dispatch = start
+        for instr in self.prelude:
             if not self.running:
                 break
-                
-            # Process command
-            self.command_signal.emit(cmd)
-            self.status_signal.emit(f"Executing: {cmd}")
+            self._join(instr, self._dispatch(instr), time.monotonic() + self._timeout(instr))
+        
+        # Loops and $variables are expanded one instruction at a time as the routine runs
+        cursor = self.cursor or self.program.cursor()
+        while self.running:
+            try:
+                instr = cursor.next()
+            except RoutineRuntimeError as e:
+                self.status_signal.emit(f"Skipped: {e}")
+                continue
+            if instr is None:
+                self.completed = True
+                break
+            
+            # parallel ... end: dispatch every command in the block, then join on all of them
+            if instr.op == "parallel":
+                last_dispatch, ok = self._run_parallel(instr.args)
+                self.tracer.block(instr.line, last_dispatch, time.monotonic())
+            
+            # wait <ms> is a minimum settle time counted from when the previous command
+            # was issued, so time already spent waiting for its completion counts toward it.
+            # Consecutive waits add up (the next one counts from where this one ended).
+            elif instr.op == "wait":
+                waited = time.monotonic()
+                self._sleep(last_dispatch + instr.args[0] / 1000 - time.monotonic())
+                last_dispatch = max(last_dispatch + instr.args[0] / 1000, time.monotonic())
+                self.tracer.wait(instr, waited, time.monotonic())
+                ok = self.running
             
-            # Handle wait commands directly in the thread
-            if cmd.startswith("wait "):
-                try:
-                    wait_time = int(cmd.split()[1])
-                    time.sleep(wait_time / 1000)  # Convert ms to seconds
-                except (IndexError, ValueError):
-                    self.status_signal.emit(f"Invalid wait command: {cmd}")
             else:
-                # For other commands, wait a bit to ensure they complete
-                time.sleep(0.5)
+                last_dispatch = time.monotonic()
+                completion = self._dispatch(instr)
+                ok = self._join(instr, completion, last_dispatch + self._timeout(instr))
+            
+            self._checkpoint(cursor, instr, ok)
         
+        self.elapsed = time.monotonic() - start
         self.finished_signal.emit()
     
+    def _run_parallel(self, block):
+        """Run one parallel block (one command per device); returns its dispatch time"""
+        dispatched = time.monotonic()
+        pending = [(instr, self._dispatch(instr)) for instr in block if instr.op != "wait"]
+        ok = True
+        for instr, completion in pending:
+            ok = self._join(instr, completion, dispatched + self._timeout(instr)) and ok
+        
+        # A wait inside the block is the minimum duration of the whole block
+        settle = max([instr.args[0] / 1000 for instr in block if instr.op == "wait"], default=0.0)
+        self._sleep(dispatched + settle - time.monotonic())
+        return dispatched, ok
+    
+    def _checkpoint(self, cursor, instr, ok):
+        """Persist the position after a finished step; a step cut short by Stop is repeated on resume"""
+        if not ok and not self.running:
+            return
+        self.step += 1
+        if ok:
+            for done in (instr.args if instr.op == "parallel" else (instr,)):
+                track_hardware(self.hardware, done)
+        else:
+            # Failed or timed out: the device state is unknown, so resume re-establishes it
+            for failed in (instr.args if instr.op == "parallel" else (instr,)):
+                forget_hardware(self.hardware, failed)
+            self.failed_steps.append({"step": self.step, "line": instr.line, "text": instr.text})
+        if not self.checkpoint_path:
+            return
+        try:
+            save_checkpoint(self.checkpoint_path, make_checkpoint(
+                self.program, cursor, self.step, instr, self.hardware, self.session(),
+                self.failed_steps))
+        except OSError as e:
+            self.status_signal.emit(f"Could not write checkpoint: {e}")
+    
+    def _dispatch(self, instr):
+        self.status_signal.emit(f"Executing: {instr.text}")
+        completion = CommandCompletion(instr)
+        self.command_signal.emit(instr, completion)
+        return completion
+    
+    def _join(self, instr, completion, deadline):
+        """Wait for one command's completion until deadline (monotonic); True if it succeeded"""
+        done = self._wait(completion, deadline - time.monotonic())
+        if completion.is_done():
+            outcome = "ok" if completion.ok else "failed"
+        else:
+            outcome = "timeout" if done is False else "stopped"
+        if outcome == "timeout":
+            self.timed_out.append(instr)
+            self.status_signal.emit(f"Timeout after {self._timeout(instr):.0f} s: {instr.text} (line {instr.line})")
+        elif outcome == "failed":
+            self.status_signal.emit(f"Command failed: {instr.text} (line {instr.line}) {completion.message}".rstrip())
+        finished = completion.finished if outcome in ("ok", "failed") else None
+        self.tracer.command(instr, completion.dispatched, finished, outcome, completion.message)
+        return outcome == "ok"
+    
+    def _timeout(self, instr):
+        if instr.op == "temp.wait_stable":
+            # Bounded by its own timeout argument; the controller reports that failure
+            return instr.args[2] + self.timeouts.get("temp", DEFAULT_TIMEOUT)
+        return self.timeouts.get(device_of(instr), DEFAULT_TIMEOUT)
+    
+    def _wait(self, completion, timeout):
+        """Wait for completion in short slices so stop() takes effect promptly"""
+        deadline = time.monotonic() + timeout
+        while self.running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return completion.is_done()
+            if completion.wait(min(remaining, 0.1)):
+                return True
+        return True
+    
+    def _sleep(self, seconds):
+        if seconds <= 0:
+            return
+        deadline = time.monotonic() + seconds
+        while self.running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, 0.1))
+    
     def stop(self):
         """Stop routine execution"""
         self.running = False
@@ -54,40 +252,72 @@ class RoutineManager(QObject):
     def __init__(self, parent):
         super().__init__(parent)
         self.parent = parent
-        self.routine_commands = []
+        self.program = None
         self.current_routine_name = "Unknown"
         self.routine_file_path = None
         self.routine_running = False
         self.worker = None
+        self.command_timeouts = getattr(parent, 'config', {}).get("routine_timeouts", {})
+        # Parameters fitted with python -m routines.simulator --fit can be set in the config
+        self.timing_model = TimingModel(getattr(parent, 'config', {}).get("timing_model", {}))
+        # Progress of the current run, for resuming after a crash or a stop (routines.checkpoint)
+        data_logger = getattr(parent, 'data_logger', None)
+        self.checkpoint_path = (os.path.join(data_logger.log_dir, "routine_checkpoint.json")
+                                if data_logger is not None else None)
+        # Command latencies of every run since startup, per command type (routines.tracing)
+        self.latency = LatencyHistograms()
+        
+        # Instruction op -> handler(args, completion), run in the GUI thread
+        self._handlers = {
+            "log": self._log,
+            "motor.move": self._motor_move,
+            "motor.home": self._motor_home,
+            "filter.position": self._filter_position,
+            "filter.home": self._filter_home,
+            "spectrometer.start": self._spec_start,
+            "spectrometer.stop": self._spec_stop,
+            "spectrometer.save": self._spec_save,
+            "spectrometer.settings": self._spec_settings,
+            "temp.setpoint": self._temp_setpoint,
+            "temp.wait_stable": self._temp_wait_stable,
+            "temp.off": self._temp_off,
+            "data.start": self._data_start,
+            "data.stop": self._data_stop,
+            "data.snapshot": self._data_snapshot,
+            "camera.capture": self._camera_capture,
+        }
     
     def load_routine_file(self, file_path):
-        """Load a routine file"""
+        """Compile a routine file; errors are reported with line numbers"""
         if not file_path:
             return False
         
         try:
-            with open(file_path, 'r') as f:
-                self.routine_commands = f.readlines()
-            
-            # Remove comments and empty lines
-            self.routine_commands = [line.strip() for line in self.routine_commands 
-                                    if line.strip() and not line.strip().startswith('#')]
-            
-            if self.routine_commands:
-                self.routine_file_path = file_path
-                self.current_routine_name = os.path.basename(file_path).replace('.txt', '')
-                self.routine_status_changed.emit()  # Add this line
-                return True
-            else:
-                return False
-            
+            program = compile_file(file_path)
+        except RoutineCompileError as e:
+            self.parent.statusBar().showMessage(
+                f"Routine has {len(e.errors)} error(s): {e.errors[0]}")
+            for error in e.errors:
+                self.parent.handle_status_message(error, source="routine")
+            return False
         except Exception as e:
             self.parent.statusBar().showMessage(f"Error loading routine: {e}")
             return False
+        
+        for warning in program.warnings:
+            self.parent.handle_status_message(warning, source="routine")
+        if not program.instructions:
+            return False
+        
+        self.program = program
+        self.routine_file_path = file_path
+        self.current_routine_name = program.name
+        self.routine_status_changed.emit()  # Add this line
+        return True
     
     def run_routine(self):
-        """Run the loaded routine commands"""
-        if not self.routine_commands:
+        """Run the loaded routine"""
+        if not self.program:
             self.parent.statusBar().showMessage("No routine commands loaded")
             return
         
@@ -97,10 +327,93 @@ class RoutineManager(QObject):
             return
         
         self.routine_running = True
-        self.parent.statusBar().showMessage(f"Running routine: {self.current_routine_name}")
+        self._legacy_duration = legacy_duration(self.program)
+        self.parent.statusBar().showMessage(
+            f"Running routine: {self.current_routine_name} "
+            f"(estimated {format_seconds(self.program.estimate_duration(self.timing_model))}, "
+            f"fixed-delay executor: {format_seconds(self._legacy_duration)})")
+        
+        # A new run replaces any earlier interrupted one
+        if self.checkpoint_path:
+            clear_checkpoint(self.checkpoint_path)
+        self._start_worker(RoutineWorker(self.program, timeouts=self.command_timeouts,
+                                         checkpoint_path=self.checkpoint_path,
+                                         session=self._data_session))
+    
+    def interrupted_routine(self):
+        """Checkpoint of a routine that did not finish, or None"""
+        if not self.checkpoint_path:
+            return None
+        return load_checkpoint(self.checkpoint_path)
+    
+    def _data_session(self):
+        """Index file of the data-logging session being written, if any"""
+        data_logger = self.parent.data_logger
+        if data_logger.continuous_saving and data_logger.session_index is not None:
+            return data_logger.session_index.path
+        return None
+    
+    def _current_hardware(self):
+        """Device state as the controllers and telemetry report it now"""
+        spec = self.parent.hw.spec_ctrl
+        return {
+            "motor_angle": telemetry.store.get("motor.angle_deg"),
+            "filter_position": telemetry.store.get("filter.position"),
+            "integration_ms": telemetry.store.get("spec.integration_time_ms"),
+            "temp_setpoint": telemetry.store.get("temp.setpoint_C"),
+            "measuring": bool(getattr(spec, 'measure_active', False)),
+        }
+    
+    def resume_routine(self):
+        """Continue the interrupted routine after its last completed step"""
+        if self.routine_running:
+            return False
+        doc = self.interrupted_routine()
+        if doc is None:
+            self.parent.statusBar().showMessage("No interrupted routine to resume")
+            return False
+        try:
+            program = compile_file(doc["source"])
+            cursor = restore_cursor(program, doc)
+        except (OSError, ValueError) as e:
+            self.parent.statusBar().showMessage(f"Cannot resume routine: {e}")
+            self.parent.handle_status_message(f"Cannot resume routine: {e}", source="routine")
+            return False
+        
+        self.program = program
+        self.routine_file_path = doc["source"]
+        self.current_routine_name = program.name
+        hardware = doc.get("hardware", {})
+        
+        # Keep writing to the session that was being logged at the checkpoint, whether
+        # the routine started it with "data start" or logging was started by hand
+        session = doc.get("session")
+        data_logger = self.parent.data_logger
+        if session and not data_logger.continuous_saving:
+            if not data_logger.resume_session(session):
+                self.parent.handle_status_message(f"Could not reopen data session {session}", source="routine")
         
-        # Create and start worker thread
-        self.worker = RoutineWorker(self.routine_commands)
+        prelude = reconcile(hardware, self._current_hardware())
+        message = (f"Resuming routine: {program.name} after line {doc['line']} ({doc['text']}), "
+                   f"step {doc['step']}")
+        failed = doc.get("failed", [])
+        if failed:
+            message += f"; {len(failed)} earlier step(s) failed: {failed_lines(failed)}"
+        if prelude:
+            message += f"; restoring {', '.join(i.text.split('  (')[0] for i in prelude)}"
+        self.parent.statusBar().showMessage(message)
+        self.parent.handle_status_message(message, source="routine")
+        
+        self.routine_running = True
+        self._legacy_duration = None
+        self._start_worker(RoutineWorker(program, timeouts=self.command_timeouts, cursor=cursor,
+                                         prelude=prelude, checkpoint_path=self.checkpoint_path,
+                                         session=self._data_session, hardware=hardware,
+                                         step=doc["step"], failed=failed))
+        return True
+    
+    def _start_worker(self, worker):
+        self.worker = worker
         self.worker.command_signal.connect(self._process_command)
         self.worker.status_signal.connect(self.parent.statusBar().showMessage)
         self.worker.finished_signal.connect(self._routine_finished)
@@ -110,6 +423,45 @@ class RoutineManager(QObject):
         self.routine_started_signal.emit()
         self.routine_status_changed.emit()  # Add this line
     
+    def dry_run(self):
+        """Simulate the loaded routine against the timing model; returns the Timeline"""
+        if not self.program:
+            self.parent.statusBar().showMessage("No routine commands loaded")
+            return None
+        
+        timeline = simulate(self.program, self.timing_model)
+        busy = ", ".join(f"{device} {seconds:.1f} s" for device, seconds in sorted(timeline.per_device().items()))
+        message = (f"Dry run of '{self.current_routine_name}': {format_seconds(timeline.total)} "
+                   f"over {len(timeline.entries)} steps (simulated in {timeline.cpu_time * 1000:.1f} ms)")
+        self.parent.statusBar().showMessage(message)
+        self.parent.handle_status_message(f"{message}; busy: {busy}", source="routine")
+        for error in timeline.skipped[:10]:
+            self.parent.handle_status_message(f"Dry run would skip: {error}", source="routine")
+        return timeline
+    
+    def save_trace(self, worker):
+        """
+        Write the run's trace next to the event logs: routine_trace_<ts>.json
+        (command durations, for fitting the timing model) and the same run as a
+        Chrome/Perfetto timeline, routine_trace_<ts>.perfetto.json
+        """
+        data_logger = getattr(self.parent, 'data_logger', None)
+        if data_logger is None or not worker.trace:
+            return None
+        ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(data_logger.log_dir, f"routine_trace_{ts}.json")
+        doc = dict(worker.tracer.to_dict(), routine=self.current_routine_name, source=self.program.source,
+                   elapsed=round(worker.elapsed, 6), histograms=worker.tracer.histograms().to_dict())
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(doc, f)
+            with open(path[:-len(".json")] + ".perfetto.json", "w", encoding="utf-8") as f:
+                json.dump(perfetto_trace(doc, self.current_routine_name or "routine"), f)
+        except OSError as e:
+            self.parent.handle_status_message(f"Could not write routine trace: {e}", source="routine")
+            return None
+        return path
+    
     def stop_routine(self):
         """Stop the running routine"""
         if self.worker and self.routine_running:
@@ -123,118 +475,182 @@ class RoutineManager(QObject):
     def _routine_finished(self):
         """Handle routine completion"""
         self.routine_running = False
-        self.parent.statusBar().showMessage(f"Routine '{self.current_routine_name}' completed")
+        worker = self.worker
+        if worker.completed:
+            message = f"Routine '{self.current_routine_name}' completed in {worker.elapsed:.1f} s"
+            if self._legacy_duration is not None:
+                message += f" (fixed-delay executor: {format_seconds(self._legacy_duration)})"
+        else:
+            message = f"Routine '{self.current_routine_name}' stopped after {worker.elapsed:.1f} s"
+        if worker.timed_out:
+            message += f", {len(worker.timed_out)} command(s) timed out"
+        if worker.failed_steps:
+            message += (f", {len(worker.failed_steps)} step(s) failed: "
+                        f"{failed_lines(worker.failed_steps)}")
+        if self.checkpoint_path:
+            if worker.completed:
+                clear_checkpoint(self.checkpoint_path)
+            else:
+                message += "; resume continues where it stopped"
+        self.save_trace(worker)
+        self.latency.add_all(worker.trace)
+        self.parent.statusBar().showMessage(message)
+        self.parent.handle_status_message(message, source="routine")
+        for line in worker.tracer.histograms().summary():
+            self.parent.handle_status_message(f"Latency {line}", source="routine")
         
         # Emit signal that routine has finished
         self.routine_finished_signal.emit()
         self.routine_status_changed.emit()  # Add this line
     
-    def _process_command(self, cmd):
-        """Process a routine command"""
-        parts = cmd.split()
-        if not parts:
+    def _complete_on(self, signal, completion, check=None, match=None):
+        """
+        Complete on the next emission of signal (check(*args) -> ok), then
+        disconnect; emissions for which match(*args) is false are ignored
+        """
+        def slot(*args):
+            if match is not None and not match(*args):
+                return
+            try:
+                signal.disconnect(slot)
+            except TypeError:
+                pass
+            completion.done(check(*args) if check else True)
+        signal.connect(slot)
+    
+    def _process_command(self, instr, completion):
+        """Run one compiled instruction; completion is set when the device reports it done"""
+        try:
+            self._handlers[instr.op](instr.args, completion)
+        except Exception as e:
+            self.parent.statusBar().showMessage(f"Routine command error (line {instr.line}): {e}")
+            completion.done(False, str(e))
+    
+    # -------------  Command handlers  ----------------------------------
+    
+    def _log(self, args, completion):
+        self.parent.handle_status_message(args[0], source="routine")
+        completion.done()
+    
+    def _motor_move(self, args, completion):
+        # Done when the encoder shows the motor in position
+        motor_ctrl = self.parent.hw.motor_ctrl
+        self._complete_on(motor_ctrl.arrived_signal, completion, lambda ok, angle: ok)
+        if not motor_ctrl.move_to(args[0]):
+            completion.done(False, "not sent")
+    
+    def _motor_home(self, args, completion):
+        self._motor_move((0.0,), completion)
+    
+    def _filter_position(self, args, completion):
+        # Done on the wheel's position report
+        position = args[0]
+        filter_ctrl = self.parent.hw.filter_ctrl
+        self._complete_on(filter_ctrl.position_signal, completion, lambda pos: pos == position)
+        if not filter_ctrl.set_position(position):
+            completion.done(False, "not sent")
+    
+    def _filter_home(self, args, completion):
+        filter_ctrl = self.parent.hw.filter_ctrl
+        self._complete_on(filter_ctrl.position_signal, completion, lambda pos: pos == 1)
+        if not filter_ctrl._send("F1r"):
+            completion.done(False, "not sent")
+    
+    def _spec_start(self, args, completion):
+        # Done when the first scan arrives
+        spec = self.parent.hw.spec_ctrl
+        self._complete_on(spec.scan_signal, completion)
+        if not spec.start():
+            completion.done(False, "not started")
+    
+    def _spec_stop(self, args, completion):
+        spec = self.parent.hw.spec_ctrl
+        if not spec.measure_active:
+            completion.done()
             return
-        
-        # Log command
-        if parts[0] == "log":
-            message = " ".join(parts[1:])
-            self.parent.handle_status_message(message)
-        
-        # Motor commands
-        elif parts[0] == "motor" and len(parts) >= 3:
-            if parts[1] == "move" and len(parts) >= 3:
-                try:
-                    angle = float(parts[2])
-                    self.parent.hw.motor_ctrl.move_to_angle(angle)
-                except (ValueError, IndexError):
-                    self.parent.statusBar().showMessage(f"Invalid motor command: {cmd}")
-            elif parts[1] == "home":
-                self.parent.hw.motor_ctrl.home()
-        
-        # Filter wheel commands
-        elif parts[0] == "filter" and len(parts) >= 3:
-            if parts[1] == "position" and len(parts) >= 3:
-                try:
-                    position = int(parts[2])
-                    self.parent.hw.filter_ctrl.move_to_position(position)
-                except (ValueError, IndexError):
-                    self.parent.statusBar().showMessage(f"Invalid filter command: {cmd}")
-            elif parts[1] == "home":
-                self.parent.hw.filter_ctrl.home()
-        
-        # Spectrometer commands
-        elif parts[0] == "spectrometer":
-            if len(parts) >= 2:
-                if parts[1] == "start":
-                    self.parent.hw.spec_ctrl.start()
-                elif parts[1] == "stop":
-                    self.parent.hw.spec_ctrl.stop()
-                elif parts[1] == "save":
-                    self.parent.hw.spec_ctrl.save()
-                elif parts[1] == "settings" and len(parts) >= 5:
-                    try:
-                        # Format: spectrometer settings <integration_time_ms> <averages> <cycles>
-                        integration_time = int(parts[2])
-                        averages = int(parts[3])
-                        cycles = int(parts[4])
-                        repetitions = int(parts[5]) if len(parts) >= 6 else 1
-                        
-                        # Update spectrometer settings
-                        self.parent.hw.spec_ctrl.update_settings(
-                            integration_time=integration_time,
-                            averages=averages,
-                            cycles=cycles,
-                            repetitions=repetitions
-                        )
-                    except (ValueError, IndexError):
-                        self.parent.statusBar().showMessage(f"Invalid spectrometer settings command: {cmd}")
-        
-        # Temperature controller commands
-        elif parts[0] == "temp":
-            if len(parts) >= 3:
-                if parts[1] == "setpoint":
-                    try:
-                        setpoint = float(parts[2])
-                        self.parent.hw.temp_ctrl.set_temperature(setpoint)
-                    except (ValueError, IndexError):
-                        self.parent.statusBar().showMessage(f"Invalid temperature command: {cmd}")
-                elif parts[1] == "off":
-                    self.parent.hw.temp_ctrl.disable()
-        
-        # Data saving commands
-        elif parts[0] == "data":
-            if len(parts) >= 2:
-                if parts[1] == "start":
-                    if not self.parent.data_logger.continuous_saving:
-                        self.parent.data_logger.toggle_data_saving()
-                elif parts[1] == "stop":
-                    if self.parent.data_logger.continuous_saving:
-                        self.parent.data_logger.toggle_data_saving()
-                elif parts[1] == "snapshot":
-                    self.parent._save_single_measurement()
-        
-        # Camera commands
-        elif parts[0] == "camera":
-            if len(parts) >= 2:
-                if parts[1] == "capture":
-                    # Capture a still image from the camera
-                    try:
-                        filename = parts[2] if len(parts) >= 3 else f"capture_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-                        self._capture_camera_image(filename)
-                    except Exception as e:
-                        self.parent.statusBar().showMessage(f"Camera capture error: {e}")
+        self._complete_on(spec.stopped_signal, completion)
+        spec.stop()
+    
+    def _spec_save(self, args, completion):
+        completion.done(self.parent.hw.spec_ctrl.save())
+    
+    def _spec_settings(self, args, completion):
+        # settings <integration_time_ms> <averages> <cycles> [repetitions]
+        # (averages follow from the integration time in the controller)
+        integration_time, _averages, cycles = args[:3]
+        repetitions = args[3] if len(args) > 3 else 1
+        spec = self.parent.hw.spec_ctrl
+        spec.integ_spinbox.setValue(integration_time)
+        spec.cycles_spinbox.setValue(cycles)
+        spec.repetitions_spinbox.setValue(repetitions)
+        if spec.measure_active:
+            # Done on the first scan taken with the new settings. A scan from the old settings
+            # can still arrive while acquisition restarts; its telemetry snapshot has the old
+            # integration time (the controller publishes the new one once it has re-armed).
+            wanted = float(spec.integ_spinbox.value())
+            integration = lambda snapshot: getattr(snapshot.get("spec.integration_time_ms"), "value", None)
+            self._complete_on(spec.scan_signal, completion,
+                              match=lambda seq, timestamp, intensities, snapshot: integration(snapshot) == wanted)
+        spec.update_measurement_settings()
+        if not spec.measure_active:
+            completion.done()
+    
+    def _temp_setpoint(self, args, completion):
+        # Done once the controller accepted the setpoint (queued in its poller thread)
+        temp_ctrl = self.parent.hw.temp_ctrl
+        if not temp_ctrl.set_temperature(args[0]):
+            completion.done(False, "not sent")
+            return
+        # Only this setpoint's result, not a manual Set or a queued power command. The result
+        # is delivered through the event loop, so connecting after queueing cannot miss it.
+        sent = temp_ctrl.setpoint  # as queued: clamped and rounded by the spin box
+        self._complete_on(temp_ctrl.command_signal, completion, lambda command, ok, value: ok,
+                          match=lambda command, ok, value: command == "setpoint" and value == sent)
+    
+    def _temp_wait_stable(self, args, completion):
+        # Done as soon as the plate holds the setpoint for the window; fails at the timeout
+        if not self.parent.hw.temp_ctrl.wait_stable(*args, callback=completion.done):
+            completion.done(False, "not connected")
+    
+    def _temp_off(self, args, completion):
+        temp_ctrl = self.parent.hw.temp_ctrl
+        self._complete_on(temp_ctrl.command_signal, completion, lambda command, ok, value: ok,
+                          match=lambda command, ok, value: command == "power off")
+        if not temp_ctrl.disable():
+            completion.done(False, "not sent")
+    
+    def _data_start(self, args, completion):
+        logger = self.parent.data_logger
+        if not logger.continuous_saving:
+            logger.toggle_data_saving()
+        completion.done(logger.continuous_saving)
+    
+    def _data_stop(self, args, completion):
+        logger = self.parent.data_logger
+        if logger.continuous_saving:
+            logger.toggle_data_saving()
+        completion.done(not logger.continuous_saving)
+    
+    def _data_snapshot(self, args, completion):
+        self.parent._save_single_measurement()
+        completion.done()
+    
+    def _camera_capture(self, args, completion):
+        # Capture a still image from the camera
+        filename = args[0] if args else f"capture_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
+        completion.done(self._capture_camera_image(filename))
     
     def _capture_camera_image(self, filename):
         """Capture a still image from the camera"""
         if not hasattr(self.parent, 'camera') or not self.parent.camera.camera.isOpened():
             self.parent.statusBar().showMessage("Camera not available")
-            return
+            return False
             
         # Capture frame
         ret, frame = self.parent.camera.camera.read()
         if not ret:
             self.parent.statusBar().showMessage("Failed to capture image")
-            return
+            return False
             
         # Save image
         try:
@@ -247,8 +663,10 @@ class RoutineManager(QObject):
             import cv2
             cv2.imwrite(img_path, frame)
             self.parent.statusBar().showMessage(f"Image saved to {img_path}")
+            return True
         except Exception as e:
             self.parent.statusBar().showMessage(f"Error saving image: {e}")
+            return False
     
     def create_preset_routine(self, preset_name):
         """Create a preset routine file with default commands"""
@@ -309,39 +727,34 @@ class RoutineManager(QObject):
                     f.write("motor move 0\n")
                     f.write("wait 1000\n")
                     
-                    # Loop through all filter positions
-                    for pos in range(1, 7):  # Assuming 6 filter positions
-                        f.write(f"filter position {pos}\n")
-                        f.write("wait 1000\n")
-                        f.write("spectrometer start\n")
-                        f.write("wait 2000\n")
-                        f.write(f"log Saving measurement with filter position {pos}\n")
-                        f.write("spectrometer save\n")
-                        f.write("wait 1000\n")
+                    # Loop through all filter positions (6 positions)
+                    f.write("for pos in 1..6\n")
+                    f.write("filter position $pos\n")
+                    f.write("wait 1000\n")
+                    f.write("spectrometer start\n")
+                    f.write("wait 2000\n")
+                    f.write("log Saving measurement with filter position $pos\n")
+                    f.write("spectrometer save\n")
+                    f.write("wait 1000\n")
+                    f.write("end\n")
                     
                     f.write("log Full Scan sequence completed\n")
                 
                 elif preset_name == "Temperature Test":
                     f.write("# Temperature test routine\n")
                     f.write("log Starting Temperature Test sequence\n")
-                    f.write("temp setpoint 20.0\n")
-                    f.write("wait 10000\n")  # Wait for temperature to stabilize
-                    f.write("spectrometer start\n")
-                    f.write("wait 2000\n")
-                    f.write("log Saving measurement at 20°C\n")
-                    f.write("spectrometer save\n")
-                    f.write("temp setpoint 25.0\n")
-                    f.write("wait 10000\n")
-                    f.write("spectrometer start\n")
-                    f.write("wait 2000\n")
-                    f.write("log Saving measurement at 25°C\n")
-                    f.write("spectrometer save\n")
-                    f.write("temp setpoint 30.0\n")
-                    f.write("wait 10000\n")
+                    
+                    # Each step waits exactly until the plate holds the setpoint
+                    # (within 0.2 °C for 30 s, giving up after 10 min)
+                    f.write("for t in 20..30 step 5\n")
+                    f.write("temp setpoint $t\n")
+                    f.write("temp wait-stable 0.2 30 600\n")
                     f.write("spectrometer start\n")
                     f.write("wait 2000\n")
-                    f.write("log Saving measurement at 30°C\n")
+                    f.write("log Saving measurement at $t°C\n")
                     f.write("spectrometer save\n")
+                    f.write("end\n")
+                    
                     f.write("temp off\n")
                     f.write("log Temperature Test sequence completed\n")
             
@@ -0,0 +1,127 @@
+"""
+Unattended routine runs from time and sun-elevation rules (routines.scheduler)
+"""
+import os
+import time
+import datetime
+import threading
+from PyQt5.QtCore import QObject, pyqtSignal
+
+import telemetry
+from routines.scheduler import Scheduler, ScheduleRule
+
+
+class SchedulerService(QObject):
+    """
+    Background thread that sleeps until the next rule firing (woken early
+    when a routine finishes or the service stops) and asks the GUI thread to
+    run the routine. Only one routine runs at a time, scheduled or manual.
+    """
+    trigger_signal = pyqtSignal(object, float)  # (ScheduleRule, due epoch time)
+    status_signal = pyqtSignal(str)
+
+    def __init__(self, parent, routine_manager, config=None):
+        super().__init__(parent)
+        self.parent = parent
+        self.routine_manager = routine_manager
+        self.config = config or {}
+        self.enabled = bool(self.config.get("enabled", False))
+
+        base_dir = os.path.join(os.path.dirname(__file__), "..", "..")
+        state_path = os.path.join(base_dir, self.config.get("state_file", "logs/scheduler_state.json"))
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        rules = []
+        for entry in self.config.get("rules", []):
+            try:
+                rules.append(ScheduleRule.from_config(entry, self._location, base_dir))
+            except (KeyError, ValueError) as e:
+                parent.handle_status_message(f"Scheduler rule ignored: {e}", source="scheduler")
+        self.scheduler = Scheduler(rules, state_path)
+
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+        self.trigger_signal.connect(self._run_rule)
+        routine_manager.routine_finished_signal.connect(self.routine_finished)
+
+    def _location(self):
+        """(lat, lon) from the config, else the IMU's GPS fix; None if unknown"""
+        location = self.config.get("location")
+        if location:
+            return float(location["latitude"]), float(location["longitude"])
+        lat = telemetry.store.get("imu.latitude_deg")
+        lon = telemetry.store.get("imu.longitude_deg")
+        if lat is None or lon is None or (lat == 0 and lon == 0):
+            return None
+        return lat, lon
+
+    def start(self):
+        if not self.enabled or not self.scheduler.rules or self._thread is not None:
+            return
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def routine_finished(self):
+        """Free the runner slot and wake the thread for anything pending"""
+        with self._cond:
+            self.scheduler.finished()
+            self._cond.notify()
+
+    def _run(self):
+        with self._cond:
+            for message in self.scheduler.start(time.time()):
+                self.status_signal.emit(f"Scheduler: {message}")
+            self._report_next()
+            while not self._stop:
+                now = time.time()
+                for message in self.scheduler.advance(now):
+                    self.status_signal.emit(f"Scheduler: {message}")
+
+                # A routine started by hand also occupies the runner
+                if self.routine_manager.routine_running:
+                    self.scheduler.busy = True
+                item, messages = self.scheduler.take(now)
+                for message in messages:
+                    self.status_signal.emit(f"Scheduler: {message}")
+                if item is not None:
+                    self.trigger_signal.emit(*item)
+                    self._report_next()
+                    continue
+
+                # Sleep until exactly the next firing; routine_finished() and stop() notify
+                wake = self.scheduler.next_wake()
+                self._cond.wait(None if wake is None else max(wake - time.time(), 0.0))
+
+    def _report_next(self):
+        upcoming = self.scheduler.upcoming(1)
+        if upcoming:
+            fire, rule = upcoming[0]
+            self.status_signal.emit(f"Scheduler: next '{rule.name}' at "
+                                    f"{datetime.datetime.fromtimestamp(fire):%Y-%m-%d %H:%M:%S}")
+
+    def _run_rule(self, rule, due):
+        """Load and start a rule's routine (GUI thread)"""
+        late = time.time() - due
+        message = f"Scheduler: starting '{rule.name}' ({rule.trigger.describe()})"
+        if late > 1:
+            message += f", {late:.0f} s late"
+        self.status_signal.emit(message)
+        if self.routine_manager.routine_running or not self.routine_manager.load_routine_file(rule.schedule):
+            self.status_signal.emit(f"Scheduler: could not start '{rule.name}' now")
+            with self._cond:
+                if self.routine_manager.routine_running:
+                    # Started by hand in the meantime: run this one after it
+                    self.scheduler.pending.append((due, rule))
+            self.routine_finished()
+            return
+        self.parent.run_routine()
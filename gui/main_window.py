@@ -4,6 +4,7 @@ Main window for the Mini ROBOHyPO application
 import sys
 import os
 import datetime
+from functools import partial
 import numpy as np
 import cv2
 
@@ -21,6 +22,8 @@ from gui.components.hardware_manager import HardwareManager
 from gui.components.camera_manager import CameraManager
 from gui.components.data_logger import DataLogger
 from gui.components.routine_manager import RoutineManager
+from gui.components.scheduler_service import SchedulerService
+from routines.timing import format_seconds
 
 class MainWindow(BaseWindow):
     def __init__(self):
@@ -28,14 +31,13 @@ class MainWindow(BaseWindow):
         
         # Initialize timers
         self.hardware_change_timer = QTimer(self)
-        self.collection_timer = QTimer(self)
-        self.save_data_timer = QTimer(self)
         
-        # Initialize managers
+        # Initialize managers (data logger first: controllers log status while connecting)
+        self.data_logger = DataLogger(self)
         self.hw = HardwareManager(self, self.config)
         self.camera = CameraManager(self)
-        self.data_logger = DataLogger(self)
         self.routine_manager = RoutineManager(self)
+        self.scheduler_service = SchedulerService(self, self.routine_manager, self.config.get("scheduler"))
         
         # Initialize UI
         self._init_ui()
@@ -43,6 +45,9 @@ class MainWindow(BaseWindow):
         # Connect signals
         self._connect_signals()
         
+        # Start unattended routine runs (if enabled in the config)
+        self.scheduler_service.start()
+        
         # Show status message
         self.statusBar().showMessage("Application initialized")
         
@@ -99,6 +104,15 @@ class MainWindow(BaseWindow):
         self.run_routine_btn.setEnabled(False)
         routine_group_layout.addWidget(self.run_routine_btn)
         
+        self.dry_run_btn = QPushButton("Dry Run")
+        self.dry_run_btn.setEnabled(False)
+        routine_group_layout.addWidget(self.dry_run_btn)
+        
+        # Continue a routine that was interrupted (crash, disconnect or stop)
+        self.resume_routine_btn = QPushButton("Resume Routine")
+        routine_group_layout.addWidget(self.resume_routine_btn)
+        self._update_resume_button()
+        
         # Set the layout for the routine group
         routine_group.setLayout(routine_group_layout)
         
@@ -136,10 +150,17 @@ class MainWindow(BaseWindow):
         self.preset_combo.currentIndexChanged.connect(self._handle_preset_change)
         self.load_routine_btn.clicked.connect(self._load_custom_routine)
         self.run_routine_btn.clicked.connect(self._toggle_routine)
+        self.dry_run_btn.clicked.connect(self.routine_manager.dry_run)
+        self.resume_routine_btn.clicked.connect(self.resume_routine)
         
         # Connect routine manager signals
         self.routine_manager.routine_status_changed.connect(self._update_routine_status)
         self.routine_manager.routine_finished_signal.connect(self._routine_finished)
+        self.scheduler_service.status_signal.connect(self.statusBar().showMessage)
+        self.scheduler_service.status_signal.connect(partial(self.handle_status_message, source="scheduler"))
+        
+        # Log every acquired scan as it arrives
+        self.hw.spec_ctrl.scan_signal.connect(self.data_logger.on_scan)
         
         # Connect hardware change timer
         self.hardware_change_timer.timeout.connect(self._resume_after_hardware_change)  # Change this line
@@ -149,6 +170,7 @@ class MainWindow(BaseWindow):
         if index <= 0:
             self.routine_status.setText("No routine loaded")
             self.run_routine_btn.setEnabled(False)
+            self.dry_run_btn.setEnabled(False)
             return
         
         preset_name = self.preset_combo.currentText()
@@ -159,28 +181,15 @@ class MainWindow(BaseWindow):
         if not os.path.exists(preset_path):
             self._create_preset_schedule_file(preset_name, preset_path)
         
-        # Load the preset file
-        try:
-            with open(preset_path, 'r') as f:
-                self.routine_commands = f.readlines()
-            
-            # Remove comments and empty lines
-            self.routine_commands = [line.strip() for line in self.routine_commands 
-                                    if line.strip() and not line.strip().startswith('#')]
-            
-            if self.routine_commands:
-                self.routine_status.setText(f"Loaded: {preset_name}\n{len(self.routine_commands)} commands")
-                self.run_routine_btn.setEnabled(True)
-                self.routine_file_path = preset_path
-                self.current_routine_name = preset_name
-            else:
-                self.routine_status.setText("No valid commands in preset")
-                self.run_routine_btn.setEnabled(False)
-                
-        except Exception as e:
-            self.statusBar().showMessage(f"Error loading preset schedule: {e}")
-            self.routine_status.setText(f"Error: {str(e)}")
+        # Compile the preset file (errors are reported with line numbers)
+        if self.routine_manager.load_routine_file(preset_path):
+            self._show_loaded_routine(preset_name)
+            self.routine_file_path = preset_path
+            self.current_routine_name = preset_name
+        else:
+            self.routine_status.setText("No valid commands in preset")
             self.run_routine_btn.setEnabled(False)
+            self.dry_run_btn.setEnabled(False)
     
     def _create_preset_schedule_file(self, preset_name, file_path):
         """Create a preset schedule file with default commands"""
@@ -238,46 +247,54 @@ class MainWindow(BaseWindow):
         if not file_path:
             return
         
-        try:
-            with open(file_path, 'r') as f:
-                self.routine_commands = f.readlines()
-            
-            # Remove comments and empty lines
-            self.routine_commands = [line.strip() for line in self.routine_commands 
-                                    if line.strip() and not line.strip().startswith('#')]
-            
-            if self.routine_commands:
-                self.routine_status.setText(f"Loaded: {os.path.basename(file_path)}\n{len(self.routine_commands)} commands")
-                self.run_routine_btn.setEnabled(True)
-                # Reset preset dropdown to avoid confusion
-                self.preset_combo.setCurrentIndex(0)
-                self.routine_file_path = file_path
-                self.current_routine_name = os.path.basename(file_path).replace('.txt', '')
-            else:
-                self.routine_status.setText("No valid commands in file")
-                self.run_routine_btn.setEnabled(False)
-                
-        except Exception as e:
-            self.statusBar().showMessage(f"Error loading routine: {e}")
-            self.routine_status.setText(f"Error: {str(e)}")
+        # Reset preset dropdown to avoid confusion
+        self.preset_combo.setCurrentIndex(0)
+        if self.routine_manager.load_routine_file(file_path):
+            self._show_loaded_routine(os.path.basename(file_path))
+            self.routine_file_path = file_path
+            self.current_routine_name = self.routine_manager.current_routine_name
+        else:
+            self.routine_status.setText("No valid commands in file")
             self.run_routine_btn.setEnabled(False)
+            self.dry_run_btn.setEnabled(False)
+    
+    def _show_loaded_routine(self, title):
+        """Show the compiled routine's size and estimated duration"""
+        program = self.routine_manager.program
+        self.routine_status.setText(f"Loaded: {title}\n{program.command_count()} commands, "
+                                    f"~{format_seconds(program.estimate_duration(self.routine_manager.timing_model), 0)}")
+        self.run_routine_btn.setEnabled(True)
+        self.dry_run_btn.setEnabled(True)
     
     def run_routine(self):
         """Run the loaded routine commands"""
-        if not self.routine_commands or self.routine_running:
+        if not self.routine_manager.program or self.routine_running:
             return
         
+        # Executed by the routine manager's worker thread, command by command
         self.routine_running = True
         self.run_routine_btn.setText("Stop Routine")
-        self.statusBar().showMessage(f"Running routine: {self.current_routine_name}")
-        
-        # Start routine execution in a separate thread or timer
-        # Implementation depends on how you want to handle command execution
-        
-        # For now, just a placeholder
-        self.statusBar().showMessage("Routine execution not implemented yet")
-        self.routine_running = False
-        self.run_routine_btn.setText("Run Routine")
+        self.routine_manager.run_routine()
+        self._update_resume_button()
+    
+    def resume_routine(self):
+        """Resume the interrupted routine from its checkpoint"""
+        if self.routine_manager.routine_running:
+            return
+        if self.routine_manager.resume_routine():
+            self.routine_running = True
+            self.run_routine_btn.setText("Stop Routine")
+            self.run_routine_btn.setEnabled(True)
+            self.current_routine_name = self.routine_manager.current_routine_name
+        self._update_resume_button()
+    
+    def _update_resume_button(self):
+        checkpoint = self.routine_manager.interrupted_routine()
+        self.resume_routine_btn.setEnabled(checkpoint is not None and not self.routine_manager.routine_running)
+        if checkpoint is not None:
+            self.resume_routine_btn.setText(f"Resume {checkpoint['routine']} (after line {checkpoint['line']})")
+        else:
+            self.resume_routine_btn.setText("Resume Routine")
     
     def toggle_data_saving(self):
         """Toggle continuous data saving on/off"""
@@ -293,25 +310,24 @@ class MainWindow(BaseWindow):
         self.data_logger._hardware_changing = False
         self.statusBar().showMessage("Resuming data collection")
     
-    def handle_status_message(self, message):
+    def handle_status_message(self, message, source="app"):
         """Handle status messages from hardware controllers"""
-        # Log the message if data logging is active
-        if self.data_logger.log_file:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.data_logger.log_file.write(f"{timestamp} [INFO] {message}\n")
-            self.data_logger.log_file.flush()
+        # Queued for the event log; written in batches by its writer thread
+        self.data_logger.write_log(message, source=source)
     
     def closeEvent(self, event):
         """Handle window close event"""
+        # No more scheduled runs
+        self.scheduler_service.stop()
+        
         # Release camera resources
         self.camera.shutdown()
         
         # Shutdown hardware controllers
         self.hw.shutdown()
         
-        # Close data files
-        if self.data_logger.continuous_saving:
-            self.data_logger.toggle_data_saving()
+        # Close data files and write out queued events
+        self.data_logger.shutdown()
         
         # Call the parent class closeEvent
         super().closeEvent(event)
@@ -336,10 +352,9 @@ class MainWindow(BaseWindow):
         
         if not self.routine_running:
             self.run_routine()
-            self.run_routine_btn.setText("Stop Routine")
-            self.routine_running = True
         else:
             # Stop the routine
+            self.routine_manager.stop_routine()
             self.routine_running = False
             self.run_routine_btn.setText("Run Routine")
             self.statusBar().showMessage("Routine stopped")
@@ -358,6 +373,7 @@ class MainWindow(BaseWindow):
         self.routine_running = False
         self.run_routine_btn.setText("Run Routine")
         self.routine_status.setText(f"Completed: {self.routine_manager.current_routine_name}")
+        self._update_resume_button()
 
 
 
@@ -0,0 +1,175 @@
+"""
+Checkpoints for resuming interrupted routines
+
+After every finished step RoutineWorker writes one small JSON document:
+where the cursor stands (program counters, loop counters, variables), the
+hardware settings the routine has made so far, the data-logging session it
+writes to and the steps that failed or timed out along the way. After a
+crash or a stop, RoutineManager.resume_routine() compiles the same file
+again, checks it is unchanged, restores the cursor, puts the hardware back
+into the recorded state and continues, appending to the same session.
+"""
+import os
+import json
+import time
+
+from routines.compiler import Instruction, Cursor
+
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(path: str, doc: dict):
+    """Replace the checkpoint atomically; it must survive a crash right after"""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(doc, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path: str):
+    """The checkpoint document, or None if there is none (or it is unreadable)"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            doc = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return doc if doc.get("version") == CHECKPOINT_VERSION else None
+
+
+def clear_checkpoint(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def make_checkpoint(program, cursor, step: int, instr, hardware: dict, session, failed=()) -> dict:
+    return {
+        "version": CHECKPOINT_VERSION,
+        "routine": program.name,
+        "source": os.path.abspath(program.source),
+        "digest": program.digest,
+        "cursor": cursor.state(),
+        "step": step,
+        "line": instr.line,
+        "text": instr.text,
+        "hardware": hardware,
+        "session": session,
+        # Steps that failed or timed out on the way here: [{"step", "line", "text"}]
+        "failed": list(failed),
+        "t": time.time(),
+    }
+
+
+def failed_lines(failed: list, limit: int = 5) -> str:
+    """'line 12 (motor move 90), ...' for the first limit failed steps"""
+    text = ", ".join(f"line {f['line']} ({f['text']})" for f in failed[:limit])
+    return text + (f" and {len(failed) - limit} more" if len(failed) > limit else "")
+
+
+def restore_cursor(program, doc: dict) -> Cursor:
+    """Cursor after the checkpoint's last completed step; ValueError if the routine changed"""
+    if doc.get("digest") != program.digest:
+        raise ValueError(f"{program.source} changed since it was interrupted")
+    return Cursor.restore(program, doc["cursor"])
+
+
+# The hardware key each instruction sets (see track_hardware)
+HARDWARE_KEYS = {
+    "motor.move": "motor_angle", "motor.home": "motor_angle",
+    "filter.position": "filter_position", "filter.home": "filter_position",
+    "spectrometer.start": "measuring", "spectrometer.stop": "measuring",
+    "spectrometer.settings": "spectrometer_settings",
+    "temp.setpoint": "temp_setpoint", "temp.off": "temp_setpoint",
+    "data.start": "data_logging", "data.stop": "data_logging",
+}
+
+
+def track_hardware(hardware: dict, instr):
+    """Record the device settings a completed instruction leaves behind"""
+    op, args = instr.op, instr.args
+    hardware.get("unknown", {}).pop(HARDWARE_KEYS.get(op), None)
+    if op == "motor.move":
+        hardware["motor_angle"] = args[0]
+    elif op == "motor.home":
+        hardware["motor_angle"] = 0.0
+    elif op == "filter.position":
+        hardware["filter_position"] = args[0]
+    elif op == "filter.home":
+        hardware["filter_position"] = 1
+    elif op == "spectrometer.start":
+        hardware["measuring"] = True
+    elif op == "spectrometer.stop":
+        hardware["measuring"] = False
+    elif op == "spectrometer.settings":
+        hardware["spectrometer_settings"] = list(args)
+    elif op == "temp.setpoint":
+        hardware["temp_setpoint"] = args[0]
+    elif op == "temp.off":
+        hardware["temp_setpoint"] = None
+    elif op == "data.start":
+        hardware["data_logging"] = True
+    elif op == "data.stop":
+        hardware["data_logging"] = False
+
+
+def forget_hardware(hardware: dict, instr):
+    """
+    Drop the setting a failed or timed-out instruction may have left half
+    applied; it is kept under "unknown" with the instruction so that
+    reconcile homes the device or sends the command again.
+    """
+    key = HARDWARE_KEYS.get(instr.op)
+    if key is not None:
+        hardware.pop(key, None)
+        hardware.setdefault("unknown", {})[key] = [instr.text, instr.op, list(instr.args)]
+
+
+def reconcile(hardware: dict, current: dict) -> list:
+    """
+    Instructions that bring the devices from current (what telemetry and the
+    controllers report now; missing keys are unknown) back to the recorded
+    hardware state. Motor and filter positions left unknown by a failed step
+    are homed, other unknown settings are sent again. Data logging is resumed
+    separately, into the same session.
+    """
+    def differs(key, tolerance=0.0):
+        value = current.get(key)
+        return value is None or abs(value - hardware[key]) > tolerance
+
+    unknown = hardware.get("unknown", {})
+    steps = []
+    if "spectrometer_settings" in unknown:
+        steps.append(unknown["spectrometer_settings"])
+    elif "spectrometer_settings" in hardware:
+        settings = hardware["spectrometer_settings"]
+        if current.get("integration_ms") != settings[0]:
+            steps.append(("spectrometer settings " + " ".join(str(v) for v in settings),
+                          "spectrometer.settings", tuple(settings)))
+    if "motor_angle" in unknown:
+        steps.append(("motor home", "motor.home", ()))
+    elif "motor_angle" in hardware and differs("motor_angle", 0.01):
+        steps.append((f"motor move {hardware['motor_angle']:g}", "motor.move", (hardware["motor_angle"],)))
+    if "filter_position" in unknown:
+        steps.append(("filter home", "filter.home", ()))
+    elif "filter_position" in hardware and current.get("filter_position") != hardware["filter_position"]:
+        steps.append((f"filter position {hardware['filter_position']}", "filter.position",
+                       (hardware["filter_position"],)))
+    if "temp_setpoint" in unknown:
+        steps.append(unknown["temp_setpoint"])
+    elif "temp_setpoint" in hardware:
+        if hardware["temp_setpoint"] is None:
+            if current.get("temp_setpoint") is not None:
+                steps.append(("temp off", "temp.off", ()))
+        elif differs("temp_setpoint", 0.05):
+            steps.append((f"temp setpoint {hardware['temp_setpoint']:g}", "temp.setpoint",
+                          (hardware["temp_setpoint"],)))
+    if "measuring" in unknown:
+        steps.append(unknown["measuring"])
+    elif hardware.get("measuring") and not current.get("measuring"):
+        steps.append(("spectrometer start", "spectrometer.start", ()))
+    elif hardware.get("measuring") is False and current.get("measuring"):
+        steps.append(("spectrometer stop", "spectrometer.stop", ()))
+    return [Instruction(op, tuple(args), 0, f"{text}  (resume)") for text, op, args in steps]
@@ -0,0 +1,532 @@
+"""
+Routine compiler: schedule text -> validated, typed instruction list
+
+Every line of a schedule file is parsed once, when the routine is loaded.
+Malformed lines are reported together with their line numbers instead of
+surfacing mid-run, and the executor runs the resulting Program through a
+dispatch table keyed by Instruction.op ("motor.move", "filter.position", ...).
+
+    program = compile_file("schedules/schedule_fu.txt")
+    program.estimate_duration()     # seconds, from routines.simulator
+
+Loops and variables are kept as nested instructions and expanded lazily by a
+Cursor while the routine runs, so a long sweep costs no more to load than its
+text:
+
+    set dwell 2000
+    for angle in 0..90 step 10      # inclusive; step may be negative
+        motor move $angle
+        wait ${dwell}
+        spectrometer save
+    end
+    repeat 3 ... end                # also: repeat until 18:30, repeat (until stopped)
+"""
+import os
+import re
+import time
+import hashlib
+import datetime
+from collections import namedtuple
+
+from routines.timing import TimingModel
+from routines.simulator import simulate
+
+# op: "device.action" (or "log", "wait", "parallel", "for", "repeat", "set"); args: typed tuple;
+# line: 1-based line number in the source; text: the source line
+Instruction = namedtuple("Instruction", ["op", "args", "line", "text"])
+
+
+def _angle(text):
+    return float(text)
+
+
+def _filter_position(text):
+    pos = int(text)
+    if not 1 <= pos <= 6:
+        raise ValueError("filter position must be 1-6")
+    return pos
+
+
+def _positive_int(text):
+    value = int(text)
+    if value <= 0:
+        raise ValueError("must be positive")
+    return value
+
+
+def _positive_float(text):
+    value = float(text)
+    if value <= 0:
+        raise ValueError("must be positive")
+    return value
+
+
+def _milliseconds(text):
+    value = int(text)
+    if value < 0:
+        raise ValueError("wait time must not be negative")
+    return value
+
+
+# (device, action) -> (op, required argument parsers, optional argument parsers)
+COMMANDS = {
+    ("motor", "move"): ("motor.move", [_angle], []),
+    ("motor", "home"): ("motor.home", [], []),
+    ("filter", "position"): ("filter.position", [_filter_position], []),
+    ("filter", "home"): ("filter.home", [], []),
+    ("spectrometer", "start"): ("spectrometer.start", [], []),
+    ("spectrometer", "stop"): ("spectrometer.stop", [], []),
+    ("spectrometer", "save"): ("spectrometer.save", [], []),
+    # settings <integration_time_ms> <averages> <cycles> [repetitions]
+    ("spectrometer", "settings"): ("spectrometer.settings",
+                                   [_positive_int, _positive_int, _positive_int], [_positive_int]),
+    ("temp", "setpoint"): ("temp.setpoint", [float], []),
+    ("temp", "off"): ("temp.off", [], []),
+    # wait-stable <tolerance_C> <window_s> <timeout_s>
+    ("temp", "wait-stable"): ("temp.wait_stable", [_positive_float, _positive_float, _positive_float], []),
+    ("data", "start"): ("data.start", [], []),
+    ("data", "stop"): ("data.stop", [], []),
+    ("data", "snapshot"): ("data.snapshot", [], []),
+    ("camera", "capture"): ("camera.capture", [], [str]),
+}
+
+# A command that ended up glued onto the end of a comment or log line
+_GLUED = re.compile(r"(?<=\S)(motor (move|home)|filter (position|home)|spectrometer (start|stop|save|settings)"
+                    r"|temp (setpoint|off|wait-stable)|data (start|stop|snapshot)|wait \d|log [A-Z])")
+
+
+_VARIABLE = re.compile(r"\$(?:\{([A-Za-z_]\w*)\}|([A-Za-z_]\w*))")
+_FOR = re.compile(r"^for\s+([A-Za-z_]\w*)\s+in\s+(\S+?)\.\.(\S+?)(?:\s+step\s+(\S+))?$")
+
+
+def format_value(value) -> str:
+    """Loop values as they appear after substitution (90, not 90.0)"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def substitute(text: str, env: dict) -> str:
+    """Replace $name / ${name} with the variable's value (KeyError if undefined)"""
+    return _VARIABLE.sub(lambda m: format_value(env[m.group(1) or m.group(2)]), text)
+
+
+def variables_in(text: str) -> list:
+    return [m.group(1) or m.group(2) for m in _VARIABLE.finditer(text)]
+
+
+def parse_until(text: str, now: float) -> float:
+    """Deadline (epoch seconds) for 'repeat until': HH:MM[:SS] today, or an ISO date-time"""
+    try:
+        return datetime.datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        pass
+    for fmt in ("%H:%M:%S", "%H:%M"):
+        try:
+            t = datetime.datetime.strptime(text, fmt).time()
+        except ValueError:
+            continue
+        day = datetime.datetime.fromtimestamp(now).date()
+        return datetime.datetime.combine(day, t).timestamp()
+    raise ValueError(f"bad time '{text}' (expected HH:MM, HH:MM:SS or an ISO date-time)")
+
+
+def device_of(instr) -> str:
+    """Device an instruction talks to ('motor', 'filter', ...)"""
+    return instr.op.split(".")[0]
+
+
+# Loop iterations one Cursor.next() call may pass without reaching a command
+MAX_EMPTY_ITERATIONS = 100000
+
+
+class RoutineCompileError(Exception):
+    """All problems found in a schedule, each as 'source:line: message'"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("\n".join(errors))
+
+
+class RoutineRuntimeError(ValueError):
+    """A line whose variables expanded to something invalid while running"""
+
+
+class Program:
+    """Compiled routine: an instruction list (parallel and loop blocks hold their own list)"""
+
+    def __init__(self, instructions, source="<routine>", warnings=None, digest=""):
+        self.instructions = instructions
+        self.source = source
+        self.warnings = warnings or []
+        # Hash of the source text, so a checkpoint is only resumed into the same routine
+        self.digest = digest
+
+    @property
+    def name(self) -> str:
+        return os.path.splitext(os.path.basename(self.source))[0]
+
+    def __len__(self) -> int:
+        return len(self.instructions)
+
+    def command_count(self) -> int:
+        """Device and log commands as written (loop bodies counted once)"""
+        def count(body):
+            n = 0
+            for instr in body:
+                if instr.op == "parallel":
+                    n += count(instr.args)
+                elif instr.op in ("for", "repeat"):
+                    n += count(instr.args[-1])
+                elif instr.op not in ("wait", "set"):
+                    n += 1
+            return n
+        return count(self.instructions)
+
+    def cursor(self, env: dict = None, clock=time.time) -> "Cursor":
+        return Cursor(self, env, clock)
+
+    def estimate_duration(self, model: TimingModel = None, start: float = None) -> float:
+        """
+        Seconds the routine should take (see routines.simulator); 'repeat until'
+        loops run against the simulated clock and routines that would not end
+        estimate as infinity.
+        """
+        return simulate(self, model, start).total
+
+
+class Cursor:
+    """
+    Walks a Program, expanding loops and substituting variables one
+    instruction at a time. next() returns a concrete Instruction (loops, set
+    and $variables already resolved; parallel blocks resolved as a whole) or
+    None at the end.
+    """
+
+    def __init__(self, program: Program, env: dict = None, clock=time.time):
+        self.program = program
+        self.env = dict(env or {})
+        self.clock = clock
+        # Each frame: the body being walked, the index of its next instruction, and loop state
+        self.frames = [{"body": program.instructions, "pc": 0, "loop": None}]
+
+    def state(self) -> dict:
+        """JSON-serializable position (variables, loop counters, program counters)"""
+        return {"env": dict(self.env),
+                "frames": [{"pc": f["pc"], "loop": f["loop"]} for f in self.frames]}
+
+    @classmethod
+    def restore(cls, program: Program, state: dict, clock=time.time) -> "Cursor":
+        """Cursor continuing where state() was taken; ValueError if it does not fit program"""
+        cursor = cls(program, state.get("env"), clock)
+        frames = []
+        body = program.instructions
+        for saved in state["frames"]:
+            if frames:
+                # A loop frame walks the body of the loop instruction its parent just passed
+                parent = frames[-1]
+                pc = parent["pc"] - 1
+                if not 0 <= pc < len(parent["body"]) or parent["body"][pc].op not in ("for", "repeat"):
+                    raise ValueError("checkpoint does not match the routine")
+                body = parent["body"][pc].args[-1]
+            if not 0 <= saved["pc"] <= len(body):
+                raise ValueError("checkpoint does not match the routine")
+            frames.append({"body": body, "pc": saved["pc"], "loop": saved["loop"]})
+        cursor.frames = frames
+        return cursor
+
+    def _error(self, instr, message):
+        return RoutineRuntimeError(f"{self.program.source}:{instr.line}: {message}: {instr.text}")
+
+    def _resolve(self, instr):
+        """Concrete instruction for a line that uses $variables"""
+        if instr.op in ("parallel",):
+            return instr._replace(args=tuple(self._resolve(sub) for sub in instr.args))
+        if "$" not in instr.text or not variables_in(instr.text):
+            return instr
+        try:
+            text = substitute(instr.text, self.env)
+        except KeyError as e:
+            raise self._error(instr, f"undefined variable {e}")
+        try:
+            return _parse_command(text.split(), instr.line, text)
+        except ValueError as e:
+            raise self._error(instr, str(e))
+
+    def _number(self, instr, token):
+        try:
+            return float(substitute(token, self.env))
+        except (KeyError, ValueError):
+            raise self._error(instr, f"bad number '{token}'")
+
+    def _enter(self, instr):
+        """Push a loop frame; False if the loop runs zero times"""
+        if instr.op == "for":
+            var, start, stop, step, body = instr.args
+            start, stop, step = (self._number(instr, t) for t in (start, stop, step))
+            if step == 0:
+                raise self._error(instr, "step must not be 0")
+            loop = {"var": var, "start": start, "stop": stop, "step": step, "index": 0}
+        else:
+            count, until, body = instr.args
+            deadline = None
+            if until is not None:
+                try:
+                    deadline = parse_until(substitute(until, self.env), self.clock())
+                except (KeyError, ValueError) as e:
+                    raise self._error(instr, str(e))
+            loop = {"count": None if count is None else int(self._number(instr, count)),
+                    "deadline": deadline, "index": 0}
+        frame = {"body": body, "pc": 0, "loop": loop}
+        if not self._iteration_ok(frame):
+            return False
+        self.frames.append(frame)
+        return True
+
+    def _iteration_ok(self, frame) -> bool:
+        """Whether the frame's loop runs iteration loop['index'] (binds the loop variable)"""
+        loop = frame["loop"]
+        i = loop["index"]
+        if "var" in loop:
+            value = loop["start"] + i * loop["step"]
+            eps = abs(loop["step"]) * 1e-9
+            if (loop["step"] > 0 and value > loop["stop"] + eps) or \
+               (loop["step"] < 0 and value < loop["stop"] - eps):
+                return False
+            self.env[loop["var"]] = round(value, 9)
+            return True
+        if loop["count"] is not None and i >= loop["count"]:
+            return False
+        if loop["deadline"] is not None and self.clock() >= loop["deadline"]:
+            return False
+        return True
+
+    def next(self):
+        wraps = 0
+        while self.frames:
+            frame = self.frames[-1]
+            body = frame["body"]
+            if frame["pc"] >= len(body):
+                if frame["loop"] is None:
+                    self.frames.pop()
+                    return None
+                wraps += 1
+                if wraps > MAX_EMPTY_ITERATIONS:
+                    # Abandon the loop so the next call continues after it
+                    self.frames.pop()
+                    raise self._error(body[0], f"loop ran {MAX_EMPTY_ITERATIONS} iterations without a command")
+                frame["loop"]["index"] += 1
+                frame["pc"] = 0
+                if not self._iteration_ok(frame):
+                    self.frames.pop()
+                continue
+
+            instr = body[frame["pc"]]
+            frame["pc"] += 1
+            if instr.op in ("for", "repeat"):
+                self._enter(instr)
+                continue
+            if instr.op == "set":
+                name, value = instr.args
+                try:
+                    self.env[name] = substitute(value, self.env)
+                except KeyError as e:
+                    raise self._error(instr, f"undefined variable {e}")
+                continue
+            return self._resolve(instr)
+        return None
+
+
+def _runs_command(body) -> bool:
+    """Whether a block holds anything besides set lines (in itself or a nested loop)"""
+    return any(instr.op != "set" and (instr.op not in ("for", "repeat") or _runs_command(instr.args[-1]))
+               for instr in body)
+
+
+def _parse_command(words, line_no, text):
+    """One command line -> Instruction (raises ValueError with a readable message)"""
+    head = words[0]
+    if head == "log":
+        return Instruction("log", (" ".join(words[1:]),), line_no, text)
+    if head == "wait":
+        if len(words) != 2:
+            raise ValueError("usage: wait <milliseconds>")
+        return Instruction("wait", (_milliseconds(words[1]),), line_no, text)
+
+    action = words[1] if len(words) > 1 else ""
+    spec = COMMANDS.get((head, action))
+    if spec is None:
+        known = sorted(a for d, a in COMMANDS if d == head)
+        if known:
+            raise ValueError(f"unknown {head} command '{action}' (expected {', '.join(known)})")
+        raise ValueError(f"unknown command '{head}'")
+
+    op, required, optional = spec
+    values = words[2:]
+    if not len(required) <= len(values) <= len(required) + len(optional):
+        raise ValueError(f"{head} {action} takes {len(required)}"
+                         f"{'-' + str(len(required) + len(optional)) if optional else ''} argument(s), "
+                         f"got {len(values)}")
+    args = []
+    for parse, value in zip(required + optional, values):
+        try:
+            args.append(parse(value))
+        except ValueError as e:
+            detail = str(e) if "must" in str(e) else "invalid number"
+            raise ValueError(f"bad argument '{value}': {detail}")
+    return Instruction(op, tuple(args), line_no, text)
+
+
+def _sample_value(token: str, known: dict) -> str:
+    try:
+        return substitute(token, known)
+    except KeyError:
+        return "0"
+
+
+def compile_lines(lines, source="<routine>") -> Program:
+    """Compile schedule lines; raises RoutineCompileError listing every bad line"""
+    lines = list(lines)
+    errors = []
+    warnings = []
+    # Open blocks: [kind, body, line, header args]; the outermost is the routine itself
+    stack = [["routine", [], 0, None]]
+    # Variables defined so far, with a representative value used to check the lines using them
+    known = {}
+
+    def error(line_no, message):
+        errors.append(f"{source}:{line_no}: {message}")
+
+    for line_no, raw in enumerate(lines, start=1):
+        text = raw.strip()
+        if not text:
+            continue
+        if text.startswith("#"):
+            glued = _GLUED.search(text)
+            if glued:
+                warnings.append(f"{source}:{line_no}: command '{text[glued.start():]}' "
+                                f"is inside a comment and will not run")
+            continue
+
+        words = text.split()
+        body = stack[-1][1]
+
+        # ----- block openers and closers -----
+        if words == ["parallel"]:
+            if stack[-1][0] == "parallel":
+                error(line_no, "nested parallel block")
+            stack.append(["parallel", [], line_no, None])
+            continue
+        if words[0] == "for":
+            m = _FOR.match(text)
+            if not m:
+                error(line_no, f"usage: for <name> in <start>..<stop> [step <n>]: {text}")
+                m_args = ("_", "0", "0", "1")
+            else:
+                m_args = (m.group(1), m.group(2), m.group(3), m.group(4) or "1")
+                for k, token in enumerate(m_args[1:]):
+                    for name in variables_in(token):
+                        if name not in known:
+                            error(line_no, f"undefined variable '{name}': {text}")
+                    try:
+                        step_ok = float(_sample_value(token, known))
+                    except ValueError:
+                        error(line_no, f"bad number '{token}': {text}")
+                        step_ok = 1
+                    if k == 2 and step_ok == 0:
+                        error(line_no, f"step must not be 0: {text}")
+                known[m_args[0]] = _sample_value(m_args[1], known)
+            if stack[-1][0] == "parallel":
+                error(line_no, "loops are not allowed inside a parallel block")
+            stack.append(["for", [], line_no, m_args])
+            continue
+        if words[0] == "repeat":
+            count = until = None
+            if len(words) == 2:
+                count = words[1]
+                try:
+                    if int(float(_sample_value(count, known))) < 0:
+                        error(line_no, f"repeat count must not be negative: {text}")
+                except ValueError:
+                    error(line_no, f"bad repeat count '{count}': {text}")
+            elif len(words) == 3 and words[1] == "until":
+                until = words[2]
+                if not variables_in(until):
+                    try:
+                        parse_until(until, time.time())
+                    except ValueError as e:
+                        error(line_no, f"{e}: {text}")
+            elif len(words) != 1:
+                error(line_no, f"usage: repeat [<count> | until <time>]: {text}")
+            if stack[-1][0] == "parallel":
+                error(line_no, "loops are not allowed inside a parallel block")
+            stack.append(["repeat", [], line_no, (count, until)])
+            continue
+        if words == ["end"]:
+            if len(stack) == 1:
+                error(line_no, "end without parallel, for or repeat")
+                continue
+            kind, block_body, start, header = stack.pop()
+            if kind == "parallel":
+                devices = [device_of(i) for i in block_body if i.op not in ("wait", "log")]
+                duplicated = sorted({d for d in devices if devices.count(d) > 1})
+                if duplicated:
+                    error(start, f"parallel block uses {', '.join(duplicated)} more than once")
+                instr = Instruction("parallel", tuple(block_body), start, "parallel")
+            elif not block_body:
+                error(start, f"empty {kind} block")
+                continue
+            elif kind == "repeat" and header[0] is None and not _runs_command(block_body):
+                # Without a count nothing would end it, not even Stop: the cursor never yields
+                error(start, "repeat block without a count has no command to run")
+                continue
+            elif kind == "for":
+                instr = Instruction("for", header + (tuple(block_body),), start, f"for {header[0]}")
+            else:
+                instr = Instruction("repeat", header + (tuple(block_body),), start, "repeat")
+            stack[-1][1].append(instr)
+            continue
+
+        # ----- variables -----
+        if words[0] == "set":
+            if len(words) < 3 or not re.match(r"^[A-Za-z_]\w*$", words[1]):
+                error(line_no, f"usage: set <name> <value>: {text}")
+                continue
+            value = " ".join(words[2:])
+            for name in variables_in(value):
+                if name not in known:
+                    error(line_no, f"undefined variable '{name}': {text}")
+            known[words[1]] = _sample_value(value, known)
+            body.append(Instruction("set", (words[1], value), line_no, text))
+            continue
+
+        # ----- commands (checked with representative values when they use variables) -----
+        undefined = [name for name in variables_in(text) if name not in known]
+        if undefined:
+            error(line_no, f"undefined variable '{undefined[0]}': {text}")
+            continue
+        checked = substitute(text, known)
+        try:
+            instr = _parse_command(checked.split(), line_no, checked)
+        except ValueError as e:
+            error(line_no, f"{e}: {text}")
+            continue
+        instr = instr._replace(text=text)
+        if instr.op == "log":
+            glued = _GLUED.search(instr.args[0])
+            if glued:
+                warnings.append(f"{source}:{line_no}: command '{instr.args[0][glued.start():]}' "
+                                f"is part of the log text and will not run")
+        body.append(instr)
+
+    for kind, _, start, _ in stack[1:]:
+        error(start, f"{kind} block without end")
+    if errors:
+        raise RoutineCompileError(errors)
+    digest = hashlib.sha1("\n".join(line.rstrip("\r\n") for line in lines).encode("utf-8")).hexdigest()
+    return Program(stack[0][1], source, warnings, digest)
+
+
+def compile_file(path: str) -> Program:
+    with open(path, "r", encoding="utf-8") as f:
+        return compile_lines(f.readlines(), source=path)
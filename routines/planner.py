@@ -0,0 +1,238 @@
+"""
+Move-minimizing order for a set of measurements
+
+A measurement is one (motor angle, filter position, integration time)
+combination. The time between two measurements is the reconfiguration time
+predicted by the TimingModel: the motor and filter wheel move together in a
+parallel block, then the spectrometer settings change if the integration time
+differs. The planner orders the set with a nearest-neighbour tour from the
+start state, improves it with 2-opt, and writes a runnable schedule.
+
+Measurement files list one measurement per line (# comments allowed):
+
+    # angle  filter  integration_ms
+    30       2       100
+    0        1       500
+
+    python -m routines.planner measurements.txt -o schedules/schedule_plan.txt
+    python -m routines.planner --angles 0..90:10 --filters 1,2 --integrations 100,500 -o plan.txt
+"""
+import sys
+import json
+import math
+import argparse
+from collections import namedtuple
+
+from routines.timing import TimingModel, averages_for, format_seconds
+from routines.compiler import compile_lines
+from routines.simulator import simulate
+
+Measurement = namedtuple("Measurement", ["angle", "filter", "integration_ms"])
+
+# Minimum time after the last reconfiguration before saving, on top of one full scan
+DEFAULT_SETTLE_MS = 500
+
+# 2-opt passes over the whole tour; each pass is O(n^2)
+MAX_PASSES = 50
+
+
+# Stand-in for compiled instructions when asking the model for durations
+_Step = namedtuple("_Step", ["op", "args"])
+
+
+def load_measurements(path: str) -> list:
+    """Measurements from a whitespace/comma separated file"""
+    measurements = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, raw in enumerate(f, start=1):
+            text = raw.split("#", 1)[0].replace(",", " ").strip()
+            if not text:
+                continue
+            fields = text.split()
+            if len(fields) != 3:
+                raise ValueError(f"{path}:{line_no}: expected 'angle filter integration_ms': {raw.strip()}")
+            measurements.append(Measurement(float(fields[0]), int(fields[1]), int(float(fields[2]))))
+    return measurements
+
+
+def grid(angles, filters, integrations) -> list:
+    """Every combination of the given values"""
+    return [Measurement(float(a), int(f), int(i)) for a in angles for f in filters for i in integrations]
+
+
+class Planner:
+    """Orders measurements to minimize predicted reconfiguration time"""
+
+    def __init__(self, model: TimingModel = None, settle_ms: int = DEFAULT_SETTLE_MS):
+        self.model = model or TimingModel()
+        self.settle_ms = settle_ms
+        start = self.model.initial_state()
+        self.start = Measurement(start["motor_angle"], start["filter_position"], int(start["integration_ms"]))
+
+    def transition(self, a: Measurement, b: Measurement) -> float:
+        """Seconds to go from measurement a's configuration to b's"""
+        state = self.model.initial_state()
+        state.update(motor_angle=a.angle, filter_position=a.filter,
+                     integration_ms=float(a.integration_ms), measuring=True)
+        moves = 0.0
+        if b.angle != a.angle:
+            moves = self.model.duration(_Step("motor.move", (b.angle,)), state)
+        if b.filter != a.filter:
+            moves = max(moves, self.model.duration(_Step("filter.position", (b.filter,)), state))
+        settings = 0.0
+        if b.integration_ms != a.integration_ms:
+            settings = self.model.duration(_Step("spectrometer.settings", (b.integration_ms,)), state)
+        return moves + settings
+
+    def cost(self, order: list) -> float:
+        """Total reconfiguration time of visiting measurements in order"""
+        total = 0.0
+        previous = self.start
+        for m in order:
+            total += self.transition(previous, m)
+            previous = m
+        return total
+
+    def plan(self, measurements: list) -> list:
+        """Nearest-neighbour tour from the start configuration, improved by 2-opt"""
+        unique = list(dict.fromkeys(measurements))
+        if len(unique) < 2:
+            return unique
+        nodes = [self.start] + unique
+        n = len(nodes)
+        # Not symmetric: a settings change costs a scan at the destination's integration time
+        cost = [[self.transition(nodes[i], nodes[j]) for j in range(n)] for i in range(n)]
+
+        # Nearest neighbour, starting from the start configuration (node 0)
+        tour = [0]
+        left = set(range(1, n))
+        while left:
+            here = tour[-1]
+            nearest = min(left, key=lambda j: (cost[here][j], j))
+            tour.append(nearest)
+            left.remove(nearest)
+
+        # 2-opt on the open path: reverse tour[i..j] when the whole path gets shorter.
+        # Reversing turns every inner edge around, so the segment is costed both ways.
+        for _ in range(MAX_PASSES):
+            improved = False
+            for i in range(1, n - 1):
+                a = tour[i - 1]
+                forward = backward = 0.0     # tour[i..j] walked as is / reversed
+                for j in range(i + 1, n):
+                    forward += cost[tour[j - 1]][tour[j]]
+                    backward += cost[tour[j]][tour[j - 1]]
+                    b, c = tour[i], tour[j]
+                    d = tour[j + 1] if j + 1 < n else None
+                    before = cost[a][b] + forward + (cost[c][d] if d is not None else 0.0)
+                    after = cost[a][c] + backward + (cost[b][d] if d is not None else 0.0)
+                    if after < before - 1e-9:
+                        tour[i:j + 1] = reversed(tour[i:j + 1])
+                        forward, backward = backward, forward
+                        improved = True
+            if not improved:
+                break
+        return [nodes[k] for k in tour[1:]]
+
+    def settle_ms_for(self, m: Measurement) -> int:
+        """Wait before saving: settle time plus one full scan at the new settings"""
+        scan_ms = m.integration_ms * averages_for(m.integration_ms)
+        return int(math.ceil(self.settle_ms + scan_ms))
+
+    def schedule_lines(self, order: list, title: str = "Planned measurement sequence") -> list:
+        """Runnable schedule text for measurements in order"""
+        lines = [f"log Starting {title}", "spectrometer start"]
+        # The hardware is wherever it was left (self.start only costs the order),
+        # so the first measurement sets everything, in one parallel block
+        current = None
+        for m in order:
+            settings = f"spectrometer settings {m.integration_ms} {averages_for(m.integration_ms)} 1"
+            if current is None:
+                lines += ["parallel", f"motor move {_number(m.angle)}", f"filter position {m.filter}",
+                          settings, "end"]
+            else:
+                moves = []
+                if m.angle != current.angle:
+                    moves.append(f"motor move {_number(m.angle)}")
+                if m.filter != current.filter:
+                    moves.append(f"filter position {m.filter}")
+                if len(moves) > 1:
+                    lines += ["parallel"] + moves + ["end"]
+                else:
+                    lines += moves
+                if m.integration_ms != current.integration_ms:
+                    lines.append(settings)
+            lines += [f"wait {self.settle_ms_for(m)}",
+                      f"log Measurement at {_number(m.angle)} deg, filter {m.filter}, {m.integration_ms} ms",
+                      "spectrometer save"]
+            current = m
+        lines.append(f"log {title} completed")
+        return lines
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+def _values(text: str, kind=float) -> list:
+    """'0..90:10' (inclusive range with step) or '1,2,5'"""
+    if ".." in text:
+        span, _, step = text.partition(":")
+        start, stop = (float(v) for v in span.split(".."))
+        step = float(step or 1)
+        count = int(math.floor((stop - start) / step + 1e-9)) + 1
+        return [kind(start + k * step) for k in range(max(count, 0))]
+    return [kind(v) for v in text.split(",") if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Order measurements to minimize motor and filter travel")
+    parser.add_argument("measurements", nargs="?", help="file of 'angle filter integration_ms' lines")
+    parser.add_argument("--angles", help="e.g. 0..90:10 or 0,45,90")
+    parser.add_argument("--filters", help="e.g. 1,2")
+    parser.add_argument("--integrations", help="integration times in ms, e.g. 100,500")
+    parser.add_argument("--params", help="JSON file of timing model parameters")
+    parser.add_argument("--settle-ms", type=int, default=DEFAULT_SETTLE_MS)
+    parser.add_argument("-o", "--output", help="schedule file to write (default: stdout)")
+    args = parser.parse_args(argv)
+
+    if args.measurements:
+        measurements = load_measurements(args.measurements)
+    elif args.angles:
+        measurements = grid(_values(args.angles), _values(args.filters or "1", int),
+                            _values(args.integrations or "100", int))
+    else:
+        parser.error("give a measurement file or --angles")
+
+    params = {}
+    if args.params:
+        with open(args.params, "r", encoding="utf-8") as f:
+            params = json.load(f)
+    model = TimingModel(params)
+    planner = Planner(model, args.settle_ms)
+    order = planner.plan(measurements)
+
+    # Report whole-schedule times from the simulator, not just the transition costs
+    title = "Planned measurement sequence"
+    given = simulate(compile_lines(planner.schedule_lines(list(dict.fromkeys(measurements)), title)), model)
+    lines = planner.schedule_lines(order, title)
+    planned = simulate(compile_lines(lines), model)
+    saved = given.total - planned.total
+    header = [f"# {len(order)} measurements, ordered by routines.planner",
+              f"# estimated {format_seconds(planned.total)} "
+              f"(given order: {format_seconds(given.total)}, saves {format_seconds(saved)})"]
+    text = "\n".join(header + lines) + "\n"
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    print(f"{len(order)} measurements: {format_seconds(planned.total)} planned vs "
+          f"{format_seconds(given.total)} in the given order (saves {format_seconds(saved)})",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
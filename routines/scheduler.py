@@ -0,0 +1,334 @@
+"""
+Time- and sun-triggered routine scheduling
+
+Rules start a schedule file from a cron-like time rule or when the sun
+crosses an elevation, e.g. SO at sunrise + 10 min and RE every hour:
+
+    {"name": "SO at sunrise", "schedule": "schedules/schedule_so.txt", "priority": 10,
+     "sun": {"elevation": -0.3, "direction": "rising", "offset_min": 10}}
+    {"name": "RE hourly", "schedule": "schedules/schedule_re.txt", "cron": "0 * * * *",
+     "catch_up": "skip"}
+
+Scheduler keeps the next firing of every rule in a priority queue and hands
+out at most one routine at a time (no overlap). A firing that comes due while
+a routine runs waits in a pending list; when the runner is free the highest
+priority (then earliest) one starts. Late firings follow the rule's catch_up:
+
+    "skip"  run only if it can start within grace_s of its time
+    "once"  run once however many firings were missed (default)
+    "all"   run every missed firing in turn
+
+The scheduler does not sleep or poll itself: next_wake() tells the service
+(gui.components.scheduler_service) exactly when to wake up next.
+"""
+import os
+import json
+import math
+import heapq
+import datetime
+
+# Firings that may pile up for one rule with catch_up "all"
+MAX_CATCH_UP = 24
+
+# A rule with no upcoming firing (e.g. no GPS fix yet for a sun rule) is re-checked this often
+RECHECK_S = 600.0
+
+# Apparent (refracted) elevation of the sun's centre at sunrise/sunset, as
+# utils.compute_sun_vector reports it: upper limb on the horizon
+SUNRISE_ELEVATION = -0.3
+
+_CRON_FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31), ("month", 1, 12), ("weekday", 0, 7))
+
+
+def _cron_field(text: str, low: int, high: int) -> set:
+    values = set()
+    for part in text.split(","):
+        span, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if span == "*":
+            start, stop = low, high
+        elif "-" in span:
+            start, stop = (int(v) for v in span.split("-", 1))
+        else:
+            start = stop = int(span)
+            if step > 1:
+                stop = high
+        if start < low or stop > high or start > stop or step < 1:
+            raise ValueError(f"'{part}' is outside {low}-{high}")
+        values.update(range(start, stop + 1, step))
+    return values
+
+
+class CronTrigger:
+    """Standard 5-field cron expression (minute hour day month weekday), local time"""
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron needs 5 fields (minute hour day month weekday): '{expr}'")
+        self.expr = expr
+        sets = [_cron_field(text, low, high) for text, (_, low, high) in zip(fields, _CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = sets
+        self.weekdays = {d % 7 for d in weekdays}  # 0 and 7 are both Sunday
+        # cron: when both day fields are restricted, either may match
+        self.day_any = fields[2] == "*"
+        self.weekday_any = fields[4] == "*"
+
+    def _day_matches(self, day: datetime.date) -> bool:
+        if day.month not in self.months:
+            return False
+        dom = day.day in self.days
+        dow = (day.isoweekday() % 7) in self.weekdays
+        if self.day_any and self.weekday_any:
+            return True
+        if self.day_any:
+            return dow
+        if self.weekday_any:
+            return dom
+        return dom or dow
+
+    def next_after(self, t: float):
+        """First firing strictly after epoch time t (None if none within ~4 years)"""
+        start = datetime.datetime.fromtimestamp(t).replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        day = start.date()
+        for _ in range(366 * 4 + 1):
+            if self._day_matches(day):
+                first = start.time() if day == start.date() else datetime.time(0, 0)
+                for hour in sorted(h for h in self.hours if h >= first.hour):
+                    for minute in sorted(self.minutes):
+                        if hour == first.hour and minute < first.minute:
+                            continue
+                        return datetime.datetime.combine(day, datetime.time(hour, minute)).timestamp()
+            day += datetime.timedelta(days=1)
+        return None
+
+    def describe(self) -> str:
+        return f"cron '{self.expr}'"
+
+
+def sun_elevation(lat: float, lon: float, t: float) -> float:
+    """Solar elevation (deg) at epoch time t, from utils.compute_sun_vector"""
+    import utils  # imported on first use: utils pulls in matplotlib for the 3D view
+    when = datetime.datetime.fromtimestamp(t, datetime.timezone.utc)
+    up = utils.compute_sun_vector(lat, lon, when)[2]
+    return math.degrees(math.asin(max(-1.0, min(1.0, up))))
+
+
+class SunTrigger:
+    """Fires when the sun crosses an elevation (rising or setting), plus an offset"""
+
+    STEP_S = 600          # coarse scan for sign changes
+    TOLERANCE_S = 1.0     # bisection accuracy
+    HORIZON_S = 2 * 86400
+
+    def __init__(self, elevation: float, rising: bool = True, offset_s: float = 0.0,
+                 location=None, elevation_fn=sun_elevation):
+        self.elevation = elevation
+        self.rising = rising
+        self.offset_s = offset_s
+        # location: callable returning (lat, lon) or None (e.g. from IMU GPS telemetry)
+        self.location = location
+        self.elevation_fn = elevation_fn
+
+    def _crossing(self, lat, lon, t0: float, t1: float):
+        """Time in (t0, t1] when elevation crosses the threshold in our direction"""
+        f = lambda t: self.elevation_fn(lat, lon, t) - self.elevation
+        a, fa = t0, f(t0)
+        while a < t1:
+            b = min(a + self.STEP_S, t1)
+            fb = f(b)
+            if (fa < 0 <= fb) if self.rising else (fa >= 0 > fb):
+                lo, hi = a, b
+                while hi - lo > self.TOLERANCE_S:
+                    mid = (lo + hi) / 2
+                    fm = f(mid)
+                    if (fm < 0) == self.rising:
+                        lo = mid
+                    else:
+                        hi = mid
+                return hi
+            a, fa = b, fb
+        return None
+
+    def next_after(self, t: float):
+        place = self.location() if self.location else None
+        if place is None:
+            return None
+        lat, lon = place
+        # The crossing itself may be before t when the offset is positive
+        crossing = self._crossing(lat, lon, t - self.offset_s, t - self.offset_s + self.HORIZON_S)
+        return None if crossing is None else crossing + self.offset_s
+
+    def describe(self) -> str:
+        direction = "rising" if self.rising else "setting"
+        offset = f" {self.offset_s / 60:+.0f} min" if self.offset_s else ""
+        return f"sun {direction} through {self.elevation:g} deg{offset}"
+
+
+class ScheduleRule:
+    """One schedule file and when to run it"""
+
+    def __init__(self, name: str, schedule: str, trigger, priority: int = 0,
+                 catch_up: str = "once", grace_s: float = 300.0, enabled: bool = True):
+        if catch_up not in ("skip", "once", "all"):
+            raise ValueError(f"rule '{name}': catch_up must be skip, once or all")
+        self.name = name
+        self.schedule = schedule
+        self.trigger = trigger
+        self.priority = priority
+        self.catch_up = catch_up
+        self.grace_s = grace_s
+        self.enabled = enabled
+
+    @classmethod
+    def from_config(cls, entry: dict, location=None, base_dir: str = "."):
+        name = entry.get("name") or os.path.basename(entry["schedule"])
+        if "cron" in entry:
+            trigger = CronTrigger(entry["cron"])
+        elif "sun" in entry:
+            sun = entry["sun"]
+            direction = sun.get("direction", "rising")
+            if direction not in ("rising", "setting"):
+                raise ValueError(f"rule '{name}': sun direction must be rising or setting")
+            trigger = SunTrigger(float(sun.get("elevation", SUNRISE_ELEVATION)), direction == "rising",
+                                 60.0 * float(sun.get("offset_min", 0)), location)
+        else:
+            raise ValueError(f"rule '{name}' needs a 'cron' or 'sun' trigger")
+        schedule = entry["schedule"]
+        if not os.path.isabs(schedule):
+            schedule = os.path.normpath(os.path.join(base_dir, schedule))
+        return cls(name, schedule, trigger, int(entry.get("priority", 0)),
+                   entry.get("catch_up", "once"), float(entry.get("grace_s", 300)),
+                   bool(entry.get("enabled", True)))
+
+
+class Scheduler:
+    """Priority queue of rule firings with a single runner slot"""
+
+    def __init__(self, rules, state_path: str = None):
+        self.rules = [r for r in rules if r.enabled]
+        self.state_path = state_path
+        self._queue = []      # (fire_time, -priority, seq, rule, recheck)
+        self._seq = 0
+        self.pending = []     # [(due, rule)] waiting for the runner
+        self.busy = False
+        self.last_fired = self._load_state()
+
+    # -------------  State  ---------------------------------------------
+
+    def _load_state(self) -> dict:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("last_fired", {})
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"last_fired": self.last_fired}, f, indent=2)
+        os.replace(tmp, self.state_path)
+
+    # -------------  Queue  ---------------------------------------------
+
+    def _push(self, rule, fire_time, now):
+        """Queue the rule's next firing, or a re-check if it has none yet"""
+        self._seq += 1
+        if fire_time is None:
+            heapq.heappush(self._queue, (now + RECHECK_S, -rule.priority, self._seq, rule, True))
+        else:
+            heapq.heappush(self._queue, (fire_time, -rule.priority, self._seq, rule, False))
+
+    def start(self, now: float) -> list:
+        """Queue every rule's next firing, plus firings missed since the last run; returns messages"""
+        messages = []
+        self._queue = []
+        for rule in self.rules:
+            last = self.last_fired.get(rule.name)
+            if last is not None and rule.catch_up != "skip":
+                missed = self._firings_between(rule, last, now)
+                if missed:
+                    messages.append(f"{rule.name}: {len(missed)} firing(s) missed while stopped")
+                    self._add_pending(rule, missed)
+            fire = rule.trigger.next_after(now)
+            if fire is None:
+                messages.append(f"{rule.name}: no upcoming {rule.trigger.describe()}")
+            self._push(rule, fire, now)
+        return messages
+
+    def _firings_between(self, rule, t0: float, t1: float) -> list:
+        firings = []
+        t = rule.trigger.next_after(t0)
+        while t is not None and t <= t1 and len(firings) < MAX_CATCH_UP:
+            firings.append(t)
+            t = rule.trigger.next_after(t)
+        return firings
+
+    def _add_pending(self, rule, dues):
+        if rule.catch_up == "all":
+            self.pending += [(due, rule) for due in dues]
+            return
+        # One pending run per rule however many firings it stands for; a "skip"
+        # rule keeps its latest firing, which is the one that may still be on time
+        others = [(due, r) for due, r in self.pending if r is not rule]
+        mine = [due for due, r in self.pending if r is rule]
+        if rule.catch_up == "skip":
+            due = max(mine + dues)
+        else:
+            due = min(mine + dues)
+        self.pending = others + [(due, rule)]
+
+    def next_wake(self):
+        """Epoch time of the next firing (None if nothing is scheduled)"""
+        return self._queue[0][0] if self._queue else None
+
+    def advance(self, now: float) -> list:
+        """Move every firing due by now to pending and queue each rule's next one"""
+        messages = []
+        while self._queue and self._queue[0][0] <= now:
+            fire, _, _, rule, recheck = heapq.heappop(self._queue)
+            if recheck:
+                self._push(rule, rule.trigger.next_after(now), now)
+                continue
+            dues = [fire] + self._firings_between(rule, fire, now)
+            self._add_pending(rule, dues)
+            if len(dues) > 1:
+                messages.append(f"{rule.name}: {len(dues)} firings came due at once")
+            self._push(rule, rule.trigger.next_after(now), now)
+        return messages
+
+    def take(self, now: float):
+        """
+        ((rule, due) to run now, or None; messages). Nothing is handed out
+        while the runner is busy; late firings their rule says to skip are
+        dropped and reported in messages.
+        """
+        messages = []
+        if self.busy:
+            return None, messages
+        while self.pending:
+            self.pending.sort(key=lambda item: (-item[1].priority, item[0]))
+            due, rule = self.pending.pop(0)
+            late = now - due
+            if rule.catch_up == "skip" and late > rule.grace_s:
+                messages.append(f"{rule.name}: skipped firing at "
+                                f"{datetime.datetime.fromtimestamp(due):%H:%M:%S} ({late:.0f} s late)")
+                continue
+            self.busy = True
+            self.last_fired[rule.name] = due
+            self._save_state()
+            return (rule, due), messages
+        return None, messages
+
+    def finished(self):
+        """The runner is free again"""
+        self.busy = False
+
+    def upcoming(self, limit: int = 10) -> list:
+        """[(fire_time, rule)] in firing order"""
+        return [(fire, rule) for fire, _, _, rule, recheck in heapq.nsmallest(limit, self._queue)
+                if not recheck]
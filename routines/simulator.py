@@ -0,0 +1,246 @@
+"""
+Dry-run simulator for compiled routines
+
+Runs a Program against a TimingModel instead of hardware, with the same
+semantics as RoutineWorker (commands wait for completion, wait is a minimum
+settle time from the previous dispatch, parallel blocks join on all their
+commands), and records a per-command timeline. A full-day schedule simulates
+in milliseconds.
+
+Execution traces written by RoutineManager after each real run can be used to
+fit the model parameters:
+
+    python -m routines.simulator schedules/schedule_sg.txt
+    python -m routines.simulator schedules/schedule_sg.txt --fit logs/routine_trace_*.json --save params.json
+"""
+import sys
+import json
+import time
+import argparse
+import datetime
+from collections import namedtuple, defaultdict
+
+import numpy as np
+
+from routines.timing import TimingModel, filter_steps, format_seconds
+
+# Instructions expanded per step by a Cursor would never end; simulations stop here
+MAX_SIMULATION_STEPS = 200000
+
+# start/duration in seconds from the beginning of the routine
+TimelineEntry = namedtuple("TimelineEntry", ["start", "duration", "instr", "note"])
+# Enough of an Instruction for TimingModel.duration when replaying a trace
+_TraceInstr = namedtuple("_TraceInstr", ["op", "args"])
+
+
+class Timeline:
+    """Result of a dry run"""
+
+    def __init__(self, program, entries, total, complete, cpu_time, skipped):
+        self.program = program
+        self.entries = entries
+        self.total = total            # seconds; inf if the routine would not end
+        self.complete = complete
+        self.cpu_time = cpu_time      # seconds spent simulating
+        self.skipped = skipped        # runtime errors (lines that would be skipped)
+
+    @property
+    def total_ms(self) -> float:
+        return self.total * 1000
+
+    def per_device(self) -> dict:
+        """Seconds each device spends busy"""
+        busy = defaultdict(float)
+        for entry in self.entries:
+            if entry.instr.op != "wait":
+                busy[entry.instr.op.split(".")[0]] += entry.duration
+        return dict(busy)
+
+    def fits_window(self, start: datetime.datetime, end: datetime.datetime) -> bool:
+        """Whether a run started at start finishes by end"""
+        return self.complete and start.timestamp() + self.total <= end.timestamp()
+
+    def format(self, limit: int = None) -> str:
+        lines = [f"{'start ms':>10} {'dur ms':>9}  line  command"]
+        for entry in self.entries[:limit]:
+            note = f"  ({entry.note})" if entry.note else ""
+            lines.append(f"{entry.start * 1000:10.0f} {entry.duration * 1000:9.0f}  "
+                         f"{entry.instr.line:4d}  {entry.instr.text}{note}")
+        if limit is not None and len(self.entries) > limit:
+            lines.append(f"... {len(self.entries) - limit} more")
+        total = f"{self.total_ms:.0f} ms" if self.complete else "open-ended"
+        lines.append(f"total {total} ({format_seconds(self.total)}), "
+                     f"{len(self.entries)} steps simulated in {self.cpu_time * 1000:.1f} ms")
+        return "\n".join(lines)
+
+
+def simulate(program, model: TimingModel = None, start: float = None,
+             max_steps: int = MAX_SIMULATION_STEPS) -> Timeline:
+    """Dry-run program; start (epoch seconds) matters only for 'repeat until'"""
+    t0 = time.process_time()
+    model = model or TimingModel()
+    state = model.initial_state()
+    start = time.time() if start is None else start
+    cursor = program.cursor(clock=lambda: start + state["t"])
+    entries = []
+    skipped = []
+    last_dispatch = 0.0
+    complete = False
+
+    for _ in range(max_steps):
+        try:
+            instr = cursor.next()
+        except ValueError as e:
+            skipped.append(str(e))
+            continue
+        if instr is None:
+            complete = True
+            break
+        now = state["t"]
+        if instr.op == "wait":
+            end = max(now, last_dispatch + instr.args[0] / 1000)
+            entries.append(TimelineEntry(now, end - now, instr, ""))
+            state["t"] = last_dispatch = end
+        elif instr.op == "parallel":
+            last_dispatch = now
+            longest = 0.0
+            for sub in instr.args:
+                if sub.op == "wait":
+                    seconds = sub.args[0] / 1000
+                else:
+                    seconds = model.duration(sub, state)
+                entries.append(TimelineEntry(now, seconds, sub, _note(sub, state)))
+                longest = max(longest, seconds)
+            state["t"] = now + longest
+        else:
+            last_dispatch = now
+            seconds = model.duration(instr, state)
+            entries.append(TimelineEntry(now, seconds, instr, _note(instr, state)))
+            state["t"] = now + seconds
+
+    total = state["t"] if complete else float("inf")
+    return Timeline(program, entries, total, complete, time.process_time() - t0, skipped)
+
+
+def _note(instr, state) -> str:
+    if instr.op == "temp.setpoint":
+        return f"setpoint reached at {state['temp_ready_s'] * 1000:.0f} ms"
+    return ""
+
+
+# -------------  Fitting from traces  ------------------------------------
+
+def load_traces(paths) -> list:
+    """Records from routine_trace_*.json files, one list per run"""
+    runs = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            runs.append(json.load(f)["commands"])
+    return runs
+
+
+def _linear_fit(xs, ys):
+    """(intercept, slope) of a least-squares line; slope 0 if x does not vary"""
+    xs, ys = np.asarray(xs, float), np.asarray(ys, float)
+    if len(xs) >= 2 and np.ptp(xs) > 0:
+        slope, intercept = np.polyfit(xs, ys, 1)
+        return float(intercept), float(slope)
+    return float(np.median(ys)), 0.0
+
+
+def fit_params(runs, model: TimingModel = None) -> dict:
+    """
+    Model parameters fitted to measured command durations. Each run is a list
+    of {"op", "args", "duration", "ok"} records in execution order; the model
+    state is replayed through each run to recover distances and integration
+    times. Parameters without enough data keep their current values.
+    """
+    model = model or TimingModel()
+    params = dict(model.params)
+    samples = defaultdict(list)  # op -> [(feature, seconds)]
+
+    for records in runs:
+        state = model.initial_state()
+        for rec in records:
+            instr = _TraceInstr(rec["op"], tuple(rec.get("args", ())))
+            if instr.op == "motor.move" or instr.op == "motor.home":
+                target = instr.args[0] if instr.op == "motor.move" else 0.0
+                feature = abs(target - state["motor_angle"])
+            elif instr.op in ("filter.position", "filter.home"):
+                target = instr.args[0] if instr.op == "filter.position" else 1
+                feature = filter_steps(state["filter_position"], target, int(params["filter_positions"]))
+            elif instr.op == "spectrometer.start":
+                feature = model.scan_seconds(state)
+            else:
+                feature = 0.0
+            model.duration(instr, state)
+            if rec.get("ok", True) and rec.get("duration") is not None:
+                samples[instr.op].append((feature, rec["duration"]))
+
+    def fit(ops):
+        points = [p for op in ops for p in samples.get(op, ())]
+        return _linear_fit(*zip(*points)) if points else None
+
+    motor = fit(("motor.move", "motor.home"))
+    if motor:
+        params["motor_overhead_s"] = max(motor[0], 0.0)
+        if motor[1] > 0:
+            params["motor_steps_per_s"] = params["motor_steps_per_deg"] / motor[1]
+    wheel = fit(("filter.position", "filter.home"))
+    if wheel:
+        params["filter_move_s"] = max(wheel[0], 0.0)
+        params["filter_step_s"] = max(wheel[1], 0.0)
+    spec = fit(("spectrometer.start",))
+    if spec:
+        params["spec_start_overhead_s"] = max(spec[0], 0.0)
+        if spec[1] > 0:
+            params["spec_start_cycles"] = spec[1]
+    for key, ops in (("spec_save_s", ("spectrometer.save",)),
+                     ("spec_stop_s", ("spectrometer.stop",)),
+                     ("temp_command_s", ("temp.setpoint", "temp.off")),
+                     ("data_command_s", ("data.start", "data.stop", "data.snapshot")),
+                     ("camera_capture_s", ("camera.capture",))):
+        durations = [d for op in ops for _, d in samples.get(op, ())]
+        if durations:
+            params[key] = float(np.median(durations))
+    return params
+
+
+def main(argv=None):
+    from routines.compiler import compile_file, RoutineCompileError
+
+    parser = argparse.ArgumentParser(description="Dry-run a routine against the timing model")
+    parser.add_argument("routine", help="schedule file")
+    parser.add_argument("--params", help="JSON file of timing model parameters")
+    parser.add_argument("--fit", nargs="+", metavar="TRACE", help="fit parameters to routine_trace_*.json first")
+    parser.add_argument("--save", metavar="PATH", help="write the (fitted) parameters as JSON")
+    parser.add_argument("--start", type=datetime.datetime.fromisoformat, help="ISO start time (for 'repeat until')")
+    parser.add_argument("--limit", type=int, default=None, help="timeline rows to print")
+    args = parser.parse_args(argv)
+
+    params = {}
+    if args.params:
+        with open(args.params, "r", encoding="utf-8") as f:
+            params = json.load(f)
+    model = TimingModel(params)
+    if args.fit:
+        model = TimingModel(fit_params(load_traces(args.fit), model))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(model.params, f, indent=2)
+
+    try:
+        program = compile_file(args.routine)
+    except RoutineCompileError as e:
+        print(e, file=sys.stderr)
+        return 1
+    start = args.start.timestamp() if args.start else None
+    timeline = simulate(program, model, start)
+    print(timeline.format(args.limit))
+    for message in timeline.skipped[:10]:
+        print(f"skipped: {message}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
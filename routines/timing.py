@@ -0,0 +1,136 @@
+"""
+Per-device timing model for routine instructions
+
+Durations are estimates of how long each instruction takes from dispatch to
+its completion event (see RoutineWorker). The model walks a program with a
+small state (motor angle, filter position, integration time, temperature) so
+that, e.g., a motor move costs time in proportion to the distance travelled.
+Parameters can be fitted from execution traces (routines.simulator.fit_params).
+"""
+from drivers.motor import TrackerSpeed, STEPS_PER_DEG
+
+DEFAULT_PARAMS = {
+    "motor_steps_per_s": float(TrackerSpeed),
+    "motor_steps_per_deg": float(STEPS_PER_DEG),
+    "motor_overhead_s": 0.05,     # Modbus write + ACK
+    "filter_move_s": 1.5,         # FilterWheelCommandThread: move, settle, position query
+    "filter_step_s": 0.0,         # extra time per position travelled
+    "filter_positions": 6,
+    "spec_start_overhead_s": 0.2, # prepare_measurement + callback registration
+    "spec_start_cycles": 1,       # scans until start completes (first scan)
+    "spec_save_s": 0.05,
+    "spec_stop_s": 0.1,
+    "temp_command_s": 0.1,
+    "temp_ramp_C_per_s": 0.05,    # TC36 plate heating/cooling rate (3 C/min)
+    "temp_initial_C": 25.0,
+    "data_command_s": 0.05,
+    "camera_capture_s": 0.2,
+}
+
+
+def averages_for(integration_ms: float) -> int:
+    """Averages SpectrometerController chooses for an integration time"""
+    if integration_ms < 10:
+        return 10
+    if integration_ms < 100:
+        return 5
+    if integration_ms < 1000:
+        return 2
+    return 1
+
+
+def filter_steps(current: int, target: int, positions: int = 6) -> int:
+    """Positions travelled between two filter slots (the wheel takes the shorter way)"""
+    d = abs(int(target) - int(current)) % positions
+    return min(d, positions - d)
+
+
+def format_seconds(seconds: float, digits: int = 1) -> str:
+    """'12.3 s', or 'open-ended' for routines that loop until stopped"""
+    if seconds == float("inf"):
+        return "open-ended"
+    return f"{seconds:.{digits}f} s"
+
+
+class TimingModel:
+    """Estimated duration of each instruction, given the state left by the previous ones"""
+
+    def __init__(self, params: dict = None):
+        self.params = dict(DEFAULT_PARAMS, **(params or {}))
+
+    @property
+    def motor_deg_per_s(self) -> float:
+        return self.params["motor_steps_per_s"] / self.params["motor_steps_per_deg"]
+
+    def initial_state(self) -> dict:
+        return {"motor_angle": 0.0, "filter_position": 1, "integration_ms": 100.0,
+                "temp_C": self.params["temp_initial_C"], "temp_setpoint_C": None,
+                "temp_ready_s": 0.0, "measuring": False, "t": 0.0}
+
+    def scan_seconds(self, state: dict) -> float:
+        """One averaged scan at the current integration time"""
+        integration = state["integration_ms"]
+        return integration * averages_for(integration) / 1000
+
+    def duration(self, instr, state: dict) -> float:
+        """Seconds from dispatch to completion; updates state in place"""
+        p = self.params
+        op, args = instr.op, instr.args
+        if op == "motor.move" or op == "motor.home":
+            target = args[0] if op == "motor.move" else 0.0
+            distance = abs(target - state["motor_angle"])
+            state["motor_angle"] = target
+            return p["motor_overhead_s"] + distance / self.motor_deg_per_s
+        if op in ("filter.position", "filter.home"):
+            target = args[0] if op == "filter.position" else 1
+            steps = filter_steps(state["filter_position"], target, int(p["filter_positions"]))
+            state["filter_position"] = target
+            return p["filter_move_s"] + steps * p["filter_step_s"]
+        if op == "spectrometer.start":
+            # Completes when the first scan arrives
+            state["measuring"] = True
+            return p["spec_start_overhead_s"] + p["spec_start_cycles"] * self.scan_seconds(state)
+        if op == "spectrometer.settings":
+            state["integration_ms"] = float(args[0])
+            # While measuring, completes when scans resume with the new settings
+            scan = self.scan_seconds(state) if state["measuring"] else 0.0
+            return p["spec_start_overhead_s"] + scan
+        if op == "spectrometer.save":
+            return p["spec_save_s"]
+        if op == "spectrometer.stop":
+            state["measuring"] = False
+            return p["spec_stop_s"]
+        if op == "temp.setpoint":
+            # The command returns at once; the plate reaches the setpoint at temp_ready_s
+            self._settle_temperature(state)
+            target = float(args[0])
+            ramp = abs(target - state["temp_C"]) / p["temp_ramp_C_per_s"]
+            state["temp_setpoint_C"] = target
+            state["temp_ready_s"] = state["t"] + p["temp_command_s"] + ramp
+            return p["temp_command_s"]
+        if op == "temp.wait_stable":
+            # Done once the plate has stayed within tolerance for a whole window
+            tolerance, window, timeout = args
+            remaining = 0.0
+            if state["temp_setpoint_C"] is not None:
+                within = state["temp_ready_s"] - tolerance / p["temp_ramp_C_per_s"]
+                remaining = max(within - state["t"], 0.0)
+            return min(remaining + window, timeout)
+        if op.startswith("temp."):
+            self._settle_temperature(state)
+            state["temp_setpoint_C"] = None
+            return p["temp_command_s"]
+        if op.startswith("data."):
+            return p["data_command_s"]
+        if op == "camera.capture":
+            return p["camera_capture_s"]
+        return 0.0
+
+    def _settle_temperature(self, state: dict):
+        """Plate temperature at state['t'] while ramping toward the setpoint"""
+        target = state["temp_setpoint_C"]
+        if target is None:
+            return
+        remaining = max(state["temp_ready_s"] - state["t"], 0.0)
+        direction = 1 if target > state["temp_C"] else -1
+        state["temp_C"] = target - direction * remaining * self.params["temp_ramp_C_per_s"]
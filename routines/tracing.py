@@ -0,0 +1,241 @@
+"""
+Per-command execution tracing for routines
+
+RoutineTracer records, for every command a RoutineWorker runs, when it was
+issued, when it completed and how it ended (ok, failed, timeout, stopped),
+plus the waits between commands. A finished trace can be
+
+  * summarised as latency histograms per command type, with motor moves
+    bucketed by distance (LatencyHistograms), and
+  * exported as a Chrome trace / Perfetto JSON timeline with one track per
+    device (open in https://ui.perfetto.dev or chrome://tracing).
+
+Saved traces (logs/routine_trace_*.json) can be summarised and converted later:
+
+    python -m routines.tracing logs/routine_trace_*.json --perfetto run.trace.json
+"""
+import sys
+import json
+import bisect
+import argparse
+
+from routines.compiler import device_of
+
+# Histogram bin upper edges (ms); the last bin is open-ended
+LATENCY_EDGES_MS = (10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+# Motor move distance buckets (deg): a move is costed by how far it goes
+MOTOR_DISTANCE_EDGES = (1, 10, 45, 90)
+
+OUTCOMES = ("ok", "failed", "timeout", "stopped")
+
+# Perfetto track order
+_TRACKS = ("routine", "motor", "filter", "spectrometer", "temp", "data", "camera", "log")
+
+
+def motor_bucket(distance: float) -> str:
+    """'motor.move 10-45deg' style label for a move of distance degrees"""
+    low = 0
+    for edge in MOTOR_DISTANCE_EDGES:
+        if distance < edge:
+            return f"motor.move {low}-{edge}deg"
+        low = edge
+    return f"motor.move >{low}deg"
+
+
+def category(record: dict) -> str:
+    """Histogram key of a trace record"""
+    op = record["op"]
+    if op in ("motor.move", "motor.home") and record.get("distance") is not None:
+        return motor_bucket(record["distance"])
+    if op == "spectrometer.start":
+        return "spectrometer.acquire"
+    if op in ("filter.position", "filter.home"):
+        return "filter.change"
+    return op
+
+
+class Histogram:
+    """Fixed-bin latency histogram with exact count, mean, min and max"""
+
+    def __init__(self, edges=LATENCY_EDGES_MS):
+        self.edges = tuple(edges)
+        self.counts = [0] * (len(self.edges) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, ms: float):
+        self.counts[bisect.bisect_left(self.edges, ms)] += 1
+        self.n += 1
+        self.total += ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.n if self.n else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Upper edge of the bin holding the q-th percentile (max for the open bin)"""
+        if not self.n:
+            return 0.0
+        target = q / 100 * self.n
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                return min(self.edges[i], self.max) if i < len(self.edges) else self.max
+        return self.max
+
+    def bins(self) -> list:
+        """[(label, count)] for the non-empty bins"""
+        labels = [f"<{e}" for e in self.edges] + [f">={self.edges[-1]}"]
+        return [(label, count) for label, count in zip(labels, self.counts) if count]
+
+
+class LatencyHistograms:
+    """Latency histograms and outcome counts per command category"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.outcomes = {}
+
+    def add(self, record: dict):
+        key = category(record)
+        outcomes = self.outcomes.setdefault(key, dict.fromkeys(OUTCOMES, 0))
+        outcomes[record.get("outcome", "ok" if record.get("ok", True) else "failed")] += 1
+        if record.get("duration") is not None and record.get("outcome", "ok") == "ok":
+            self.histograms.setdefault(key, Histogram()).add(record["duration"] * 1000)
+
+    def add_all(self, records):
+        for record in records:
+            self.add(record)
+
+    def summary(self) -> list:
+        """One line per category: count, mean, p50/p95, max and failures"""
+        lines = []
+        for key in sorted(set(self.histograms) | set(self.outcomes)):
+            h = self.histograms.get(key, Histogram())
+            bad = {k: v for k, v in self.outcomes.get(key, {}).items() if k != "ok" and v}
+            line = (f"{key}: n={h.n} mean={h.mean:.0f} ms p50<={h.percentile(50):.0f} ms "
+                    f"p95<={h.percentile(95):.0f} ms max={h.max or 0:.0f} ms")
+            if bad:
+                line += " " + " ".join(f"{k}={v}" for k, v in bad.items())
+            lines.append(line)
+        return lines
+
+    def to_dict(self) -> dict:
+        return {key: {"edges_ms": list(h.edges), "counts": h.counts, "n": h.n,
+                      "mean_ms": h.mean, "min_ms": h.min, "max_ms": h.max,
+                      "outcomes": self.outcomes.get(key, {})}
+                for key, h in self.histograms.items()}
+
+
+class RoutineTracer:
+    """
+    Records issue/completion times (time.monotonic()) and outcomes of a run.
+    Written by the worker thread only; read after the run has finished.
+    """
+
+    def __init__(self, start: float, motor_angle: float = None):
+        self.start = start
+        self.commands = []   # one record per command (see command())
+        self.waits = []      # (start, end, line, text)
+        self.blocks = []     # parallel blocks: (start, end, line)
+        self._motor_angle = motor_angle
+
+    def command(self, instr, issued: float, completed, outcome: str, message: str = ""):
+        record = {
+            "op": instr.op, "args": list(instr.args), "line": instr.line, "text": instr.text,
+            "device": device_of(instr),
+            "start": round(issued - self.start, 6),
+            "duration": round(completed - issued, 6) if completed is not None else None,
+            "ok": outcome == "ok",
+            "outcome": outcome,
+        }
+        if instr.op in ("motor.move", "motor.home"):
+            target = instr.args[0] if instr.op == "motor.move" else 0.0
+            if self._motor_angle is not None:
+                record["distance"] = abs(target - self._motor_angle)
+            # Where the motor ended up after a failed, timed-out or stopped move is unknown
+            self._motor_angle = target if outcome == "ok" else None
+        if message:
+            record["message"] = message
+        self.commands.append(record)
+        return record
+
+    def wait(self, instr, start: float, end: float):
+        if end > start:
+            self.waits.append((start - self.start, end - self.start, instr.line, instr.text))
+
+    def block(self, line: int, start: float, end: float):
+        self.blocks.append((start - self.start, end - self.start, line))
+
+    def histograms(self) -> LatencyHistograms:
+        h = LatencyHistograms()
+        h.add_all(self.commands)
+        return h
+
+    def to_dict(self) -> dict:
+        return {"commands": self.commands,
+                "waits": [list(w) for w in self.waits],
+                "blocks": [list(b) for b in self.blocks]}
+
+
+def perfetto_trace(trace: dict, name: str = "routine") -> dict:
+    """Chrome trace event JSON (one track per device) for a saved or live trace dict"""
+    tids = {track: i + 1 for i, track in enumerate(_TRACKS)}
+    us = lambda seconds: round(seconds * 1e6)
+    events = [{"ph": "M", "pid": 1, "name": "process_name", "args": {"name": name}}]
+    for track, tid in tids.items():
+        events.append({"ph": "M", "pid": 1, "tid": tid, "name": "thread_name", "args": {"name": track}})
+        events.append({"ph": "M", "pid": 1, "tid": tid, "name": "thread_sort_index", "args": {"sort_index": tid}})
+
+    for rec in trace.get("commands", []):
+        tid = tids.get(rec.get("device") or rec["op"].split(".")[0], tids["routine"])
+        args = {"line": rec.get("line"), "outcome": rec.get("outcome", "ok" if rec.get("ok", True) else "failed")}
+        for key in ("distance", "message"):
+            if key in rec:
+                args[key] = rec[key]
+        if rec.get("duration") is None:
+            # Never completed: mark where it was issued
+            events.append({"ph": "i", "s": "t", "pid": 1, "tid": tid, "ts": us(rec["start"]),
+                           "name": f"{rec['text']} ({args['outcome']})", "cat": rec["op"], "args": args})
+            continue
+        events.append({"ph": "X", "pid": 1, "tid": tid, "ts": us(rec["start"]), "dur": us(rec["duration"]),
+                       "name": rec["text"], "cat": rec["op"], "args": args})
+    for start, end, line, text in trace.get("waits", []):
+        events.append({"ph": "X", "pid": 1, "tid": tids["routine"], "ts": us(start), "dur": us(end - start),
+                       "name": text, "cat": "wait", "args": {"line": line}})
+    for start, end, line in trace.get("blocks", []):
+        events.append({"ph": "X", "pid": 1, "tid": tids["routine"], "ts": us(start), "dur": us(end - start),
+                       "name": "parallel", "cat": "parallel", "args": {"line": line}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latency histograms and Perfetto timelines from routine traces")
+    parser.add_argument("traces", nargs="+", help="routine_trace_*.json files")
+    parser.add_argument("--perfetto", metavar="PATH", help="write the first trace as Chrome/Perfetto JSON")
+    args = parser.parse_args(argv)
+
+    histograms = LatencyHistograms()
+    docs = []
+    for path in args.traces:
+        with open(path, "r", encoding="utf-8") as f:
+            doc = json.load(f)
+        docs.append(doc)
+        histograms.add_all(doc.get("commands", []))
+    for line in histograms.summary():
+        print(line)
+    if args.perfetto:
+        with open(args.perfetto, "w", encoding="utf-8") as f:
+            json.dump(perfetto_trace(docs[0], docs[0].get("routine", "routine")), f)
+        print(f"wrote {args.perfetto}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
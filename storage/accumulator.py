@@ -0,0 +1,61 @@
+"""
+Streaming per-segment accumulators for averaging spectra
+
+A segment is a run of consecutive scans taken with the same hardware state
+(motor angle, filter position, integration time). Its statistics are kept as
+running per-pixel values, so memory does not grow with the number of scans.
+Mean and variance use Welford's update: a sum of squares minus the squared
+mean cancels catastrophically at 60000-count pixel levels.
+"""
+import numpy as np
+
+
+class SegmentAccumulator:
+    """Running mean, sum of squared deviations (M2), count, min and max per pixel for one segment"""
+
+    def __init__(self, key, npix: int):
+        self.key = key
+        self.npix = npix
+        self.count = 0
+        self._mean = np.zeros(npix, dtype=np.float64)
+        self._m2 = np.zeros(npix, dtype=np.float64)
+        self.min = np.full(npix, np.inf)
+        self.max = np.full(npix, -np.inf)
+        self.first_time = None
+        self.last_time = None
+        self.first_seq = None
+        self.last_seq = None
+        self.housekeeping = None
+
+    def add(self, intens, timestamp=None, seq=None, housekeeping=None):
+        """Fold one scan into the running statistics"""
+        x = np.asarray(intens, dtype=np.float64)
+        if len(x) != self.npix:
+            # Pad/truncate so a stray short scan cannot break the segment
+            y = np.zeros(self.npix)
+            n = min(self.npix, len(x))
+            y[:n] = x[:n]
+            x = y
+        self.count += 1
+        delta = x - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (x - self._mean)
+        np.minimum(self.min, x, out=self.min)
+        np.maximum(self.max, x, out=self.max)
+
+        if self.first_time is None:
+            self.first_time = timestamp
+            self.first_seq = seq
+        self.last_time = timestamp
+        self.last_seq = seq
+        if housekeeping is not None:
+            self.housekeeping = housekeeping
+
+    def mean(self) -> np.ndarray:
+        return self._mean.copy()
+
+    def std(self) -> np.ndarray:
+        """Population standard deviation per pixel"""
+        if self.count < 2:
+            return np.zeros(self.npix)
+        return np.sqrt(self._m2 / self.count)
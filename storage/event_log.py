@@ -0,0 +1,234 @@
+"""
+Structured, buffered JSON-lines event log
+
+Status messages from all controllers are queued in memory by the emitting
+thread and written in batches by a background writer thread, one JSON object
+per line:
+
+    {"seq": 12, "t": 1747662467.123, "mono": 8812.402, "level": "INFO",
+     "source": "motor", "msg": "Motor moved to 90 deg"}
+
+"t" is wall-clock epoch seconds, "mono" is time.monotonic() (immune to clock
+steps, so event ordering and intervals stay exact). Files rotate by size into
+<stem>_NNN.jsonl segments with a session index (storage.rotation).
+
+Query from the command line:
+
+    python -m storage.event_log logs --level WARNING --source motor --grep timeout
+    python -m storage.event_log logs/events_20250519_153747.index.json --since "2025-05-19 15:40"
+"""
+import os
+import sys
+import glob
+import json
+import time
+import queue
+import argparse
+import datetime
+import threading
+
+from storage.rotation import SessionIndex, RotatingSegmentFile
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+
+def classify(message: str) -> str:
+    """Severity of a free-text status message"""
+    text = message.lower()
+    if "error" in text or "fail" in text or "exception" in text:
+        return "ERROR"
+    if "warn" in text or "timeout" in text or "missed" in text:
+        return "WARNING"
+    return "INFO"
+
+
+class EventLog:
+    """Queue-fed JSON-lines writer; log() never touches the disk"""
+
+    def __init__(self, directory: str, max_bytes: int = 16 * 1024 * 1024,
+                 flush_interval: float = 0.5, max_batch: int = 1000):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = queue.SimpleQueue()
+        self._seq = 0
+        self._seq_lock = threading.Lock()
+        self.error = None       # last write failure, None while writes succeed
+        self.lost = 0           # events dropped because their batch could not be written
+
+        ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.index = SessionIndex(directory, f"events_{ts}")
+        self.index.meta = {"format": "jsonl", "levels": list(LEVELS)}
+        self.file = RotatingSegmentFile(self.index, "events", directory, f"events_{ts}", ".jsonl",
+                                        max_bytes=max_bytes)
+        self.index.save()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self._thread.start()
+
+    @property
+    def index_path(self) -> str:
+        return self.index.path
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+    def log(self, message: str, level: str = None, source: str = "app", **fields) -> int:
+        """Queue one event; returns its sequence number"""
+        with self._seq_lock:
+            self._seq += 1
+            seq = self._seq
+        event = {
+            "seq": seq,
+            "t": round(time.time(), 6),
+            "mono": round(time.monotonic(), 6),
+            "level": level or classify(message),
+            "source": source,
+            "msg": message,
+        }
+        if fields:
+            event.update(fields)
+        self._queue.put(event)
+        return seq
+
+    # -------------  Writer thread  -------------------------------------
+
+    def _drain(self, first=None) -> list:
+        batch = [] if first is None else [first]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: list):
+        if not batch:
+            return
+        data = "".join(json.dumps(e, ensure_ascii=False, default=str) + "\n" for e in batch)
+        self.file.write(data, timestamp=datetime.datetime.fromtimestamp(batch[-1]["t"]),
+                        records=len(batch))
+        self.file.flush()
+
+    def _write_batch(self, batch: list):
+        """_write() that never raises: a failure is reported once and its batch dropped"""
+        try:
+            self._write(batch)
+        except Exception as e:
+            self.lost += len(batch)
+            if self.error is None:
+                print(f"Event log: write failed, dropping events until it recovers: {e!r}", file=sys.stderr)
+            self.error = e
+            return
+        if self.error is not None:
+            print(f"Event log: writing again ({self.lost} events lost)", file=sys.stderr)
+            self.error = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            # Let a burst accumulate so it costs one write instead of one per message
+            time.sleep(min(self.flush_interval, 0.05))
+            self._write_batch(self._drain(first))
+
+    def close(self):
+        """Stop the writer and write whatever is still queued"""
+        if self.file.closed:
+            return
+        self._stop.set()
+        self._thread.join(timeout=2 * self.flush_interval + 1)
+        batch = self._drain()
+        while batch:
+            self._write_batch(batch)
+            batch = self._drain()
+        self.file.close()
+
+
+# -------------  Query  ------------------------------------------------
+
+def _segment_paths(path: str) -> list:
+    """Event files behind a directory, an index file or a single .jsonl file"""
+    if os.path.isdir(path):
+        paths = []
+        for index_path in sorted(glob.glob(os.path.join(path, "events_*.index.json"))):
+            paths += _segment_paths(index_path)
+        return paths
+    if path.endswith(".index.json"):
+        index = SessionIndex.load(path)
+        return [os.path.join(index.directory, seg["file"]) for seg in index.segments("events")]
+    return [path]
+
+
+def query(paths, level: str = None, sources=None, grep: str = None,
+          since=None, until=None, seq_from: int = None):
+    """Yield events matching every given filter"""
+    min_level = LEVELS.get(level.upper(), 0) if level else 0
+    sources = set(sources) if sources else None
+    since = since.timestamp() if isinstance(since, datetime.datetime) else since
+    until = until.timestamp() if isinstance(until, datetime.datetime) else until
+    needle = grep.lower() if grep else None
+
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                # Cheap text test before paying for json.loads
+                if needle and needle not in line.lower():
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue  # partial last line of a segment still being written
+                if min_level and LEVELS.get(event.get("level"), 0) < min_level:
+                    continue
+                if sources and event.get("source") not in sources:
+                    continue
+                if since is not None and event.get("t", 0) < since:
+                    continue
+                if until is not None and event.get("t", 0) >= until:
+                    continue
+                if seq_from is not None and event.get("seq", 0) < seq_from:
+                    continue
+                if needle and needle not in event.get("msg", "").lower():
+                    continue
+                yield event
+
+
+def _parse_time(text: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Filter JSON-lines event logs")
+    parser.add_argument("paths", nargs="+", help="log directory, events_*.index.json or .jsonl files")
+    parser.add_argument("--level", help="minimum severity (DEBUG, INFO, WARNING, ERROR)")
+    parser.add_argument("--source", action="append", help="source controller (repeatable)")
+    parser.add_argument("--grep", help="case-insensitive text in the message")
+    parser.add_argument("--since", type=_parse_time, help="ISO time, inclusive")
+    parser.add_argument("--until", type=_parse_time, help="ISO time, exclusive")
+    parser.add_argument("--seq-from", type=int, help="first sequence number")
+    parser.add_argument("--json", action="store_true", help="print raw JSON lines")
+    args = parser.parse_args(argv)
+
+    paths = []
+    for p in args.paths:
+        paths += _segment_paths(p)
+    count = 0
+    for event in query(paths, args.level, args.source, args.grep, args.since, args.until, args.seq_from):
+        if args.json:
+            print(json.dumps(event, ensure_ascii=False))
+        else:
+            stamp = datetime.datetime.fromtimestamp(event["t"]).isoformat(sep=" ", timespec="milliseconds")
+            print(f"{stamp} [{event['level']}] {event['source']}: {event['msg']}")
+        count += 1
+    print(f"{count} events", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Fixed-size binary scan records and a memory-mapped reader for recorded sessions
+
+Every scan row the DataLogger writes to CSV is mirrored as one record in the
+session's "records" stream (<session>_NNN.rec). A record is a NumPy
+structured value: the UNIX timestamp, one float64 per numeric housekeeping
+column, and (for "text" sessions) the spectrum as float32. The record layout
+is stored in the session index, so a reader can memory-map every segment and
+hand out views without parsing text. Packed sessions keep the spectra in the
+compressed block store (storage.spectral_codec) instead; the reader decodes
+only the blocks a slice touches.
+
+    reader = SessionReader("data/Scans_SO_20250519_153747.index.json")
+    hour = reader.slice_time(t0, t0 + 3600, columns=["MotorAngle_deg"])
+    hour["Spectrum"]        # (n, npix) float32 view into the mapped file
+"""
+import os
+import bisect
+import datetime
+import numpy as np
+
+from storage.rotation import SessionIndex
+from storage.spectral_codec import SpectralBlockReader
+
+TIMESTAMP_FIELD = "Timestamp"
+SPECTRUM_FIELD = "Spectrum"
+
+
+def record_dtype(columns, npix: int) -> np.dtype:
+    """Record layout: timestamp, numeric housekeeping columns, then the spectrum (if npix)"""
+    fields = [(TIMESTAMP_FIELD, "<f8")]
+    fields += [(name, "<f8") for name in columns]
+    if npix:
+        fields.append((SPECTRUM_FIELD, "<f4", (npix,)))
+    return np.dtype(fields)
+
+
+def dtype_to_meta(dtype: np.dtype) -> list:
+    """JSON-friendly description of a record dtype (for the session index)"""
+    meta = []
+    for name in dtype.names:
+        base, shape = dtype.fields[name][0].base, dtype.fields[name][0].shape
+        meta.append([name, base.str, list(shape)])
+    return meta
+
+
+def dtype_from_meta(meta: list) -> np.dtype:
+    return np.dtype([(name, typ, tuple(shape)) if shape else (name, typ)
+                     for name, typ, shape in meta])
+
+
+def to_epoch(t) -> float:
+    """Accept a datetime (naive = local time), numpy datetime64 or epoch seconds"""
+    if isinstance(t, datetime.datetime):
+        return t.timestamp()
+    if isinstance(t, np.datetime64):
+        return t.astype("datetime64[us]").astype(np.int64) / 1e6
+    return float(t)
+
+
+class SessionReader:
+    """Random-access, memory-mapped view over a session's binary record segments"""
+
+    def __init__(self, index_path: str, stream: str = "records"):
+        self.index = SessionIndex.load(index_path)
+        meta = self.index.meta.get(f"{stream}_dtype")
+        if meta is None:
+            raise ValueError(f"Session {self.index.session_name} has no '{stream}' stream")
+        self.dtype = dtype_from_meta(meta)
+        self.stream = stream
+
+        # Record counts come from the file sizes, so a segment that was still
+        # being written when the index was last saved is read in full
+        self._paths = []
+        self._counts = []
+        for seg in self.index.segments(stream):
+            path = os.path.join(self.index.directory, seg["file"])
+            if not os.path.exists(path):
+                continue
+            count = os.path.getsize(path) // self.dtype.itemsize
+            if count:
+                self._paths.append(path)
+                self._counts.append(count)
+        self._offsets = np.concatenate([[0], np.cumsum(self._counts, dtype=np.int64)])
+        self._maps = [None] * len(self._paths)
+        self._first_times = [self._segment(i)[TIMESTAMP_FIELD][0] for i in range(len(self._paths))]
+
+        # Spectra kept in the compressed block store rather than in the records
+        self._blocks = None
+        spectra_meta = self.index.meta.get("spectra")
+        if spectra_meta and stream == "records" and SPECTRUM_FIELD not in self.dtype.names:
+            self._blocks = SpectralBlockReader(self.index.directory, self.index.segments("spectra"),
+                                               spectra_meta["block_index"], self.npix)
+
+    # -------------  Segment access  ------------------------------------
+
+    def _segment(self, i: int) -> np.memmap:
+        if self._maps[i] is None:
+            self._maps[i] = np.memmap(self._paths[i], dtype=self.dtype, mode="r",
+                                      shape=(self._counts[i],))
+        return self._maps[i]
+
+    def _locate(self, record: int):
+        """Global record number -> (segment, local record number)"""
+        seg = int(np.searchsorted(self._offsets, record, side="right")) - 1
+        seg = min(max(seg, 0), len(self._counts) - 1)
+        return seg, record - int(self._offsets[seg])
+
+    # -------------  Public API  ----------------------------------------
+
+    def __len__(self) -> int:
+        return int(self._offsets[-1])
+
+    @property
+    def columns(self) -> list:
+        """Housekeeping column names available for selection"""
+        return [n for n in self.dtype.names if n not in (TIMESTAMP_FIELD, SPECTRUM_FIELD)]
+
+    @property
+    def npix(self) -> int:
+        if SPECTRUM_FIELD in self.dtype.names:
+            return self.dtype.fields[SPECTRUM_FIELD][0].shape[0]
+        return int(self.index.meta.get("npix", 0))
+
+    def time_range(self):
+        """(first, last) timestamp in epoch seconds"""
+        if not len(self):
+            return None, None
+        last = self._segment(len(self._counts) - 1)
+        return float(self._first_times[0]), float(last[TIMESTAMP_FIELD][-1])
+
+    def index_of_time(self, t, side: str = "left") -> int:
+        """Global record number of the first record at/after t (binary search)"""
+        t = to_epoch(t)
+        if not len(self):
+            return 0
+        seg = max(bisect.bisect_right(self._first_times, t) - 1, 0)
+        local = int(np.searchsorted(self._segment(seg)[TIMESTAMP_FIELD], t, side=side))
+        return int(self._offsets[seg]) + local
+
+    def iter_records(self, start: int = 0, stop: int = None):
+        """Yield per-segment structured views covering records [start, stop)"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = max(start, 0)
+        while start < stop:
+            seg, local = self._locate(start)
+            take = min(stop - start, self._counts[seg] - local)
+            yield self._segment(seg)[local:local + take]
+            start += take
+
+    def records(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """
+        Structured records [start, stop). Returns a view into the mapped file
+        when the range lies within one segment, a concatenated copy otherwise.
+        """
+        parts = list(self.iter_records(start, stop))
+        if not parts:
+            return np.empty(0, dtype=self.dtype)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    def slice_records(self, start: int, stop: int, columns=None, spectra: bool = True) -> dict:
+        """Selected columns for a record range as {name: array}"""
+        recs = self.records(start, stop)
+        names = [TIMESTAMP_FIELD] + (self.columns if columns is None else list(columns))
+        result = {name: recs[name] for name in names}
+        if spectra:
+            result[SPECTRUM_FIELD] = self.spectra(start, stop)
+        return result
+
+    def slice_time(self, t0, t1, columns=None, spectra: bool = True) -> dict:
+        """Selected columns for records with t0 <= Timestamp < t1"""
+        return self.slice_records(self.index_of_time(t0), self.index_of_time(t1),
+                                  columns=columns, spectra=spectra)
+
+    def spectra(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """Spectra for records [start, stop) (decoded copies for packed sessions)"""
+        if self._blocks is not None:
+            stop = len(self) if stop is None else min(stop, len(self))
+            return self._blocks.read(max(start, 0), stop)
+        return self.records(start, stop)[SPECTRUM_FIELD]
+
+    def timestamps(self, start: int = 0, stop: int = None) -> np.ndarray:
+        return self.records(start, stop)[TIMESTAMP_FIELD]
+
+    def close(self):
+        """Drop the memory maps (the OS unmaps once views are released)"""
+        self._maps = [None] * len(self._paths)
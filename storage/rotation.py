@@ -0,0 +1,186 @@
+"""
+Size- and time-based rotation of session files with a per-session index
+"""
+import os
+import json
+import datetime
+
+
+class SessionIndex:
+    """Small JSON index describing every segment written during a session"""
+
+    def __init__(self, directory: str, session_name: str):
+        self.directory = directory
+        self.session_name = session_name
+        self.path = os.path.join(directory, f"{session_name}.index.json")
+        self.created = datetime.datetime.now().isoformat(timespec="seconds")
+        self.streams = {}
+        self.meta = {}
+
+    def segments(self, stream: str) -> list:
+        return self.streams.setdefault(stream, [])
+
+    def save(self):
+        """Rewrite the index atomically (write to temp file, then replace)"""
+        doc = {
+            "session": self.session_name,
+            "created": self.created,
+            "meta": self.meta,
+            "streams": self.streams,
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    @classmethod
+    def load(cls, path: str) -> "SessionIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            doc = json.load(f)
+        index = cls(os.path.dirname(path), doc["session"])
+        index.created = doc.get("created", index.created)
+        index.meta = doc.get("meta", {})
+        index.streams = doc.get("streams", {})
+        return index
+
+
+class RotatingSegmentFile:
+    """
+    File-like writer that rolls over into numbered segments
+    (<stem>_001<suffix>, <stem>_002<suffix>, ...) once a segment exceeds
+    max_bytes or the wall-clock hour changes. The next segment is opened
+    ahead of time so a rollover never waits on the filesystem.
+    """
+
+    def __init__(self, index: SessionIndex, stream: str, directory: str, stem: str, suffix: str,
+                 max_bytes: int = 0, rotate_hourly: bool = False, header: str = "",
+                 binary: bool = False):
+        self.index = index
+        self.stream = stream
+        self.directory = directory
+        self.stem = stem
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.rotate_hourly = rotate_hourly
+        self.header = header
+        self.binary = binary
+
+        self._file = None
+        self._spare = None
+        self._entry = None
+        self._bytes = 0
+        self._hour = None
+        self._number = len(index.segments(stream))
+        self._open_next()
+
+    # -------------  Segment handling  ----------------------------------
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{self.stem}_{number:03d}{self.suffix}")
+
+    def _open_file(self, number: int):
+        path = self._segment_path(number)
+        if self.binary:
+            f = open(path, "ab")
+        else:
+            f = open(path, "a", encoding="utf-8", newline="")
+        if self.header and f.tell() == 0:
+            f.write(self.header)
+        return f
+
+    def _open_next(self):
+        """Promote the pre-opened spare to the active segment and open a new spare"""
+        if self._spare is None:
+            self._spare = self._open_file(self._number + 1)
+        self._file, self._spare = self._spare, None
+        self._number += 1
+        self._bytes = len(self.header)
+        self._hour = None
+        self._entry = {
+            "file": os.path.relpath(self._segment_path(self._number), self.index.directory),
+            "start": None,
+            "end": None,
+            "records": 0,
+            "bytes": self._bytes,
+        }
+        self.index.segments(self.stream).append(self._entry)
+        self._spare = self._open_file(self._number + 1)
+
+    def _needs_rotation(self, timestamp) -> bool:
+        if self._entry["records"] == 0:
+            return False
+        if self.max_bytes and self._bytes >= self.max_bytes:
+            return True
+        if self.rotate_hourly and timestamp is not None:
+            return timestamp.replace(minute=0, second=0, microsecond=0) != self._hour
+        return False
+
+    def rotate(self):
+        """Close the active segment and continue in the pre-opened one"""
+        self._file.close()
+        self._open_next()
+        self.index.save()
+
+    # -------------  File-like API  -------------------------------------
+
+    @property
+    def path(self) -> str:
+        return self._segment_path(self._number)
+
+    @property
+    def number(self) -> int:
+        """Number of the active segment (1-based)"""
+        return self._number
+
+    @property
+    def size(self) -> int:
+        """Bytes written to the active segment, i.e. the offset of the next write"""
+        return self._bytes
+
+    def rollover_if_due(self, timestamp=None):
+        """Rotate now if the next record would go to a new segment"""
+        if timestamp is None:
+            timestamp = datetime.datetime.now()
+        if self._needs_rotation(timestamp):
+            self.rotate()
+        return timestamp
+
+    def write(self, data, timestamp=None, records: int = 1):
+        """Write one or more records, rolling over to a new segment first if due"""
+        timestamp = self.rollover_if_due(timestamp)
+
+        self._file.write(data)
+        self._bytes += len(data)
+
+        entry = self._entry
+        stamp = timestamp.isoformat(timespec="milliseconds")
+        if entry["start"] is None:
+            entry["start"] = stamp
+            self._hour = timestamp.replace(minute=0, second=0, microsecond=0)
+        entry["end"] = stamp
+        entry["records"] += records
+        entry["bytes"] = self._bytes
+
+    def flush(self, sync: bool = False):
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """Close the active segment and discard the unused spare"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._spare is not None:
+            spare_path = self._spare.name
+            self._spare.close()
+            self._spare = None
+            try:
+                os.remove(spare_path)
+            except OSError:
+                pass
+        self.index.save()
+
+    @property
+    def closed(self) -> bool:
+        return self._file is None
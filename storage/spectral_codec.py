@@ -0,0 +1,255 @@
+"""
+Integer-count compressed spectral storage
+
+Spectra are stored as blocks of consecutive scans. Within a block the
+intensities are converted to integer counts with a fixed-point scale
+(1 for raw ADC counts, the number of averaged scans for averaged data, which
+makes the conversion lossless), delta-encoded against the previous scan and
+compressed with a stdlib codec. Compression runs in a thread pool; blocks are
+written in order to rotating <session>_NNN.spz segments, and a small
+<session>.spx table of per-block offsets keeps random access cheap.
+
+Blocks that cannot be represented exactly as scaled counts are stored as
+compressed float32 instead. Scan numbers need not be contiguous: a resumed
+session continues after the scans lost in the interruption, and those read
+back as NaN.
+"""
+import os
+import lzma
+import zlib
+import struct
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+BLOCK_MAGIC = b"SPZB"
+# magic, kind, delta element width, codec, n_scans, npix, scale, payload length
+BLOCK_HEADER = struct.Struct("<4sBBBxIIdI")
+
+KIND_DELTA_UINT16 = 0
+KIND_DELTA_UINT32 = 1
+KIND_FLOAT32 = 2
+
+CODECS = {"zlib": 0, "lzma": 1}
+_CODEC_NAMES = {v: k for k, v in CODECS.items()}
+
+# One entry per block in the <session>.spx offset table
+BLOCK_INDEX_DTYPE = np.dtype([
+    ("segment", "<u4"),
+    ("n_scans", "<u4"),
+    ("offset", "<u8"),
+    ("length", "<u8"),
+    ("first_scan", "<u8"),
+])
+
+# Tolerance when checking that value * scale is an integer count
+_EXACT_ATOL = 1e-6
+
+
+def to_counts(spectra: np.ndarray, scale: int):
+    """Scaled integer counts, or None if the block is not exactly representable"""
+    scaled = np.asarray(spectra, dtype=np.float64) * scale
+    counts = np.rint(scaled)
+    if counts.min(initial=0) < 0 or not np.allclose(counts, scaled, rtol=0, atol=_EXACT_ATOL * scale):
+        return None
+    if counts.max(initial=0) <= 0xFFFF:
+        return counts.astype(np.uint16)
+    if counts.max() <= 0xFFFFFFFF:
+        return counts.astype(np.uint32)
+    return None
+
+
+def _compress(data: bytes, codec: str, level: int) -> bytes:
+    if codec == "lzma":
+        return lzma.compress(data, preset=level)
+    return zlib.compress(data, level)
+
+
+def _decompress(data: bytes, codec_id: int) -> bytes:
+    if _CODEC_NAMES[codec_id] == "lzma":
+        return lzma.decompress(data)
+    return zlib.decompress(data)
+
+
+def encode_block(spectra: np.ndarray, scale: int = 1, codec: str = "zlib", level: int = 6) -> bytes:
+    """Encode an (n_scans, npix) block into one self-describing byte string"""
+    spectra = np.atleast_2d(spectra)
+    n_scans, npix = spectra.shape
+    counts = to_counts(spectra, scale)
+
+    if counts is None:
+        kind, width = KIND_FLOAT32, 4
+        raw = np.ascontiguousarray(spectra, dtype="<f4").tobytes()
+        scale = 1
+    else:
+        kind = KIND_DELTA_UINT16 if counts.dtype == np.uint16 else KIND_DELTA_UINT32
+        # Successive scans differ little: keep the first scan, then differences
+        deltas = np.diff(counts.astype(np.int64), axis=0)
+        width, dt = 2, "<i2"
+        if deltas.size:
+            for width, dt in ((2, "<i2"), (4, "<i4"), (8, "<i8")):
+                info = np.iinfo(dt)
+                if deltas.min() >= info.min and deltas.max() <= info.max:
+                    break
+        raw = counts[0].astype(counts.dtype.newbyteorder("<")).tobytes() + deltas.astype(dt).tobytes()
+
+    payload = _compress(raw, codec, level)
+    header = BLOCK_HEADER.pack(BLOCK_MAGIC, kind, width, CODECS[codec],
+                               n_scans, npix, float(scale), len(payload))
+    return header + payload
+
+
+def decode_block(blob) -> np.ndarray:
+    """Decode a block produced by encode_block into float64 intensities"""
+    magic, kind, width, codec_id, n_scans, npix, scale, length = BLOCK_HEADER.unpack_from(blob)
+    if magic != BLOCK_MAGIC:
+        raise ValueError("Not a spectral block")
+    raw = _decompress(bytes(blob[BLOCK_HEADER.size:BLOCK_HEADER.size + length]), codec_id)
+
+    if kind == KIND_FLOAT32:
+        return np.frombuffer(raw, dtype="<f4").reshape(n_scans, npix).astype(np.float64)
+
+    first_dtype = "<u2" if kind == KIND_DELTA_UINT16 else "<u4"
+    first_len = npix * np.dtype(first_dtype).itemsize
+    counts = np.empty((n_scans, npix), dtype=np.int64)
+    counts[0] = np.frombuffer(raw[:first_len], dtype=first_dtype)
+    deltas = np.frombuffer(raw[first_len:], dtype=f"<i{width}").reshape(n_scans - 1, npix)
+    np.cumsum(deltas, axis=0, out=counts[1:])
+    counts[1:] += counts[0]
+    if scale == 1:
+        return counts.astype(np.float64)
+    return counts / scale
+
+
+class SpectralBlockWriter:
+    """Buffers scans into blocks, compresses them in a thread pool and writes them in order"""
+
+    def __init__(self, segment_file, block_index_path: str, npix: int, block_scans: int = 32,
+                 codec: str = "zlib", level: int = 6, workers: int = 2, first_scan: int = 0):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec: {codec}")
+        self.segment_file = segment_file
+        self.block_index_path = block_index_path
+        self.npix = npix
+        self.block_scans = block_scans
+        self.codec = codec
+        self.level = level
+
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="spz")
+        self._pending = collections.deque()
+        self._buffer = np.zeros((block_scans, npix), dtype=np.float64)
+        self._buffered = 0
+        self._scale = 1
+        self._block_time = None
+        self._next_scan = first_scan
+        self._index_file = open(block_index_path, "ab")
+
+    def append(self, spectrum, scale: int = 1, timestamp=None):
+        """Add one scan; scale is the fixed-point factor that makes it integral"""
+        # A block shares one scale, so a scale change starts a new block
+        if self._buffered and scale != self._scale:
+            self._submit()
+        if self._buffered == 0:
+            self._scale = scale
+            self._block_time = timestamp
+
+        row = self._buffer[self._buffered]
+        n = min(self.npix, len(spectrum))
+        row[:n] = spectrum[:n]
+        row[n:] = 0
+        self._buffered += 1
+
+        if self._buffered == self.block_scans:
+            self._submit()
+        self._write_completed(wait=False)
+
+    def _submit(self):
+        block = self._buffer[:self._buffered].copy()
+        future = self._pool.submit(encode_block, block, self._scale, self.codec, self.level)
+        self._pending.append((future, self._next_scan, self._buffered, self._block_time))
+        self._next_scan += self._buffered
+        self._buffered = 0
+
+    def _write_completed(self, wait: bool):
+        """Write finished blocks, preserving submission order"""
+        while self._pending and (wait or self._pending[0][0].done()):
+            future, first_scan, n_scans, timestamp = self._pending.popleft()
+            blob = future.result()
+            self.segment_file.rollover_if_due(timestamp)
+            entry = np.zeros(1, dtype=BLOCK_INDEX_DTYPE)
+            entry["segment"] = self.segment_file.number
+            entry["n_scans"] = n_scans
+            entry["offset"] = self.segment_file.size
+            entry["length"] = len(blob)
+            entry["first_scan"] = first_scan
+            self.segment_file.write(blob, timestamp=timestamp, records=n_scans)
+            self._index_file.write(entry.tobytes())
+            # Block first, then its index entry: after a crash every entry points at data
+            self.segment_file.flush()
+            self._index_file.flush()
+
+    @property
+    def scans_written(self) -> int:
+        return self._next_scan
+
+    def flush(self):
+        """Encode any partial block and write everything that is pending"""
+        if self._buffered:
+            self._submit()
+        self._write_completed(wait=True)
+        self.segment_file.flush()
+        self._index_file.flush()
+
+    def close(self):
+        self.flush()
+        self._pool.shutdown(wait=True)
+        self._index_file.close()
+        self.segment_file.close()
+
+
+class SpectralBlockReader:
+    """Random access to the spectra of a session through its block offset table"""
+
+    def __init__(self, directory: str, segments: list, block_index_file: str, npix: int):
+        self.directory = directory
+        self.npix = npix
+        self.segment_files = {i + 1: os.path.join(directory, seg["file"])
+                              for i, seg in enumerate(segments)}
+        index_path = os.path.join(directory, block_index_file)
+        count = os.path.getsize(index_path) // BLOCK_INDEX_DTYPE.itemsize if os.path.exists(index_path) else 0
+        self.blocks = (np.memmap(index_path, dtype=BLOCK_INDEX_DTYPE, mode="r", shape=(count,))
+                       if count else np.zeros(0, dtype=BLOCK_INDEX_DTYPE))
+        self._cache_key = None
+        self._cache = None
+
+    def __len__(self) -> int:
+        if not len(self.blocks):
+            return 0
+        last = self.blocks[-1]
+        return int(last["first_scan"]) + int(last["n_scans"])
+
+    def _block(self, i: int) -> np.ndarray:
+        if self._cache_key != i:
+            entry = self.blocks[i]
+            with open(self.segment_files[int(entry["segment"])], "rb") as f:
+                f.seek(int(entry["offset"]))
+                blob = f.read(int(entry["length"]))
+            self._cache = decode_block(blob)
+            self._cache_key = i
+        return self._cache
+
+    def read(self, start: int, stop: int) -> np.ndarray:
+        """Spectra for scans [start, stop), decoding only the blocks that overlap (NaN where missing)"""
+        spectra = np.full((max(stop - start, 0), self.npix), np.nan)
+        if start >= stop or not len(self.blocks):
+            return spectra
+        first = self.blocks["first_scan"].astype(np.int64)
+        end = first + self.blocks["n_scans"]
+        b0 = int(np.searchsorted(end, start, side="right"))
+        b1 = int(np.searchsorted(first, stop, side="left"))
+        for i in range(b0, b1):
+            block = self._block(i)
+            lo, hi = max(int(first[i]), start), min(int(end[i]), stop)
+            n = min(self.npix, block.shape[1])
+            spectra[lo - start:hi - start, :n] = block[lo - first[i]:hi - first[i], :n]
+        return spectra
@@ -0,0 +1,123 @@
+"""
+Central latest-value telemetry store shared by drivers, controllers and the data logger
+
+Each channel holds the most recent value together with the monotonic time it
+was published and a per-channel sequence number. Publishing replaces one
+immutable Sample, so readers never take a lock and never see a torn value;
+a snapshot of every channel is a single pass over a tuple.
+
+    import telemetry
+    telemetry.store.publish("motor.angle_deg", 90)
+    snap = telemetry.store.snapshot()
+    snap["motor.angle_deg"].value
+"""
+import time
+import threading
+from collections import namedtuple
+
+Sample = namedtuple("Sample", ["value", "t_mono", "seq"])
+
+# Known channels: name -> (type, unit)
+CHANNELS = {
+    "motor.angle_deg":       (float, "deg"),
+    "motor.target_deg":      (float, "deg"),
+    "motor.moving":          (int, ""),
+    "motor.zenith.angle_deg":  (float, "deg"),
+    "motor.zenith.target_deg": (float, "deg"),
+    "motor.zenith.moving":     (int, ""),
+    "filter.position":       (int, ""),
+    "imu.roll_deg":          (float, "deg"),
+    "imu.pitch_deg":         (float, "deg"),
+    "imu.yaw_deg":           (float, "deg"),
+    "imu.accel_g":           (tuple, "g"),
+    "imu.gyro_dps":          (tuple, "deg/s"),
+    "imu.mag_uT":            (tuple, "uT"),
+    "imu.pressure_hPa":      (float, "hPa"),
+    "imu.temperature_C":     (float, "C"),
+    "imu.latitude_deg":      (float, "deg"),
+    "imu.longitude_deg":     (float, "deg"),
+    "temp.current_C":        (float, "C"),
+    "temp.setpoint_C":       (float, "C"),
+    "temp.aux_C":            (float, "C"),
+    "thp.temperature_C":     (float, "C"),
+    "thp.humidity_pct":      (float, "%"),
+    "thp.pressure_hPa":      (float, "hPa"),
+    "spec.integration_time_ms": (float, "ms"),
+    "spec.averages":         (int, ""),
+    "spec.scan_seq":         (int, ""),
+}
+
+
+class Channel:
+    """One typed telemetry value; written by a single producer, read by anyone"""
+    __slots__ = ("name", "kind", "unit", "latest")
+
+    def __init__(self, name: str, kind=float, unit: str = ""):
+        self.name = name
+        self.kind = kind
+        self.unit = unit
+        self.latest = None
+
+    def publish(self, value, t_mono: float = None) -> Sample:
+        prev = self.latest
+        sample = Sample(self.kind(value), time.monotonic() if t_mono is None else t_mono,
+                        1 if prev is None else prev.seq + 1)
+        self.latest = sample  # single reference swap: readers see old or new, never a mix
+        return sample
+
+
+class TelemetryStore:
+    """Registry of channels with lock-free reads and snapshots"""
+
+    def __init__(self, channels: dict = None):
+        self._lock = threading.Lock()  # only taken to add channels
+        self._channels = {}
+        self._items = ()
+        for name, (kind, unit) in (channels or {}).items():
+            self.channel(name, kind, unit)
+
+    def channel(self, name: str, kind=float, unit: str = "") -> Channel:
+        """Get a channel, creating it on first use"""
+        ch = self._channels.get(name)
+        if ch is None:
+            with self._lock:
+                ch = self._channels.get(name)
+                if ch is None:
+                    ch = Channel(name, kind, unit)
+                    self._channels = {**self._channels, name: ch}
+                    self._items = tuple(self._channels.items())
+        return ch
+
+    def publish(self, name: str, value, t_mono: float = None) -> Sample:
+        return self.channel(name).publish(value, t_mono)
+
+    def publish_many(self, values: dict, t_mono: float = None):
+        """Publish several channels with one shared timestamp"""
+        t = time.monotonic() if t_mono is None else t_mono
+        for name, value in values.items():
+            self.channel(name).publish(value, t)
+
+    def sample(self, name: str):
+        ch = self._channels.get(name)
+        return ch.latest if ch is not None else None
+
+    def get(self, name: str, default=None):
+        """Latest value of a channel, or default if nothing was published yet"""
+        ch = self._channels.get(name)
+        sample = ch.latest if ch is not None else None
+        return default if sample is None else sample.value
+
+    def snapshot(self, names=None) -> dict:
+        """{name: Sample} for every channel that has a value (or only for names)"""
+        if names is None:
+            return {name: ch.latest for name, ch in self._items if ch.latest is not None}
+        channels = self._channels
+        return {name: channels[name].latest for name in names
+                if name in channels and channels[name].latest is not None}
+
+    def names(self) -> list:
+        return [name for name, _ in self._items]
+
+
+# Process-wide store used by all controllers
+store = TelemetryStore(CHANNELS)
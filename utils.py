@@ -3,8 +3,9 @@ from astral import LocationInfo
 from astral.sun import azimuth, elevation
 from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 
-def compute_sun_vector(lat,lon):
-    now=datetime.datetime.now(datetime.timezone.utc)
+def compute_sun_vector(lat,lon,when=None):
+    """Unit vector (east, north, up) towards the sun at when (aware datetime, default now)"""
+    now=when or datetime.datetime.now(datetime.timezone.utc)
     city=LocationInfo(latitude=lat,longitude=lon)
     az=azimuth(city.observer,now); el=elevation(city.observer,now)
     azr,elr=math.radians(az),math.radians(el)
@@ -127,14 +128,4 @@ try:
     def modbus_crc16(data: bytes) -> int:
         return libscrc.modbus(data)
 except ImportError:
-    def modbus_crc16(data: bytes) -> int:
-        crc = 0xFFFF
-        for b in data:
-            crc ^= b
-            for _ in range(8):
-                if crc & 1:
-                    crc = (crc >> 1) ^ 0xA001
-                else:
-                    crc >>= 1
-        return crc & 0xFFFF
-
+    from drivers.modbus_rtu import crc16 as modbus_crc16